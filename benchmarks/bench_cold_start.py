@@ -0,0 +1,149 @@
+"""
+Cold start of the app: ``python -X importtime -c "import main"`` and the
+time from spawning ``uvicorn main:app`` to the first 200 on /documents,
+against the stub Ollama.
+
+Fails (exit code 1) when the median import or time-to-first-200 exceeds
+its budget, or when a module that should only load on first use (PDF and
+DOCX parsers, pandas, reportlab, Chroma, langchain_community) is imported
+at startup. Run it in CI to catch import-time regressions.
+
+    python -m benchmarks.bench_cold_start --runs 5
+    python -m benchmarks.bench_cold_start --budget-import-ms 1200 --budget-ready-ms 2500 --out cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from benchmarks.run_suite import REPO_ROOT, free_port
+from benchmarks.stub_ollama import StubOllamaServer
+
+DEFERRED_MODULES = (
+    "pypdf", "docx2txt", "pandas", "reportlab", "chromadb", "langchain_community", "langchain",
+    "sentence_transformers",
+)
+
+
+def app_env(stub: StubOllamaServer) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "OLLAMA_BASE_URL": stub.base_url,
+        "CHAT_MODEL": "stub-chat",
+        "EMBEDDING_MODEL": "stub-embed",
+        "TRACE_SAMPLE_RATE": "0",
+    })
+    return env
+
+
+def import_profile(env: dict) -> tuple[float, dict]:
+    """(cumulative ms to import main, {top-level package: ms spent in its own modules})"""
+    workdir = tempfile.mkdtemp(prefix="bench_cold_start_")
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if output.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{output.stderr[-2000:]}")
+    packages: dict[str, float] = {}
+    total_ms = None
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if name == "main":
+            total_ms = int(cumulative) / 1000
+        # Self times, so a package is not also charged for what it imports from others
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0.0) + int(own) / 1000
+    return total_ms, {root: round(ms, 1) for root, ms in packages.items()}
+
+
+def time_to_first_200(env: dict, timeout: float = 120) -> float:
+    """Seconds from spawning uvicorn to the first successful GET /documents"""
+    workdir = tempfile.mkdtemp(prefix="bench_cold_start_")
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/documents", timeout=5) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            if server.poll() is not None or time.perf_counter() - start > timeout:
+                raise RuntimeError("server did not start")
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-import-ms", type=float, default=1500)
+    parser.add_argument("--budget-ready-ms", type=float, default=3000)
+    parser.add_argument("--top", type=int, default=12, help="heaviest packages to list")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub = StubOllamaServer().start()
+    try:
+        env = app_env(stub)
+        import_runs, ready_runs, packages = [], [], {}
+        for _ in range(args.runs):
+            total_ms, packages = import_profile(env)
+            import_runs.append(total_ms)
+            ready_runs.append(time_to_first_200(env) * 1000)
+    finally:
+        stub.stop()
+
+    import_ms = statistics.median(import_runs)
+    ready_ms = statistics.median(ready_runs)
+    print(f"import main: median {import_ms:.0f} ms (budget {args.budget_import_ms:.0f})")
+    print(f"first 200 on /documents: median {ready_ms:.0f} ms (budget {args.budget_ready_ms:.0f})")
+    print("heaviest packages at import (ms in their own modules, last run):")
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {ms:>8.1f}  {name}")
+
+    failures = []
+    if import_ms > args.budget_import_ms:
+        failures.append(f"import took {import_ms:.0f} ms, budget {args.budget_import_ms:.0f} ms")
+    if ready_ms > args.budget_ready_ms:
+        failures.append(f"first 200 took {ready_ms:.0f} ms, budget {args.budget_ready_ms:.0f} ms")
+    eager = sorted(name for name in DEFERRED_MODULES if name in packages)
+    if eager:
+        failures.append(f"imported at startup, should load on first use: {', '.join(eager)}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "import_ms": import_runs,
+                "ready_ms": [round(ms, 1) for ms in ready_runs],
+                "packages_ms": packages,
+                "failures": failures,
+            }, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
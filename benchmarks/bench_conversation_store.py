@@ -0,0 +1,59 @@
+"""
+Per-turn write cost as conversation history grows.
+
+Compares appending a row to ConversationStore with the old approach of
+rewriting the whole conversation JSON (indent=2) after every answer.
+
+    python -m benchmarks.bench_conversation_store --turns 2000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from models.schemas import ChatResponse, Source
+from services.conversation_store import ConversationStore
+
+
+def make_turn(i: int) -> ChatResponse:
+    return ChatResponse(
+        response=f"<think>reasoning {i}</think> Answer {i}. " * 30,
+        sources=[Source(document_name="Leica GS18 Manual.pdf", page_number=i % 300 + 1,
+                        content_snippet="Snippet ...")],
+        conversation_id="bench",
+        user_message=f"Question {i}?"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--report-every", type=int, default=500)
+    args = parser.parse_args()
+
+    turns = [make_turn(i) for i in range(args.turns)]
+    with tempfile.TemporaryDirectory() as db_directory:
+        store = ConversationStore(db_directory)
+        store.create("bench")
+        legacy_path = os.path.join(db_directory, "legacy.json")
+        legacy_messages = []
+
+        print(f"{'turn':>6} {'append ms':>10} {'rewrite ms':>11}")
+        for i, turn in enumerate(turns, start=1):
+            start = time.perf_counter()
+            store.append_message("bench", turn)
+            append_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            legacy_messages.append(turn.model_dump())
+            with open(legacy_path, "w", encoding="utf-8") as f:
+                json.dump({"id": "bench", "messages": legacy_messages}, f, indent=2, ensure_ascii=False)
+            rewrite_ms = (time.perf_counter() - start) * 1000
+
+            if i == 1 or i % args.report_every == 0:
+                print(f"{i:>6} {append_ms:>10.2f} {rewrite_ms:>11.2f}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
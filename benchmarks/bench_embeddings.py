@@ -0,0 +1,51 @@
+"""
+Measure embedding throughput against the stub Ollama server.
+
+Compares one-text-per-request (the old behaviour) with the batched,
+concurrent client at several settings.
+
+    python -m benchmarks.bench_embeddings --chunks 2000 --latency-ms 30
+"""
+import argparse
+import time
+from benchmarks.stub_ollama import StubOllamaServer
+from services.embeddings import OllamaBatchEmbeddings
+
+
+def run(server: StubOllamaServer, texts: list[str], batch_size: int, concurrency: int) -> float:
+    client = OllamaBatchEmbeddings(
+        model="stub-embed",
+        base_url=server.base_url,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        backoff_seconds=0.01
+    )
+    start = time.perf_counter()
+    vectors = client.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts)
+    return len(texts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="fixed cost per request")
+    parser.add_argument("--per-text-ms", type=float, default=1.0, help="extra cost per text in a request")
+    parser.add_argument("--fail-every", type=int, default=0, help="return 503 on every Nth request")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(latency_ms=args.latency_ms, per_text_ms=args.per_text_ms,
+                              fail_every=args.fail_every).start()
+    texts = [f"chunk {i}: the GS18 receiver tracks satellites " * 10 for i in range(args.chunks)]
+    try:
+        print(f"{'batch':>6} {'concurrency':>12} {'chunks/sec':>12}")
+        for batch_size, concurrency in [(1, 1), (16, 1), (32, 4), (64, 8)]:
+            rate = run(server, texts, batch_size, concurrency)
+            print(f"{batch_size:>6} {concurrency:>12} {rate:>12.1f}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Render a long conversation with ExportService.
+
+Times the first PDF render, the cached repeat, and streaming each text
+format, and reports peak RSS.
+
+    python -m benchmarks.bench_export --turns 2000
+"""
+import argparse
+import asyncio
+import resource
+import sys
+import tempfile
+import time
+from models.schemas import ChatResponse, Source
+from services.export_service import ExportService, STREAMING_FORMATS
+
+
+def make_conversation(turns: int) -> list[ChatResponse]:
+    return [
+        ChatResponse(
+            response=f"<think>Looking up the tilt settings.</think> Answer {i}: open Settings > TPS & GPS. " * 6,
+            sources=[Source(document_name="Leica CS20 GS07 Manual.pdf", page_number=i % 250 + 1,
+                            content_snippet="...")],
+            conversation_id="bench",
+            user_message=f"How do I configure item {i}?"
+        )
+        for i in range(turns)
+    ]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def run(turns: int):
+    messages = make_conversation(turns)
+    with tempfile.TemporaryDirectory() as export_dir:
+        service = ExportService(export_dir=export_dir)
+        for attempt in ("first", "cached"):
+            start = time.perf_counter()
+            filename = await service.export_chat_async(lambda: messages, "bench", len(messages), "pdf")
+            print(f"pdf ({attempt}): {(time.perf_counter() - start) * 1000:.0f} ms -> {filename}")
+
+        for format in STREAMING_FORMATS:
+            start = time.perf_counter()
+            size = sum(len(part.encode("utf-8")) for part in service.iter_export(messages, format))
+            print(f"{format} (streamed): {(time.perf_counter() - start) * 1000:.0f} ms, {size:,} bytes")
+        service.shutdown()
+    print(f"peak RSS: {peak_rss_mb():.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Build and query latency of the BM25 lexical index on a synthetic corpus
+of equipment-manual chunks.
+
+    python -m benchmarks.bench_lexical_index --chunks 5000 --queries 1000
+"""
+import argparse
+import random
+import statistics
+import time
+from services.lexical_index import LexicalIndex
+
+WORDS = ("receiver antenna height controller survey satellite tracking battery firmware "
+         "bluetooth radio rover base station coordinate system warranty measurement "
+         "tilt compensation calibration settings menu screen memory card").split()
+CODES = ["GS18", "GS07", "CS20", "GS16", "CS35", "772-451", "RTK-100", "AS10"]
+
+
+def make_chunk(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(150)]
+    for _ in range(rng.randint(0, 3)):
+        words.insert(rng.randrange(len(words)), rng.choice(CODES))
+    return " ".join(words)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = [make_chunk(rng) for _ in range(args.chunks)]
+    ids = [f"chunk-{i}" for i in range(args.chunks)]
+
+    index = LexicalIndex()
+    start = time.perf_counter()
+    for offset in range(0, len(texts), 128):
+        index.add(ids[offset:offset + 128], texts[offset:offset + 128],
+                  [{"page_number": i} for i in range(offset, min(offset + 128, len(texts)))])
+    build_s = time.perf_counter() - start
+    print(f"built index over {len(index)} chunks in {build_s * 1000:.0f} ms")
+
+    queries = [f"{rng.choice(CODES)} {rng.choice(WORDS)}" for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, k=20)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"query latency over {len(queries)} queries: p50 {statistics.median(latencies):.2f} ms, "
+          f"p99 {percentile(latencies, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
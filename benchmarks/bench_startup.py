@@ -0,0 +1,96 @@
+"""
+Measure ChatService startup time and resident memory with many saved
+conversations.
+
+``--legacy`` additionally opens one Chroma client per conversation, as
+the service did before the shared vector store, for comparison.
+
+    python -m benchmarks.bench_startup --conversations 1000
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (falls back to peak RSS off Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def write_conversations(db_directory: str, count: int, turns: int):
+    conversations_dir = os.path.join(db_directory, "conversations")
+    os.makedirs(conversations_dir, exist_ok=True)
+    for i in range(count):
+        conv_id = f"bench-{i:06d}"
+        messages = [
+            {
+                "response": f"Answer {t} about the CS20 controller. " * 20,
+                "sources": [{"document_name": "Leica CS20 GS07 Manual.pdf", "page_number": t + 1,
+                             "content_snippet": "Snippet text ..."}],
+                "conversation_id": conv_id,
+                "user_message": f"Question {t}?"
+            }
+            for t in range(turns)
+        ]
+        with open(os.path.join(conversations_dir, f"{conv_id}.json"), "w", encoding="utf-8") as f:
+            json.dump({"id": conv_id, "messages": messages}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    from benchmarks.stub_ollama import StubOllamaServer
+    from services.embeddings import OllamaBatchEmbeddings
+    from services.vector_store import SharedVectorStore
+    from services.chat_service import ChatService
+
+    server = StubOllamaServer().start()
+    try:
+        with tempfile.TemporaryDirectory() as db_directory:
+            write_conversations(db_directory, args.conversations, args.turns)
+            embeddings = OllamaBatchEmbeddings(model="stub-embed", base_url=server.base_url)
+
+            rss_before = rss_mb()
+            start = time.perf_counter()
+            vector_store = SharedVectorStore(db_directory, embeddings)
+            service = ChatService(db_directory=db_directory, vector_store=vector_store)
+            elapsed = time.perf_counter() - start
+            print(f"lazy store, shared vector store: ready with {args.conversations} conversations on disk in "
+                  f"{elapsed * 1000:.0f} ms, RSS +{rss_mb() - rss_before:.1f} MB")
+
+            # First access pays for loading one conversation, not all of them
+            start = time.perf_counter()
+            service.get_conversation_history("bench-000000")
+            print(f"first access of one conversation: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+            if args.legacy:
+                from langchain_community.vectorstores import Chroma
+                rss_before = rss_mb()
+                start = time.perf_counter()
+                clients = [
+                    Chroma(persist_directory=db_directory, embedding_function=embeddings)
+                    for _ in range(args.conversations)
+                ]
+                elapsed = time.perf_counter() - start
+                print(f"per-conversation Chroma: {len(clients)} clients in "
+                      f"{elapsed * 1000:.0f} ms, RSS +{rss_mb() - rss_before:.1f} MB")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare the cumulative and delta /chat streaming protocols.
+
+Reports bytes on the wire and server CPU time per answer of N tokens.
+
+    python -m benchmarks.bench_streaming --tokens 1000 --runs 20
+"""
+import argparse
+import time
+from models.schemas import ChatResponse, Source
+from services.stream_protocol import get_stream_encoder, STREAM_PROTOCOLS
+
+
+def _fake_sources(count: int = 3) -> list[Source]:
+    return [
+        Source(
+            document_name=f"Leica GS18 Manual {i}.pdf",
+            page_number=i + 1,
+            content_snippet=("Lorem ipsum dolor sit amet " * 8)[:200] + "..."
+        )
+        for i in range(count)
+    ]
+
+
+def _fake_tokens(count: int) -> list[str]:
+    words = ["<think>", "the", " receiver", " antenna", " height", " is", " measured", "</think>", "\n"]
+    return [words[i % len(words)] + " " for i in range(count)]
+
+
+def run_once(protocol: str, tokens: list[str], sources: list[Source]) -> tuple[int, float]:
+    start = time.process_time()
+    encoder = get_stream_encoder(protocol, sources, "bench-conversation", "What is the antenna height?")
+    total_bytes = len(encoder.start("<think>Analyzing...</think>\n").encode("utf-8"))
+    for token in tokens:
+        total_bytes += len(encoder.token(token).encode("utf-8"))
+    chat_response = ChatResponse(
+        response=encoder.response,
+        sources=sources,
+        conversation_id="bench-conversation",
+        user_message="What is the antenna height?"
+    )
+    final_line = encoder.end(chat_response)
+    if final_line:
+        total_bytes += len(final_line.encode("utf-8"))
+    return total_bytes, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    tokens = _fake_tokens(args.tokens)
+    sources = _fake_sources()
+    print(f"{'protocol':<12} {'bytes/answer':>14} {'cpu ms/answer':>14}")
+    for protocol in STREAM_PROTOCOLS:
+        results = [run_once(protocol, tokens, sources) for _ in range(args.runs)]
+        total_bytes = results[0][0]
+        cpu_ms = 1000 * sum(r[1] for r in results) / len(results)
+        print(f"{protocol:<12} {total_bytes:>14,} {cpu_ms:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Structured (record-level) against legacy (text blob) ingestion of CSV and
+JSON files, in process with the mmap vector backend and the stub Ollama.
+
+For each format the same generated file is ingested twice, once with
+``structured_ingestion`` off (pandas row blocks or the whole JSON
+re-serialized with ``indent=2``, split into 1000-char chunks) and once
+on (whole records in token-sized chunks under their column headers).
+Reports chunks, embedding tokens per MB of input, rows cut by a chunk
+boundary and chunks without a header line (for chunks holding CSV), and
+ingest time. For the structured run it also times a filter answered
+from the column index.
+
+    python -m benchmarks.bench_structured_ingest --rows 20000
+    python -m benchmarks.bench_structured_ingest --rows 100000 --formats csv --per-text-ms 2 --out structured.json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from benchmarks.run_suite import make_csv
+from benchmarks.stub_ollama import StubOllamaServer
+
+FORMATS = ("csv", "json")
+
+
+def make_json(records: int, seed: int) -> bytes:
+    """An array of nested equipment records, as exported by a fleet tool"""
+    rng = random.Random(seed)
+    return json.dumps([
+        {
+            "serial": f"SN{seed:03d}{i:05d}",
+            "model": rng.choice(["GS18", "GS07", "CS20"]),
+            "firmware": {"version": f"{rng.randint(1, 9)}.{rng.randint(0, 99)}", "channel": rng.choice(["stable", "beta"])},
+            "battery_hours": rng.randint(4, 12),
+            "site": f"site-{rng.randint(1, 40)}",
+            "status": rng.choice(["ok", "ok", "ok", "service"]),
+        }
+        for i in range(records)
+    ]).encode("utf-8")
+
+
+def csv_chunk_quality(texts: list[str], width: int) -> tuple[int, int]:
+    """(rows cut short by a chunk boundary, chunks without a header line) for chunks holding CSV"""
+    cut, headerless = 0, 0
+    for text in texts:
+        rows = [row for row in csv.reader(io.StringIO(text)) if row]
+        if not rows or rows[0][0] != "serial":
+            headerless += 1
+        cut += sum(1 for row in rows if len(row) != width)
+    return cut, headerless
+
+
+def run(path: str, fmt: str, structured: bool, stub: StubOllamaServer, args) -> dict:
+    from services.document_processor import DocumentProcessor
+    from services.embeddings import OllamaBatchEmbeddings
+    from services.prompt_builder import TokenCounter
+    from services.vector_store import SharedVectorStore
+
+    workdir = tempfile.mkdtemp(prefix="bench_structured_")
+    try:
+        embeddings = OllamaBatchEmbeddings(
+            model="stub-embed", base_url=stub.base_url, batch_size=32, concurrency=4, backoff_seconds=0.01
+        )
+        db_dir = os.path.join(workdir, "db")
+        vector_store = SharedVectorStore(persist_directory=db_dir, embeddings=embeddings, backend="mmap")
+        processor = DocumentProcessor(
+            upload_dir=os.path.join(workdir, "uploads"),
+            db_directory=db_dir,
+            vector_store=vector_store,
+            embeddings=embeddings,
+            embedding_batch_size=128,
+            structured_ingestion=structured,
+            structured_chunk_tokens=args.chunk_tokens
+        )
+        with open(path, "rb") as f:
+            doc_info, _ = processor.save_stream(f, os.path.basename(path))
+        start = time.perf_counter()
+        processor.ingest_document(doc_info.id)
+        elapsed = time.perf_counter() - start
+
+        _, texts, _ = vector_store.get_chunks({"document_id": doc_info.id})
+        counter = TokenCounter()
+        tokens = sum(counter.count(text) for text in texts)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        result = {
+            "format": fmt,
+            "path": "structured" if structured else "legacy",
+            "input_mb": round(size_mb, 2),
+            "chunks": len(texts),
+            "embedding_tokens": tokens,
+            "tokens_per_mb": round(tokens / size_mb),
+            "cut_rows": None,
+            "headerless_chunks": None,
+            "ingest_seconds": round(elapsed, 2),
+            "mb_per_second": round(size_mb / elapsed, 2),
+        }
+        # Legacy JSON chunks are pretty-printed JSON, not rows
+        if fmt == "csv" or structured:
+            result["cut_rows"], result["headerless_chunks"] = csv_chunk_quality(texts, 5 if fmt == "csv" else 7)
+        if structured:
+            filters = [("status", "eq", "service"), ("battery_hours", "ge", 10)] if fmt == "json" else \
+                [("model", "eq", "GS18"), ("battery_hours", "ge", 10)]
+            processor.structured_index.query(filters, limit=0)
+            start = time.perf_counter()
+            answer = processor.structured_index.query(filters, limit=10, stats=["battery_hours"])
+            result["filter_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            result["filter_matched"] = answer["matched"]
+        processor.shutdown()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="CSV rows / JSON records")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--chunk-tokens", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="stub cost per embedding request")
+    parser.add_argument("--per-text-ms", type=float, default=0.5, help="stub cost per embedded chunk")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub = StubOllamaServer(latency_ms=args.latency_ms, per_text_ms=args.per_text_ms).start()
+    datadir = tempfile.mkdtemp(prefix="bench_structured_data_")
+    results = []
+    try:
+        for fmt in args.formats:
+            path = os.path.join(datadir, f"fleet.{fmt}")
+            with open(path, "wb") as f:
+                f.write(make_csv(args.rows, 1) if fmt == "csv" else make_json(args.rows, 1))
+            for structured in (False, True):
+                results.append(run(path, fmt, structured, stub, args))
+                r = results[-1]
+                print(f"{r['format']:>4} {r['path']:>10}: {r['chunks']:>7} chunks, {r['tokens_per_mb']:>8} tokens/MB, "
+                      f"{r['cut_rows']} cut rows, {r['headerless_chunks']} chunks without header, {r['ingest_seconds']:>7.2f}s"
+                      + (f", filter {r['filter_ms']} ms ({r['filter_matched']} rows)" if structured else ""))
+    finally:
+        stub.stop()
+        shutil.rmtree(datadir, ignore_errors=True)
+
+    print(f"\n{'format':>6} {'tokens/MB':>14} {'ingest time':>12}")
+    for fmt in args.formats:
+        legacy, structured = [r for r in results if r["format"] == fmt]
+        print(f"{fmt:>6} {structured['tokens_per_mb'] / legacy['tokens_per_mb']:>13.2f}x "
+              f"{structured['ingest_seconds'] / legacy['ingest_seconds']:>11.2f}x")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Server memory against upload size, for /upload and /upload/bulk, using
+the stub Ollama.
+
+Each size runs against a fresh server: a small warm-up upload first (so
+the parsers are imported), then one upload of the given size, streamed
+from the client without building it in memory. Ingestion jobs are
+cancelled as soon as they are queued, since only the upload path is
+measured. Reports upload throughput and how much the server's peak RSS
+grew during the upload.
+
+Fails (exit code 1) when the peak-RSS growth for the largest size
+exceeds the growth for the smallest by more than ``--max-growth-mb``,
+i.e. when memory use depends on the upload size.
+
+    python -m benchmarks.bench_upload --sizes-mb 8 64 256
+    python -m benchmarks.bench_upload --mode bulk --files 50 --sizes-mb 1 4 --out upload.json
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import zipfile
+from uuid import uuid4
+from benchmarks.run_suite import REPO_ROOT, Client, free_port, peak_rss_mb
+from benchmarks.stub_ollama import StubOllamaServer
+
+BLOCK_ROWS = 20000
+CSV_HEADER = b"serial,model,firmware,status,notes\n"
+
+
+def csv_block() -> bytes:
+    """About 1 MB of rows; the upload repeats it, so the client never holds more than one"""
+    return "".join(
+        f"SN{i:07d},GS18,{i % 7}.{i % 13},{'ok' if i % 5 else 'service'},calibrated on site {i % 97}\n"
+        for i in range(BLOCK_ROWS)
+    ).encode("utf-8")
+
+
+def csv_parts(size_bytes: int, block: bytes) -> tuple[int, list]:
+    """(exact length, list of chunks) for a CSV of about ``size_bytes``; chunks are shared, not copied"""
+    repeats = max(1, (size_bytes - len(CSV_HEADER)) // len(block))
+    return len(CSV_HEADER) + repeats * len(block), [CSV_HEADER] + [block] * repeats
+
+
+def post_multipart(base_url: str, path: str, parts: list[tuple[str, str, int, object]]) -> tuple[int, dict]:
+    """
+    Stream a multipart body of ``(filename, content type, length, chunk
+    iterable)`` parts with an exact Content-Length
+    """
+    boundary = uuid4().hex
+    pieces, length = [], 0
+    for filename, content_type, size, chunks in parts:
+        head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{"files" if path.endswith("bulk") else "file"}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        pieces.append([head])
+        pieces.append(chunks)
+        pieces.append([b"\r\n"])
+        length += len(head) + size + 2
+    tail = f"--{boundary}--\r\n".encode("utf-8")
+    pieces.append([tail])
+    length += len(tail)
+
+    def body():
+        for piece in pieces:
+            yield from piece
+
+    host = base_url.split("://", 1)[1]
+    connection = http.client.HTTPConnection(host, timeout=600)
+    try:
+        connection.request("POST", path, body=body(), headers={
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(length)
+        })
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+
+def file_chunks(path: str, chunk_size: int = 1024 * 1024):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def write_zip(path: str, files: int, file_bytes: int, block: bytes) -> int:
+    """Build the archive on disk, one member at a time"""
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for i in range(files):
+            _, chunks = csv_parts(file_bytes, block)
+            with archive.open(f"manuals/unit_{i:04d}.csv", "w") as member:
+                # A distinct first row so members are not deduplicated
+                member.write(chunks[0] + f"SN-UNIQUE-{i},GS18,0,ok,bulk\n".encode("utf-8"))
+                for chunk in chunks[1:]:
+                    member.write(chunk)
+    return os.path.getsize(path)
+
+
+def start_server(stub: StubOllamaServer, workdir: str, max_upload_bytes: int) -> tuple[subprocess.Popen, Client]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "OLLAMA_BASE_URL": stub.base_url,
+        "CHAT_MODEL": "stub-chat",
+        "EMBEDDING_MODEL": "stub-embed",
+        "TRACE_SAMPLE_RATE": "0",
+        "MAX_UPLOAD_SIZE": str(max_upload_bytes),
+        "MAX_BULK_UPLOAD_SIZE": str(max_upload_bytes * 1000),
+        "WARM_UP": "false",
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL
+    )
+    client = Client(f"http://127.0.0.1:{port}")
+    deadline = time.time() + 180
+    while True:
+        try:
+            client.get_json("/documents")
+            return server, client
+        except (urllib.error.URLError, ConnectionError):
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError("server did not start")
+            time.sleep(0.2)
+
+
+def cancel_jobs(client: Client, job_ids: list[str]):
+    for job_id in job_ids:
+        if not job_id:
+            continue
+        try:
+            with client.request("DELETE", f"/jobs/{job_id}"):
+                pass
+        except urllib.error.HTTPError:
+            pass
+    for job_id in job_ids:
+        if job_id:
+            client.wait_for_job(job_id, poll_seconds=0.1)
+
+
+def run_size(stub: StubOllamaServer, mode: str, size_mb: float, files: int, block: bytes) -> dict:
+    size_bytes = int(size_mb * 1024 * 1024)
+    workdir = tempfile.mkdtemp(prefix="bench_upload_")
+    server, client = start_server(stub, workdir, max(size_bytes * 2, 64 * 1024 * 1024))
+    try:
+        # Warm-up, so imports and first-use allocations are not charged to the upload
+        length, chunks = csv_parts(1024 * 1024, block)
+        status, response = post_multipart(client.base_url, "/upload", [("warmup.csv", "text/csv", length, chunks)])
+        if status != 200:
+            raise RuntimeError(f"warm-up upload failed: {status} {response}")
+        cancel_jobs(client, [response.get("job_id")])
+        baseline_mb = peak_rss_mb(server.pid)
+
+        start = time.perf_counter()
+        if mode == "single":
+            length, chunks = csv_parts(size_bytes, block)
+            status, response = post_multipart(client.base_url, "/upload", [("manual.csv", "text/csv", length, chunks)])
+            job_ids = [response.get("job_id")]
+            sent = length
+        else:
+            archive = os.path.join(workdir, "bulk.zip")
+            sent = write_zip(archive, files, size_bytes, block)
+            start = time.perf_counter()
+            status, response = post_multipart(
+                client.base_url, "/upload/bulk", [("bulk.zip", "application/zip", sent, file_chunks(archive))]
+            )
+            job_ids = [r.get("job_id") for r in response.get("results", [])]
+        elapsed = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError(f"upload failed: {status} {response}")
+        peak_mb = peak_rss_mb(server.pid)
+        cancel_jobs(client, job_ids)
+        result = {
+            "mode": mode,
+            "size_mb": size_mb,
+            "files": files if mode == "bulk" else 1,
+            "sent_mb": round(sent / 1024 / 1024, 1),
+            "seconds": round(elapsed, 3),
+            "mb_per_second": round(sent / 1024 / 1024 / elapsed, 1),
+            "baseline_rss_mb": baseline_mb,
+            "peak_rss_mb": peak_mb,
+            "rss_growth_mb": round(peak_mb - baseline_mb, 1) if peak_mb and baseline_mb else None,
+        }
+        if mode == "bulk":
+            result["queued"] = response["queued"]
+            result["rejected"] = response["rejected"]
+        return result
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("single", "bulk"), default="single")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[8, 64, 256],
+                        help="upload size; per archive member in bulk mode")
+    parser.add_argument("--files", type=int, default=20, help="archive members in bulk mode")
+    parser.add_argument("--max-growth-mb", type=float, default=64)
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    block = csv_block()
+    stub = StubOllamaServer(latency_ms=0).start()
+    results = []
+    try:
+        for size_mb in sorted(args.sizes_mb):
+            results.append(run_size(stub, args.mode, size_mb, args.files, block))
+            r = results[-1]
+            print(f"{r['mode']:>6} {r['sent_mb']:>8.1f} MB: {r['mb_per_second']:>7.1f} MB/s, "
+                  f"peak RSS {r['peak_rss_mb']} MB (+{r['rss_growth_mb']} MB over warm-up)")
+    finally:
+        stub.stop()
+
+    failures = []
+    growth = [r["rss_growth_mb"] for r in results if r["rss_growth_mb"] is not None]
+    if len(growth) >= 2 and growth[-1] - growth[0] > args.max_growth_mb:
+        failures.append(
+            f"peak RSS grew {growth[-1] - growth[0]:.1f} MB more for {results[-1]['sent_mb']} MB "
+            f"than for {results[0]['sent_mb']} MB (allowed {args.max_growth_mb:.0f} MB)"
+        )
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"results": results, "failures": failures}, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
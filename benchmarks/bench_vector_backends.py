@@ -0,0 +1,153 @@
+"""
+Chroma against the memory-mapped float16 index (VECTOR_BACKEND=mmap) on
+synthetic embeddings: build time, query p50/p99 (unfiltered and scoped to
+a few documents), resident memory and on-disk size per corpus size.
+
+Each backend and size runs in its own process so memory is not shared
+between runs.
+
+    python -m benchmarks.bench_vector_backends --sizes 10000 100000 1000000
+    python -m benchmarks.bench_vector_backends --sizes 100000 --backends mmap --dim 384
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BATCH = 1000
+DOCUMENTS = 200
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def memory_kb() -> dict:
+    """Current and peak resident set size from /proc (Linux)"""
+    fields = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    fields[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return fields
+
+
+def disk_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def open_collection(backend: str, path: str):
+    if backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        return client.get_or_create_collection("bench")
+    from services.mmap_vector_index import MmapVectorClient
+    return MmapVectorClient(path).get_or_create_collection("bench")
+
+
+def run_child(backend: str, size: int, dim: int, queries: int, path: str) -> dict:
+    rng = np.random.default_rng(7)
+    # Clustered vectors, closer to real embeddings than uniform noise
+    centers = rng.normal(size=(64, dim)).astype(np.float32)
+    collection = open_collection(backend, path)
+
+    start = time.perf_counter()
+    for offset in range(0, size, BATCH):
+        n = min(BATCH, size - offset)
+        vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+        collection.upsert(
+            ids=[f"chunk-{i}" for i in range(offset, offset + n)],
+            embeddings=vectors.tolist(),
+            metadatas=[{"document_id": f"doc-{i % DOCUMENTS}", "chunk": i} for i in range(offset, offset + n)],
+            documents=[f"chunk text {i}" for i in range(offset, offset + n)]
+        )
+    build_s = time.perf_counter() - start
+    after_build = memory_kb()
+
+    def timed(collection, where) -> list[float]:
+        latencies = []
+        for _ in range(queries):
+            vector = centers[rng.integers(0, len(centers))] + 0.3 * rng.normal(size=dim).astype(np.float32)
+            start = time.perf_counter()
+            collection.query(query_embeddings=[vector.tolist()], n_results=20, where=where,
+                             include=["documents", "metadatas", "distances"])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    unfiltered = timed(collection, None)
+    scoped = timed(collection, {"document_id": {"$in": ["doc-1", "doc-2", "doc-3"]}})
+    memory = memory_kb()
+    del collection
+    return {
+        "backend": backend,
+        "chunks": size,
+        "dim": dim,
+        "build_s": round(build_s, 2),
+        "query_p50_ms": round(statistics.median(unfiltered), 2),
+        "query_p99_ms": round(percentile(unfiltered, 99), 2),
+        "scoped_query_p99_ms": round(percentile(scoped, 99), 2),
+        "rss_after_build_mb": round(after_build.get("VmRSS", 0) / 1024, 1),
+        "rss_mb": round(memory.get("VmRSS", 0) / 1024, 1),
+        "peak_rss_mb": round(memory.get("VmHWM", 0) / 1024, 1),
+        "disk_mb": round(disk_bytes(path) / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--backends", nargs="+", choices=["chroma", "mmap"], default=["chroma", "mmap"])
+    parser.add_argument("--dim", type=int, default=768, help="nomic-embed-text vectors are 768-d")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--child", nargs=3, metavar=("BACKEND", "SIZE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        backend, size, path = args.child
+        print(json.dumps(run_child(backend, int(size), args.dim, args.queries, path)))
+        return
+
+    results = []
+    for size in args.sizes:
+        for backend in args.backends:
+            path = tempfile.mkdtemp(prefix=f"bench-{backend}-")
+            try:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_vector_backends", "--dim", str(args.dim),
+                     "--queries", str(args.queries), "--child", backend, str(size), path],
+                    capture_output=True, text=True
+                )
+                if output.returncode != 0:
+                    print(f"{backend} at {size} chunks failed:\n{output.stderr.strip()}")
+                    continue
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+            results.append(result)
+            print(f"{backend:>6} {size:>8} chunks: build {result['build_s']:.1f} s, "
+                  f"query p50 {result['query_p50_ms']:.2f} ms / p99 {result['query_p99_ms']:.2f} ms, "
+                  f"scoped p99 {result['scoped_query_p99_ms']:.2f} ms, "
+                  f"RSS {result['rss_mb']:.0f} MB (peak {result['peak_rss_mb']:.0f}), disk {result['disk_mb']:.0f} MB")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
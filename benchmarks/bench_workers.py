@@ -0,0 +1,195 @@
+"""
+Throughput of /documents, /export and retrieval (/search) against the
+number of uvicorn worker processes, using the stub Ollama.
+
+For each worker count the app is started in a fresh directory with the
+mmap vector backend, seeded with CSV uploads and a few conversations, and
+then driven by closed-loop clients for a fixed time per endpoint. Every
+/documents response is checked against the seeded document count, so a
+worker that misses another worker's uploads shows up as errors. Reports
+requests/sec, p50/p99 and the speed-up over one worker.
+
+Client load comes from several processes so the load generator is not
+the bottleneck; near-linear scaling needs at least as many free cores as
+workers plus client processes.
+
+    python -m benchmarks.bench_workers --workers 1 2 4 8 --duration 10
+    python -m benchmarks.bench_workers --workers 1 4 --endpoints search --concurrency 32 --out workers.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from benchmarks.run_suite import QUESTIONS, REPO_ROOT, Client, free_port, make_csv, percentile
+from benchmarks.stub_ollama import StubOllamaServer
+
+ENDPOINTS = ("documents", "export", "search")
+
+
+def one_request(client: Client, endpoint: str, i: int, context: dict):
+    if endpoint == "documents":
+        documents = client.get_json("/documents")
+        if len(documents) != context["documents"]:
+            raise RuntimeError(f"saw {len(documents)} of {context['documents']} documents")
+    elif endpoint == "export":
+        conversations = context["conversations"]
+        response = client.post_json("/export", {
+            "conversation_id": conversations[i % len(conversations)],
+            "format": ("txt", "md", "jsonl")[i % 3]
+        })
+        with client.request("GET", f"/download/{response['file_name']}") as download:
+            while download.read(65536):
+                pass
+    else:
+        # Distinct queries, so the query and retrieval caches do not answer for the index
+        query = urllib.parse.quote(f"{QUESTIONS[i % len(QUESTIONS)]} SN{i:06d}")
+        hits = client.get_json(f"/search?q={query}&mode=hybrid&k=5")["hits"]
+        if not hits:
+            raise RuntimeError("no hits")
+
+
+def drive(base_url: str, endpoint: str, threads: int, duration: float, seed: int, context: dict) -> tuple[list, int]:
+    """Closed-loop load from one client process; returns (latencies, errors)"""
+    client = Client(base_url, timeout=60)
+    deadline = time.perf_counter() + duration
+
+    def loop(thread: int):
+        latencies, errors, i = [], 0, seed * 100000 + thread * 1000
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                one_request(client, endpoint, i, context)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+            i += 1
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(loop, range(threads)))
+    return [x for latencies, _ in results for x in latencies], sum(errors for _, errors in results)
+
+
+def start_server(workers: int, stub: StubOllamaServer, workdir: str) -> tuple[subprocess.Popen, Client]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "OLLAMA_BASE_URL": stub.base_url,
+        "CHAT_MODEL": "stub-chat",
+        "EMBEDDING_MODEL": "stub-embed",
+        "TRACE_SAMPLE_RATE": "0",
+        "VECTOR_BACKEND": "mmap",
+        "WEB_CONCURRENCY": str(workers),
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL
+    )
+    client = Client(f"http://127.0.0.1:{port}")
+    deadline = time.time() + 180
+    while True:
+        try:
+            client.get_json("/documents")
+            return server, client
+        except (urllib.error.URLError, ConnectionError):
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError("server did not start")
+            time.sleep(0.2)
+
+
+def seed(client: Client, documents: int, csv_rows: int, conversations: int) -> dict:
+    for i in range(documents):
+        response = client.upload(f"fleet_{i}.csv", make_csv(csv_rows, i), "text/csv")
+        if response.get("job_id"):
+            job = client.wait_for_job(response["job_id"])
+            if job["status"] != "completed":
+                raise RuntimeError(f"seeding failed: {job}")
+    conversation_ids = []
+    for i in range(conversations):
+        _, _, conversation_id = client.chat(QUESTIONS[i % len(QUESTIONS)])
+        conversation_ids.append(conversation_id)
+    return {"documents": documents, "conversations": conversation_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads in total")
+    parser.add_argument("--client-processes", type=int, default=4)
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--csv-rows", type=int, default=500)
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub = StubOllamaServer(latency_ms=0, chat_tokens=40, token_rate=2000, first_token_ms=0).start()
+    processes = max(1, min(args.client_processes, args.concurrency))
+    results = []
+    try:
+        for workers in args.workers:
+            workdir = tempfile.mkdtemp(prefix=f"bench_workers_{workers}_")
+            server, client = start_server(workers, stub, workdir)
+            try:
+                context = seed(client, args.documents, args.csv_rows, args.conversations)
+                # Let every worker pick up the seeded chunks from the change feed
+                time.sleep(2)
+                for endpoint in args.endpoints:
+                    start = time.perf_counter()
+                    with ProcessPoolExecutor(max_workers=processes) as pool:
+                        parts = list(pool.map(
+                            drive,
+                            [client.base_url] * processes,
+                            [endpoint] * processes,
+                            [args.concurrency // processes + (p < args.concurrency % processes) for p in range(processes)],
+                            [args.duration] * processes,
+                            range(processes),
+                            [context] * processes
+                        ))
+                    wall = time.perf_counter() - start
+                    latencies = [x for part, _ in parts for x in part]
+                    errors = sum(e for _, e in parts)
+                    results.append({
+                        "workers": workers,
+                        "endpoint": endpoint,
+                        "requests": len(latencies),
+                        "errors": errors,
+                        "rps": round(len(latencies) / wall, 1),
+                        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+                        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+                    })
+                    print(f"{workers} workers {endpoint:>9}: {results[-1]['rps']:>8.1f} req/s, "
+                          f"p50 {results[-1]['p50_ms']} ms, p99 {results[-1]['p99_ms']} ms, {errors} errors")
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+    finally:
+        stub.stop()
+
+    baseline = {r["endpoint"]: r["rps"] for r in results if r["workers"] == min(args.workers)}
+    print(f"\n{'endpoint':>9} {'workers':>7} {'req/s':>9} {'speed-up':>9} {'efficiency':>10}")
+    for r in results:
+        base = baseline.get(r["endpoint"])
+        r["speedup"] = round(r["rps"] / base, 2) if base else None
+        r["efficiency"] = round(r["speedup"] * min(args.workers) / r["workers"], 2) if base else None
+        print(f"{r['endpoint']:>9} {r['workers']:>7} {r['rps']:>9.1f} {r['speedup'] or 0:>8.2f}x {r['efficiency'] or 0:>10.2f}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+End-to-end offline benchmark of the FastAPI app against a stub Ollama.
+
+Starts the stub (chat + embeddings) and ``uvicorn main:app`` in a scratch
+directory, then drives concurrent /chat streams, bulk /upload of
+generated PDFs and CSVs, and /export + /download. Reports p50/p99
+latency, throughput and the server's peak RSS, and writes a JSON result
+file that can be compared across commits.
+
+    python -m benchmarks.run_suite --chat-requests 50 --concurrency 10 --out results.json
+    python -m benchmarks.run_suite --out new.json --compare results.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from uuid import uuid4
+from benchmarks.stub_ollama import StubOllamaServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = [
+    "How do I calibrate the tilt compensation on the GS18?",
+    "What is the battery life of the CS20 controller?",
+    "How do I pair the GS07 antenna over Bluetooth?",
+    "Which coordinate systems are supported?",
+    "What is the warranty period?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(len(ordered) * pct / 100 + 0.5)) - 1)]
+
+
+def summarize(latencies: list[float], wall_seconds: float, errors: int) -> dict:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+        "throughput_per_s": round(len(latencies) / wall_seconds, 3) if wall_seconds > 0 else None,
+    }
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """Peak RSS (VmHWM) of a process and its direct children, Linux only"""
+    def vm_hwm(p: int) -> int:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    if not os.path.exists(f"/proc/{pid}"):
+        return None
+    total = vm_hwm(pid)
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            total += sum(vm_hwm(int(child)) for child in f.read().split())
+    except OSError:
+        pass
+    return round(total / 1024, 1)
+
+
+class Client:
+    def __init__(self, base_url: str, timeout: float = 600):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def get_json(self, path: str):
+        with self.request("GET", path) as response:
+            return json.loads(response.read())
+
+    def post_json(self, path: str, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        with self.request("POST", path, body, {"Content-Type": "application/json"}) as response:
+            return json.loads(response.read())
+
+    def chat(self, message: str, conversation_id: str | None = None) -> tuple[float | None, float, str | None]:
+        """Return (time to first token, total time, conversation id)"""
+        body = json.dumps({"message": message, "conversation_id": conversation_id}).encode("utf-8")
+        start = time.perf_counter()
+        first_token = None
+        conv_id = conversation_id
+        with self.request("POST", "/chat", body, {"Content-Type": "application/json"}) as response:
+            for line in response:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                conv_id = event.get("conversation_id", conv_id)
+                if event.get("event") == "delta" and first_token is None:
+                    first_token = time.perf_counter() - start
+                if event.get("event") == "error":
+                    raise RuntimeError(event.get("response"))
+        return first_token, time.perf_counter() - start, conv_id
+
+    def upload(self, filename: str, content: bytes, content_type: str) -> dict:
+        boundary = uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8") + content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        with self.request("POST", "/upload", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}) as r:
+            return json.loads(r.read())
+
+    def wait_for_job(self, job_id: str, poll_seconds: float = 0.05) -> dict:
+        while True:
+            job = self.get_json(f"/jobs/{job_id}")
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(poll_seconds)
+
+
+def make_pdf(pages: int, seed: int) -> bytes:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    rng = random.Random(seed)
+    words = ("receiver antenna controller survey satellite battery firmware bluetooth radio rover "
+             "base station coordinate warranty calibration GS18 CS20 GS07").split()
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    for page in range(pages):
+        y = 750
+        for _ in range(40):
+            pdf.drawString(50, y, " ".join(rng.choice(words) for _ in range(12)) + f" (seed {seed} p{page})")
+            y -= 18
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def make_csv(rows: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    lines = ["serial,model,firmware,battery_hours,site"]
+    for i in range(rows):
+        lines.append(f"SN{seed:03d}{i:05d},{rng.choice(['GS18', 'GS07', 'CS20'])},"
+                     f"{rng.randint(1, 9)}.{rng.randint(0, 99)},{rng.randint(4, 12)},site-{rng.randint(1, 40)}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def run_chat(client: Client, requests: int, concurrency: int) -> tuple[dict, list[str]]:
+    ttfts, totals, conversations, errors = [], [], [], 0
+
+    def one(i: int):
+        return client.chat(QUESTIONS[i % len(QUESTIONS)])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(one, i) for i in range(requests)]:
+            try:
+                ttft, total, conv_id = future.result()
+                totals.append(total)
+                if ttft is not None:
+                    ttfts.append(ttft)
+                if conv_id:
+                    conversations.append(conv_id)
+            except Exception as e:
+                print(f"chat error: {e}")
+                errors += 1
+    wall = time.perf_counter() - start
+    result = summarize(totals, wall, errors)
+    result["ttft_p50_ms"] = round(percentile(ttfts, 50) * 1000, 2) if ttfts else None
+    result["ttft_p99_ms"] = round(percentile(ttfts, 99) * 1000, 2) if ttfts else None
+    return result, conversations
+
+
+def run_uploads(client: Client, pdfs: int, csvs: int, pdf_pages: int, csv_rows: int, concurrency: int) -> dict:
+    files = [(f"manual_{i}.pdf", make_pdf(pdf_pages, i), "application/pdf") for i in range(pdfs)]
+    files += [(f"fleet_{i}.csv", make_csv(csv_rows, i), "text/csv") for i in range(csvs)]
+    accept, ingest, errors = [], [], 0
+    total_bytes = sum(len(content) for _, content, _ in files)
+
+    def one(item):
+        filename, content, content_type = item
+        start = time.perf_counter()
+        response = client.upload(filename, content, content_type)
+        accepted = time.perf_counter() - start
+        job = client.wait_for_job(response["job_id"]) if response.get("job_id") else {"status": "completed"}
+        if job["status"] != "completed":
+            raise RuntimeError(f"{filename}: job {job['status']} {job.get('error')}")
+        return accepted, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(one, item) for item in files]:
+            try:
+                accepted, done = future.result()
+                accept.append(accepted)
+                ingest.append(done)
+            except Exception as e:
+                print(f"upload error: {e}")
+                errors += 1
+    wall = time.perf_counter() - start
+    result = summarize(ingest, wall, errors)
+    result["accept_p50_ms"] = round(percentile(accept, 50) * 1000, 2) if accept else None
+    result["accept_p99_ms"] = round(percentile(accept, 99) * 1000, 2) if accept else None
+    result["mb_per_s"] = round(total_bytes / 1024 / 1024 / wall, 3) if wall > 0 else None
+    return result
+
+
+def run_exports(client: Client, conversations: list[str], requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    formats = ["pdf", "txt", "md", "jsonl"]
+
+    def one(i: int):
+        start = time.perf_counter()
+        response = client.post_json("/export", {
+            "conversation_id": conversations[i % len(conversations)],
+            "format": formats[i % len(formats)]
+        })
+        with client.request("GET", f"/download/{response['file_name']}") as download:
+            while download.read(65536):
+                pass
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(one, i) for i in range(requests)]:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                print(f"export error: {e}")
+                errors += 1
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\nComparison with {baseline.get('commit', 'baseline')[:12] if baseline.get('commit') else 'baseline'}:")
+    for phase in ("chat", "upload", "export"):
+        for metric in ("p50_ms", "p99_ms", "throughput_per_s"):
+            new = current["results"].get(phase, {}).get(metric)
+            old = baseline.get("results", {}).get(phase, {}).get(metric)
+            if new is None or not old:
+                continue
+            print(f"  {phase:<7} {metric:<17} {old:>10} -> {new:>10} ({(new - old) / old * 100:+.1f}%)")
+    new_rss, old_rss = current.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if new_rss and old_rss:
+        print(f"  peak_rss_mb               {old_rss:>10} -> {new_rss:>10} ({(new_rss - old_rss) / old_rss * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--csvs", type=int, default=4)
+    parser.add_argument("--csv-rows", type=int, default=2000)
+    parser.add_argument("--exports", type=int, default=20)
+    parser.add_argument("--chat-tokens", type=int, default=300)
+    parser.add_argument("--token-rate", type=float, default=200.0, help="stub tokens/sec per stream")
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0)
+    parser.add_argument("--backends", type=int, default=1, help="stub chat hosts behind OLLAMA_CHAT_URLS")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    args = parser.parse_args()
+
+    stubs = [
+        StubOllamaServer(latency_ms=args.embed_latency_ms, chat_tokens=args.chat_tokens,
+                         token_rate=args.token_rate, first_token_ms=args.first_token_ms).start()
+        for _ in range(max(1, args.backends))
+    ]
+    stub = stubs[0]
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "OLLAMA_BASE_URL": stub.base_url,
+        "OLLAMA_CHAT_URLS": ",".join(s.base_url for s in stubs),
+        "CHAT_MODEL": "stub-chat",
+        "EMBEDDING_MODEL": "stub-embed",
+        "TRACE_SAMPLE_RATE": "0",
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=workdir, env=env
+    )
+    client = Client(f"http://127.0.0.1:{port}")
+    try:
+        deadline = time.time() + 120
+        while True:
+            try:
+                client.get_json("/documents")
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.2)
+
+        results = {}
+        print("uploading...")
+        results["upload"] = run_uploads(client, args.pdfs, args.csvs, args.pdf_pages, args.csv_rows, args.concurrency)
+        print("chatting...")
+        results["chat"], conversations = run_chat(client, args.chat_requests, args.concurrency)
+        if conversations:
+            print("exporting...")
+            results["export"] = run_exports(client, conversations, args.exports, args.concurrency)
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "params": vars(args),
+            "results": results,
+            "peak_rss_mb": peak_rss_mb(server.pid),
+            "chat_requests_per_backend": [s.chat_requests for s in stubs],
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        for s in stubs:
+            s.stop()
+
+    print(json.dumps(report, indent=2))
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
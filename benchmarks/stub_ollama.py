@@ -0,0 +1,196 @@
+"""
+Deterministic stand-in for the Ollama HTTP API, for benchmarks and local
+testing without a GPU.
+
+Serves /api/embed, /api/embeddings, streaming /api/chat and /api/generate,
+and /api/tags. Chat answers are a fixed token sequence emitted after
+``first_token_ms`` at ``token_rate`` tokens/sec. ``drop_chat_after`` cuts
+every chat stream off after that many tokens, to exercise failover. Start
+several on different ports to stand in for a pool of GPU hosts.
+
+    python -m benchmarks.stub_ollama --port 11435 --dim 768 --latency-ms 20 --token-rate 50
+"""
+import argparse
+import hashlib
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ANSWER_WORDS = ("the GS18 receiver supports tilt compensation when the IMU is calibrated "
+                "and the CS20 controller shows the status on the main screen").split()
+
+
+def fake_tokens(count: int) -> list[str]:
+    """Deterministic answer of ``count`` tokens, with a short <think> block"""
+    tokens = ["<think>", " Checking", " the", " context", "</think>", "\n"]
+    i = 0
+    while len(tokens) < count:
+        tokens.append(" " + ANSWER_WORDS[i % len(ANSWER_WORDS)])
+        i += 1
+    return tokens[:count]
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    """Stable pseudo-random unit vector derived from the text"""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        values.extend(v / 2**31 for v in struct.unpack("<8i", digest))
+        counter += 1
+    values = values[:dim]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+
+class StubOllamaServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dim: int = 768,
+                 latency_ms: float = 0.0, per_text_ms: float = 0.0, fail_every: int = 0,
+                 chat_tokens: int = 200, token_rate: float = 0.0, first_token_ms: float = 0.0,
+                 drop_chat_after: int = 0):
+        self.dim = dim
+        self.chat_tokens = chat_tokens
+        self.token_rate = token_rate
+        self.first_token_ms = first_token_ms
+        self.drop_chat_after = drop_chat_after
+        self.chat_requests = 0
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+        self.fail_every = fail_every
+        self.request_count = 0
+        self.texts_embedded = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._reply(200, {"models": [{"name": "stub"}]})
+                else:
+                    self._reply(404, {"error": f"unknown path {self.path}"})
+
+            def _stream(self, request: dict, chat: bool):
+                with stub._lock:
+                    stub.chat_requests += 1
+                model = request.get("model", "stub")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                time.sleep(stub.first_token_ms / 1000)
+                delay = 1.0 / stub.token_rate if stub.token_rate else 0.0
+                try:
+                    for i, token in enumerate(fake_tokens(stub.chat_tokens)):
+                        if i and delay:
+                            time.sleep(delay)
+                        if stub.drop_chat_after and i >= stub.drop_chat_after:
+                            # Simulate a host dying mid-answer
+                            self.close_connection = True
+                            self.connection.shutdown(2)
+                            return
+                        if chat:
+                            line = {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+                        else:
+                            line = {"model": model, "response": token, "done": False}
+                        self.wfile.write((json.dumps(line) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    final = {"model": model, "done": True, "eval_count": stub.chat_tokens}
+                    if chat:
+                        final["message"] = {"role": "assistant", "content": ""}
+                    else:
+                        final["response"] = ""
+                    self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/") in ("/api/chat", "/api/generate"):
+                    self._stream(request, chat=self.path.rstrip("/") == "/api/chat")
+                    return
+                with stub._lock:
+                    stub.request_count += 1
+                    count = stub.request_count
+                if stub.fail_every and count % stub.fail_every == 0:
+                    self._reply(503, {"error": "stub overloaded"})
+                    return
+
+                if self.path == "/api/embed":
+                    texts = request.get("input", [])
+                    if isinstance(texts, str):
+                        texts = [texts]
+                elif self.path == "/api/embeddings":
+                    texts = [request.get("prompt", "")]
+                else:
+                    self._reply(404, {"error": f"unknown path {self.path}"})
+                    return
+
+                time.sleep((stub.latency_ms + stub.per_text_ms * len(texts)) / 1000)
+                vectors = [fake_embedding(t, stub.dim) for t in texts]
+                with stub._lock:
+                    stub.texts_embedded += len(texts)
+                if self.path == "/api/embed":
+                    self._reply(200, {"model": request.get("model"), "embeddings": vectors})
+                else:
+                    self._reply(200, {"embedding": vectors[0]})
+
+        return Handler
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--per-text-ms", type=float, default=0.0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--chat-tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=0.0, help="tokens/sec, 0 for unthrottled")
+    parser.add_argument("--first-token-ms", type=float, default=0.0)
+    parser.add_argument("--drop-chat-after", type=int, default=0, help="cut chat streams off after N tokens")
+    args = parser.parse_args()
+    server = StubOllamaServer(args.host, args.port, args.dim, args.latency_ms, args.per_text_ms, args.fail_every,
+                              args.chat_tokens, args.token_rate, args.first_token_ms, args.drop_chat_after)
+    print(f"Stub Ollama listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -417,6 +417,12 @@ function App() {
               <MenuItem onClick={() => handleExport('txt')}>
                 <Typography>Export as Text</Typography>
               </MenuItem>
+              <MenuItem onClick={() => handleExport('md')}>
+                <Typography>Export as Markdown</Typography>
+              </MenuItem>
+              <MenuItem onClick={() => handleExport('jsonl')}>
+                <Typography>Export as JSONL</Typography>
+              </MenuItem>
             </Menu>
           </Box>
 
@@ -25,25 +25,74 @@ export const uploadDocument = async (file) => {
   }
 };
 
-export const sendMessage = async (message, conversationId = null, onProgress = null) => {
+// Folds one streamed line into the accumulated message state.
+// Delta protocol lines carry an `event` field; legacy cumulative lines do not.
+const applyStreamEvent = (state, data) => {
+  switch (data.event) {
+    case 'start':
+      return {
+        response: data.response,
+        sources: data.sources,
+        conversation_id: data.conversation_id,
+        user_message: data.user_message,
+        answer: '',
+        reasoning: '',
+      };
+    case 'queued':
+      return { ...state, queue_position: data.position };
+    case 'reasoning':
+      return { ...state, reasoning: (state?.reasoning || '') + data.delta };
+    case 'delta': {
+      const answer = (state?.answer || '') + data.delta;
+      return { ...state, answer, response: answer, queue_position: null };
+    }
+    case 'end':
+    case 'error': {
+      const { event, ...message } = data;
+      return state?.reasoning ? { ...message, reasoning: state.reasoning } : message;
+    }
+    default:
+      return data;
+  }
+};
+
+export const sendMessage = async (message, conversationId = null, onProgress = null, streamProtocol = 'delta', filters = null, includeReasoning = false) => {
+  let state = null;
+  let consumed = 0;
+
+  // Only parse lines that arrived since the previous progress event
+  const consume = (buffer, flush = false) => {
+    const lastNewline = buffer.lastIndexOf('\n');
+    const end = flush ? buffer.length : lastNewline + 1;
+    if (end <= consumed) return;
+    const lines = buffer.slice(consumed, end).split('\n');
+    consumed = end;
+    for (const line of lines) {
+      if (line.trim()) {
+        try {
+          state = applyStreamEvent(state, JSON.parse(line));
+        } catch (e) {
+          console.error('Error parsing streaming response:', e);
+        }
+      }
+    }
+    if (onProgress && state) {
+      onProgress(state);
+    }
+  };
+
   try {
     const response = await api.post('/chat', {
       message,
       conversation_id: conversationId,
+      stream_protocol: streamProtocol,
+      filters,
+      include_reasoning: includeReasoning,
     }, {
       onDownloadProgress: (progressEvent) => {
-        if (onProgress && progressEvent.event.target.response) {
-          const lines = progressEvent.event.target.response.split('\n');
-          for (const line of lines) {
-            if (line.trim()) {
-              try {
-                const data = JSON.parse(line);
-                onProgress(data);
-              } catch (e) {
-                console.error('Error parsing streaming response:', e);
-              }
-            }
-          }
+        const buffer = progressEvent.event.target.response;
+        if (buffer) {
+          consume(buffer);
         }
       },
       responseType: 'text',
@@ -51,11 +100,12 @@ export const sendMessage = async (message, conversationId = null, onProgress = n
         'Accept': 'text/event-stream',
       },
     });
-    
-    // Parse the last complete response
-    const lines = response.data.split('\n');
-    const lastLine = lines.filter(line => line.trim()).pop();
-    return lastLine ? JSON.parse(lastLine) : null;
+
+    consume(response.data, true);
+    if (state) {
+      delete state.answer;
+    }
+    return state;
   } catch (error) {
     throw error.response?.data || error.message;
   }
@@ -70,6 +120,24 @@ export const getDocuments = async () => {
   }
 };
 
+export const getJob = async (jobId) => {
+  try {
+    const response = await api.get(`/jobs/${jobId}`);
+    return response.data;
+  } catch (error) {
+    throw error.response?.data || error.message;
+  }
+};
+
+export const cancelJob = async (jobId) => {
+  try {
+    const response = await api.delete(`/jobs/${jobId}`);
+    return response.data;
+  } catch (error) {
+    throw error.response?.data || error.message;
+  }
+};
+
 export const exportChat = async (conversationId, format) => {
   try {
     const response = await api.post('/export', {
@@ -1,19 +1,108 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
-from typing import List, Optional
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from typing import List, Optional, Literal
+import asyncio
 import os
+import threading
+import time
+import zipfile
 from dotenv import load_dotenv
 from services.document_processor import DocumentProcessor
 from services.chat_service import ChatService
-from services.export_service import ExportService
-from models.schemas import ChatResponse, DocumentInfo, ChatRequest, ExportRequest, ExportResponse
+from services.export_service import ExportService, STREAMING_FORMATS
+from services.ingestion_queue import IngestionQueue, QueueFullError
+from services.embeddings import DEFAULT_EMBEDDING_MODEL, create_embeddings
+from services.embedding_cache import EmbeddingCache, CachedEmbeddings
+from services.vector_store import SharedVectorStore, collection_name_for
+from services.prompt_builder import PromptBuilder
+from services.generation_scheduler import GenerationScheduler
+from services.backend_pool import BackendPool
+from services.reranking import RetrievalPipeline, create_reranker
+from services.answer_cache import SemanticAnswerCache
+from services.change_feed import ChangeFeed
+from services.uploads import BodySizeLimitMiddleware, UploadTooLargeError, is_archive, iter_archive
+from services import metrics
+from models.schemas import BulkUploadResponse, BulkUploadResult, RecordQuery, RecordQueryResponse, DocumentInfo, ChatRequest, ExportRequest, ExportResponse, JobInfo, MessagePage, ReasoningPage, ReasoningTrace, RetrievalFilter, SearchHit, SearchResponse
 
 load_dotenv()
 
 app = FastAPI(title="AI Document Assistant")
 
-# Configure CORS
+# Request counts and latency by route, for /metrics
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Initialize services
+UPLOAD_DIR = os.path.join(os.getcwd(), "uploaded_documents")
+DB_DIR = os.path.join(os.getcwd(), "vector_db")
+EXPORT_DIR = os.path.join(os.getcwd(), "exported_chats")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_RETENTION_HOURS = float(os.getenv("EXPORT_RETENTION_HOURS", "168"))
+EXPORT_MAX_FILES = int(os.getenv("EXPORT_MAX_FILES", "200"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_QUEUE_DEPTH = int(os.getenv("INGEST_MAX_QUEUE_DEPTH", "32"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.3"))
+PROMPT_HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", "10"))
+STORE_REASONING = os.getenv("STORE_REASONING", "false").lower() in ("1", "true", "yes")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+RETRIEVAL_DENSE_K = int(os.getenv("RETRIEVAL_DENSE_K", "20"))
+RETRIEVAL_LEXICAL_K = int(os.getenv("RETRIEVAL_LEXICAL_K", "20"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "30"))
+RETRIEVAL_DEDUPE_THRESHOLD = float(os.getenv("RETRIEVAL_DEDUPE_THRESHOLD", "0.8"))
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7"))
+RETRIEVAL_RERANKER = os.getenv("RETRIEVAL_RERANKER", "lexical")
+RERANKER_MODEL = os.getenv("RERANKER_MODEL")
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "2048"))
+QUERY_CACHE_MB = int(os.getenv("QUERY_CACHE_MB", "64"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_ENTRIES = int(os.getenv("ANSWER_CACHE_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+VECTOR_COLLECTION_MODE = os.getenv("VECTOR_COLLECTION_MODE", "shared")
+VECTOR_SEARCH_WORKERS = int(os.getenv("VECTOR_SEARCH_WORKERS", "8"))
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_MMAP_NPROBE = int(os.getenv("VECTOR_MMAP_NPROBE", "16"))
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "deepseek-r1:32b")
+OLLAMA_CHAT_URLS = os.getenv("OLLAMA_CHAT_URLS", OLLAMA_BASE_URL)
+OLLAMA_EMBEDDING_URLS = os.getenv("OLLAMA_EMBEDDING_URLS", OLLAMA_CHAT_URLS)
+OLLAMA_HEALTH_CHECK_INTERVAL = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "15"))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "2"))
+OLLAMA_COOLDOWN = float(os.getenv("OLLAMA_COOLDOWN", "30"))
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "2"))
+CHAT_MAX_QUEUE_DEPTH = int(os.getenv("CHAT_MAX_QUEUE_DEPTH", "64"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "120"))
+CHAT_FAIRNESS = os.getenv("CHAT_FAIRNESS", "conversation")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "true").lower() in ("1", "true", "yes")
+WORKER_SYNC_INTERVAL = float(os.getenv("WORKER_SYNC_INTERVAL", "0.5"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "168"))
+WARM_UP = os.getenv("WARM_UP", "true").lower() in ("1", "true", "yes")
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(100 * 1024 * 1024)))
+MAX_BULK_UPLOAD_SIZE = int(os.getenv("MAX_BULK_UPLOAD_SIZE", str(2 * 1024 * 1024 * 1024)))
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "500"))
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", "4"))
+BULK_INGEST_WORKERS = int(os.getenv("BULK_INGEST_WORKERS", "1"))
+STRUCTURED_INGESTION = os.getenv("STRUCTURED_INGESTION", "true").lower() in ("1", "true", "yes")
+STRUCTURED_CHUNK_TOKENS = int(os.getenv("STRUCTURED_CHUNK_TOKENS", "256"))
+
+# Stop reading an upload once it is over the limit, before the rest is spooled to disk
+MULTIPART_OVERHEAD = 64 * 1024
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits=[
+        ("POST", "/upload", MAX_UPLOAD_SIZE and MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD),
+        ("PUT", "/documents/[^/]+", MAX_UPLOAD_SIZE and MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD),
+        ("POST", "/upload/bulk", MAX_BULK_UPLOAD_SIZE),
+    ]
+)
+# Configure CORS. Added last so it is the outermost layer and 413s from the size limit carry its headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,14 +111,230 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-UPLOAD_DIR = os.path.join(os.getcwd(), "uploaded_documents")
-DB_DIR = os.path.join(os.getcwd(), "vector_db")
-EXPORT_DIR = os.path.join(os.getcwd(), "exported_chats")
+os.makedirs(DB_DIR, exist_ok=True)
+metrics.configure(sample_rate=TRACE_SAMPLE_RATE)
+
+# Worker processes (uvicorn --workers) tell each other what they changed through this feed
+change_feed = ChangeFeed(os.path.join(DB_DIR, "changes.sqlite3"), poll_interval=WORKER_SYNC_INTERVAL)
+if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 and VECTOR_BACKEND == "chroma":
+    print("Warning: Chroma keeps its index in process memory; use VECTOR_BACKEND=mmap with several workers")
+
+# Separate host pools so embedding traffic can be kept off the generation GPUs
+backend_options = dict(
+    failure_threshold=OLLAMA_FAILURE_THRESHOLD,
+    cooldown_seconds=OLLAMA_COOLDOWN,
+    health_check_interval=OLLAMA_HEALTH_CHECK_INTERVAL
+)
+chat_pool = BackendPool.from_urls(OLLAMA_CHAT_URLS, role="chat", **backend_options)
+embedding_pool = BackendPool.from_urls(OLLAMA_EMBEDDING_URLS, role="embedding", **backend_options)
+chat_pool.start_health_checks()
+embedding_pool.start_health_checks()
+
+# One embedding client (a small dedicated model by default) shared by ingestion and retrieval
+embeddings = create_embeddings(
+    model=EMBEDDING_MODEL,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    concurrency=EMBEDDING_CONCURRENCY,
+    pool=embedding_pool
+)
+embedding_cache = None
+if EMBEDDING_CACHE:
+    embedding_cache = EmbeddingCache(os.path.join(DB_DIR, "embedding_cache.sqlite3"))
+    embeddings = CachedEmbeddings(embeddings, embedding_cache)
+
+# One vector store handle for the whole app, shared by ingestion and every conversation.
+# Each embedding model writes to its own collection, since their vector sizes differ.
+vector_store = SharedVectorStore(
+    persist_directory=DB_DIR,
+    embeddings=embeddings,
+    collection_name=collection_name_for(EMBEDDING_MODEL),
+    query_cache_entries=QUERY_CACHE_ENTRIES,
+    query_cache_bytes=QUERY_CACHE_MB * 1024 * 1024,
+    query_cache_ttl=QUERY_CACHE_TTL,
+    collection_mode=VECTOR_COLLECTION_MODE,
+    search_workers=VECTOR_SEARCH_WORKERS,
+    backend=VECTOR_BACKEND,
+    mmap_nprobe=VECTOR_MMAP_NPROBE,
+    change_feed=change_feed
+)
+
+# Over-fetch, dedupe, MMR and rerank so fewer, more varied chunks reach the prompt
+retrieval_pipeline = None
+if RETRIEVAL_FETCH_K > 0:
+    retrieval_pipeline = RetrievalPipeline(
+        vector_store,
+        fetch_k=RETRIEVAL_FETCH_K,
+        dense_k=max(RETRIEVAL_DENSE_K, RETRIEVAL_FETCH_K),
+        lexical_k=max(RETRIEVAL_LEXICAL_K, RETRIEVAL_FETCH_K),
+        dedupe_threshold=RETRIEVAL_DEDUPE_THRESHOLD,
+        mmr_lambda=RETRIEVAL_MMR_LAMBDA,
+        reranker=create_reranker(RETRIEVAL_RERANKER, RERANKER_MODEL)
+    )
+
+# Opt-in: replay stored answers to repeated first questions over the same context
+answer_cache = None
+if ANSWER_CACHE:
+    answer_cache = SemanticAnswerCache(
+        max_entries=ANSWER_CACHE_ENTRIES,
+        ttl_seconds=ANSWER_CACHE_TTL,
+        similarity_threshold=ANSWER_CACHE_THRESHOLD
+    )
+    vector_store.add_change_listener(answer_cache.invalidate_documents)
+
+document_processor = DocumentProcessor(
+    upload_dir=UPLOAD_DIR,
+    db_directory=DB_DIR,
+    vector_store=vector_store,
+    # Hand the embedder enough texts per call to keep every concurrent request busy
+    embedding_batch_size=EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY,
+    pdf_workers=PDF_EXTRACT_WORKERS,
+    max_upload_bytes=MAX_UPLOAD_SIZE,
+    # CSV/JSON as whole records in token-sized chunks, plus a column index for /records/query
+    structured_ingestion=STRUCTURED_INGESTION,
+    structured_chunk_tokens=STRUCTURED_CHUNK_TOKENS
+)
+chat_service = ChatService(
+    db_directory=DB_DIR,
+    vector_store=vector_store,
+    prompt_builder=PromptBuilder(
+        token_budget=PROMPT_TOKEN_BUDGET,
+        history_share=PROMPT_HISTORY_SHARE,
+        max_history_turns=PROMPT_HISTORY_TURNS
+    ),
+    retrieval_k=RETRIEVAL_K,
+    dense_k=RETRIEVAL_DENSE_K,
+    lexical_k=RETRIEVAL_LEXICAL_K,
+    retrieval_pipeline=retrieval_pipeline,
+    answer_cache=answer_cache,
+    store_reasoning=STORE_REASONING,
+    chat_model=CHAT_MODEL,
+    chat_pool=chat_pool,
+    # Bound concurrent generations; the rest wait in a per-conversation (or per-client) fair queue
+    scheduler=GenerationScheduler(
+        max_in_flight=CHAT_MAX_IN_FLIGHT,
+        max_queue_depth=CHAT_MAX_QUEUE_DEPTH,
+        queue_timeout=CHAT_QUEUE_TIMEOUT
+    )
+)
+export_service = ExportService(
+    export_dir=EXPORT_DIR,
+    max_workers=EXPORT_WORKERS,
+    retention_seconds=EXPORT_RETENTION_HOURS * 3600,
+    max_files=EXPORT_MAX_FILES
+)
+# Job state is recorded in the document store so any worker can report on (and cancel) any job
+ingestion_queue = IngestionQueue(
+    max_workers=INGEST_WORKERS,
+    max_queue_depth=INGEST_MAX_QUEUE_DEPTH,
+    on_update=lambda job: document_processor.store.save_job(job.to_info()),
+    # Bulk uploads get their own workers so they cannot starve interactive ones
+    bulk_workers=BULK_INGEST_WORKERS,
+    max_bulk_jobs=max(BULK_UPLOAD_MAX_FILES, 1000)
+)
+document_processor.store.prune_jobs(JOB_RETENTION_HOURS * 3600)
+change_feed.subscribe("job_cancel", lambda job_ids: [ingestion_queue.cancel(job_id) for job_id in job_ids])
+change_feed.start()
+
+def _warm_up():
+    start = time.perf_counter()
+    try:
+        vector_store.warm_up()
+        chat_service.warm_up()
+    except Exception as e:
+        print(f"Warm-up failed: {str(e)}")
+        return
+    print(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+@app.on_event("startup")
+def start_warm_up():
+    """Open the vector store and chat clients in the background; requests are served meanwhile"""
+    if WARM_UP:
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+@app.on_event("startup")
+def requeue_for_new_embedding_model():
+    """Re-ingest documents whose chunks are in another embedding model's collection"""
+    documents = document_processor.claim_for_reembedding()
+    if not documents:
+        return
+    print(f"Re-embedding {len(documents)} documents into collection {vector_store.collection_name}")
+    for doc in documents:
+        try:
+            _queue_ingestion(doc.id, doc.filename, bulk=True)
+        except HTTPException as e:
+            # Left cancelled, so uploading the file again ingests it
+            print(f"Could not queue {doc.filename} for re-embedding: {e.detail}")
+
+@app.on_event("shutdown")
+def shutdown_ingestion():
+    ingestion_queue.shutdown()
+    document_processor.shutdown()
+    export_service.shutdown()
+    chat_pool.shutdown()
+    embedding_pool.shutdown()
+    change_feed.shutdown()
 
-document_processor = DocumentProcessor(upload_dir=UPLOAD_DIR, db_directory=DB_DIR)
-chat_service = ChatService(db_directory=DB_DIR)
-export_service = ExportService(export_dir=EXPORT_DIR)
+def _validate_file_type(filename: str):
+    """Reject uploads without a supported extension"""
+    allowed_types = {'.pdf', '.docx', '.json', '.csv'}
+    file_ext = os.path.splitext(filename.lower())[1]
+
+    print(f"File extension: {file_ext}")
+
+    if not file_ext:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File must have an extension. Allowed types: {', '.join(allowed_types)}"
+        )
+
+    if file_ext not in allowed_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type '{file_ext}'. Allowed types: {', '.join(allowed_types)}"
+        )
+
+def _queue_ingestion(doc_id: str, filename: str, bulk: bool = False):
+    """Submit a saved document to the ingestion workers and record the job on it"""
+    try:
+        job = ingestion_queue.submit(
+            document_id=doc_id,
+            filename=filename,
+            work=lambda progress: document_processor.ingest_document(doc_id, progress),
+            on_cancel=lambda: document_processor.mark_cancelled(doc_id),
+            bulk=bulk
+        )
+    except QueueFullError as e:
+        document_processor.mark_cancelled(doc_id)
+        raise HTTPException(status_code=429, detail=str(e))
+    document_processor.set_job_id(doc_id, job.id)
+    return job
+
+def _cancel_remote_job(job_id: str) -> Optional[JobInfo]:
+    """Ask the worker process running a job to cancel it; returns its last recorded state"""
+    info = document_processor.store.get_job(job_id)
+    if info is not None and info.status in ("queued", "running"):
+        change_feed.publish("job_cancel", [job_id])
+    return info
+
+async def _stop_ingestion(job_id: Optional[str], timeout: float = 30.0):
+    """Cancel a document's ingestion job and wait for its worker to let go"""
+    if not job_id:
+        return
+    job = ingestion_queue.cancel(job_id)
+    if job is not None:
+        if job.future is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(job.future), timeout)
+        except Exception:
+            pass
+        return
+    # Running in another worker process: wait until its record says it stopped
+    info = _cancel_remote_job(job_id)
+    deadline = time.monotonic() + timeout
+    while info is not None and info.status in ("queued", "running") and time.monotonic() < deadline:
+        await asyncio.sleep(WORKER_SYNC_INTERVAL)
+        info = document_processor.store.get_job(job_id)
 
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
@@ -41,49 +346,242 @@ async def upload_document(file: UploadFile = File(...)):
         print(f"Received file: {file.filename}")
         print(f"Content type: {file.content_type}")
         
-        # Validate file type
-        allowed_types = {'.pdf', '.docx', '.json', '.csv'}
-        filename = file.filename.lower()
-        file_ext = os.path.splitext(filename)[1]
-        
-        print(f"File extension: {file_ext}")
-        
-        if not file_ext:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File must have an extension. Allowed types: {', '.join(allowed_types)}"
-            )
-        
-        if file_ext not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file type '{file_ext}'. Allowed types: {', '.join(allowed_types)}"
-            )
+        _validate_file_type(file.filename)
         
-        # Process the document
-        doc_info = await document_processor.process_document(file)
-        return {"message": "Document processed successfully", "document_info": doc_info}
+        if ingestion_queue.active_count() >= ingestion_queue.max_queue_depth:
+            raise HTTPException(status_code=429, detail="Ingestion queue is full. Try again later.")
+
+        # Save the file now; extraction and embedding run on the ingestion workers
+        doc_info, is_duplicate = await document_processor.save_upload(file)
+        if is_duplicate:
+            return {
+                "message": "Document already uploaded",
+                "job_id": doc_info.job_id,
+                "document_info": doc_info
+            }
+
+        job = _queue_ingestion(doc_info.id, doc_info.filename)
+        doc_info.job_id = job.id
+        return {"message": "Document queued for processing", "job_id": job.id, "document_info": doc_info}
     
+    except HTTPException:
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print(f"Error processing file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _save_bulk_document(source, filename: str, archive: Optional[str] = None) -> BulkUploadResult:
+    """Save and queue one file of a bulk upload; failures are reported, not raised"""
+    result = BulkUploadResult(filename=filename, archive=archive, status="rejected")
+    try:
+        _validate_file_type(filename)
+        doc_info, is_duplicate = document_processor.save_stream(source, filename)
+        result.document_id = doc_info.id
+        if is_duplicate:
+            result.status = "duplicate"
+            result.job_id = doc_info.job_id
+            return result
+        result.job_id = _queue_ingestion(doc_info.id, doc_info.filename, bulk=True).id
+        result.status = "queued"
+    except HTTPException as e:
+        result.error = e.detail
+    except Exception as e:
+        print(f"Error saving {filename}: {str(e)}")
+        result.error = str(e)
+    return result
+
+def _save_bulk_upload(file: UploadFile) -> List[BulkUploadResult]:
+    """Save one part of a bulk upload: a document, or every document in a zip archive"""
+    if not is_archive(file.filename):
+        return [_save_bulk_document(file.file, file.filename)]
+    results = []
+    try:
+        for name, stream, reason in iter_archive(file.file, BULK_UPLOAD_MAX_FILES):
+            if stream is None:
+                results.append(BulkUploadResult(filename=name, archive=file.filename, status="rejected", error=reason))
+            else:
+                results.append(_save_bulk_document(stream, name, archive=file.filename))
+    except zipfile.BadZipFile as e:
+        results.append(BulkUploadResult(filename=file.filename, status="rejected", error=f"Not a valid zip archive: {str(e)}"))
+    return results
+
+@app.post("/upload/bulk", response_model=BulkUploadResponse)
+async def upload_documents_bulk(files: List[UploadFile] = File(...)):
+    """
+    Upload many documents at once, as separate files and/or zip archives.
+    Files are streamed to disk BULK_UPLOAD_CONCURRENCY at a time and
+    ingested on the bulk workers; each file gets its own result.
+    """
+    if len(files) > BULK_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_UPLOAD_MAX_FILES} files per request")
+    semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+
+    async def save(file: UploadFile) -> List[BulkUploadResult]:
+        async with semaphore:
+            return await asyncio.to_thread(_save_bulk_upload, file)
+
+    results = [result for part in await asyncio.gather(*(save(file) for file in files)) for result in part]
+    print(f"Bulk upload: {len(results)} files from {len(files)} parts")
+    return BulkUploadResponse(
+        queued=sum(1 for r in results if r.status == "queued"),
+        duplicates=sum(1 for r in results if r.status == "duplicate"),
+        rejected=sum(1 for r in results if r.status == "rejected"),
+        results=results
+    )
+
+def _client_key(http_request: Request) -> Optional[str]:
+    """Fairness key for the generation queue; None falls back to the conversation id"""
+    if CHAT_FAIRNESS != "client":
+        return None
+    client_id = http_request.headers.get("X-Client-Id")
+    if client_id:
+        return client_id
+    return http_request.client.host if http_request.client else None
+
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Chat with the AI about the uploaded documents
     """
+    if chat_service.scheduler.is_full():
+        raise HTTPException(status_code=429, detail="Too many chat requests waiting. Try again later.")
     try:
         return StreamingResponse(
             chat_service.get_streaming_response(
                 message=request.message,
-                conversation_id=request.conversation_id
+                conversation_id=request.conversation_id,
+                protocol=request.stream_protocol,
+                client_id=_client_key(http_request),
+                is_disconnected=http_request.is_disconnected,
+                retrieval_filter=document_processor.resolve_filter(request.filters),
+                include_reasoning=request.include_reasoning
             ),
             media_type="text/event-stream"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def list_messages(
+    conversation_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Page through the messages of a conversation, oldest first
+    """
+    total = chat_service.count_messages(conversation_id)
+    if total is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    messages = chat_service.get_conversation_history(conversation_id, offset=offset, limit=limit)
+    return MessagePage(
+        conversation_id=conversation_id,
+        total=total,
+        offset=offset,
+        limit=limit,
+        messages=messages
+    )
+
+@app.get("/conversations/{conversation_id}/reasoning", response_model=ReasoningPage)
+async def list_reasoning(
+    conversation_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Page through the stored reasoning traces of a conversation (only kept with STORE_REASONING)
+    """
+    if chat_service.count_messages(conversation_id) is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    traces = chat_service.store.get_reasoning(conversation_id, offset=offset, limit=limit)
+    return ReasoningPage(
+        conversation_id=conversation_id,
+        offset=offset,
+        limit=limit,
+        traces=[ReasoningTrace(message_index=seq, reasoning=trace) for seq, trace in traces]
+    )
+
+@app.get("/search", response_model=SearchResponse)
+async def search(
+    q: str,
+    mode: Literal["keyword", "dense", "hybrid", "pipeline"] = "keyword",
+    k: int = Query(5, ge=1, le=100),
+    document_id: Optional[List[str]] = Query(None),
+    document_type: Optional[List[str]] = Query(None)
+):
+    """
+    Search document chunks without calling the LLM. ``keyword`` mode uses
+    only the BM25 index and never calls the embedding model; ``pipeline``
+    is what /chat uses (hybrid, deduped, MMR, reranked). Repeat
+    ``document_id`` or ``document_type`` to search only those documents.
+    """
+    try:
+        start = time.perf_counter()
+        where = document_processor.resolve_filter(
+            RetrievalFilter(document_ids=document_id, document_types=document_type)
+        )
+        if mode == "keyword":
+            docs = [doc for _, doc in vector_store.keyword_search(q, k=k, filter=where)]
+        elif mode == "dense":
+            docs = [doc for _, doc in vector_store.dense_search(q, k=k, filter=where)]
+        elif mode == "pipeline" and retrieval_pipeline is not None:
+            docs = retrieval_pipeline.retrieve(q, k=k, filter=where).docs
+        else:
+            docs = vector_store.hybrid_search(
+                q, k=k, dense_k=RETRIEVAL_DENSE_K, lexical_k=RETRIEVAL_LEXICAL_K, filter=where
+            )
+        latency_ms = (time.perf_counter() - start) * 1000
+        return SearchResponse(
+            query=q,
+            mode=mode,
+            latency_ms=round(latency_ms, 3),
+            hits=[
+                SearchHit(
+                    document_name=doc.metadata.get("document_name", "Unknown"),
+                    document_id=doc.metadata.get("document_id"),
+                    page_number=doc.metadata.get("page_number", 1),
+                    content=doc.page_content
+                )
+                for doc in docs
+            ]
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/records/query", response_model=RecordQueryResponse)
+async def query_records(request: RecordQuery):
+    """
+    Filter the rows of ingested CSV and JSON documents on their fields,
+    from the column index and without calling the LLM. All filters must
+    match; ``stats`` adds count/min/max/mean/sum of numeric columns over
+    the matching rows.
+    """
+    start = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(
+            document_processor.structured_index.query,
+            [(f.column, f.op, f.value) for f in request.filters],
+            document_ids=request.document_ids,
+            limit=request.limit,
+            stats=request.stats
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return RecordQueryResponse(latency_ms=round((time.perf_counter() - start) * 1000, 3), **result)
+
+@app.get("/documents/{document_id}/columns")
+async def document_columns(document_id: str):
+    """
+    List the indexed columns of a CSV or JSON document, with their type,
+    how many rows have them and how many distinct values they hold
+    """
+    columns = document_processor.structured_index.columns(document_id)
+    if columns is None:
+        raise HTTPException(status_code=404, detail="No column index for this document")
+    return columns
+
 @app.get("/documents", response_model=List[DocumentInfo])
 async def list_documents():
     """
@@ -96,26 +594,177 @@ async def list_documents():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.put("/documents/{document_id}")
+async def replace_document(document_id: str, file: UploadFile = File(...)):
+    """
+    Replace a document with a revised file. Only chunks whose text changed
+    are re-embedded; chunks that disappeared are deleted.
+    """
+    try:
+        _validate_file_type(file.filename)
+        existing = document_processor.get_document(document_id)
+        if existing is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        if ingestion_queue.active_count() >= ingestion_queue.max_queue_depth:
+            raise HTTPException(status_code=429, detail="Ingestion queue is full. Try again later.")
+
+        # A half-ingested previous version would race with the replacement
+        await _stop_ingestion(existing.job_id)
+        doc_info, is_unchanged = await document_processor.save_replacement(document_id, file)
+        if is_unchanged:
+            return {"message": "Document unchanged", "job_id": doc_info.job_id, "document_info": doc_info}
+
+        job = _queue_ingestion(document_id, doc_info.filename)
+        doc_info.job_id = job.id
+        return {"message": "Document replacement queued for processing", "job_id": job.id, "document_info": doc_info}
+
+    except HTTPException:
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        print(f"Error replacing document: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents/{document_id}", response_model=DocumentInfo)
+async def delete_document(document_id: str):
+    """
+    Delete a document, its chunks and its uploaded file
+    """
+    existing = document_processor.get_document(document_id)
+    if existing is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    try:
+        await _stop_ingestion(existing.job_id)
+        deleted = await asyncio.to_thread(document_processor.delete_document, document_id)
+    except Exception as e:
+        print(f"Error deleting document: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return deleted
+
+@app.get("/embeddings/stats")
+async def embedding_stats():
+    """
+    Report embedding throughput (chunks/sec), retry counters and cache hits
+    """
+    stats = getattr(embeddings, "stats", None)
+    return {
+        "model": getattr(embeddings, "model", None),
+        "stats": stats.to_dict() if stats else None,
+        "cache": embedding_cache.stats() if embedding_cache else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus text exposition of request, retrieval, generation and ingestion metrics
+    """
+    metrics.registry.gauge("ingest_jobs_active", "Queued and running ingestion jobs").set(
+        ingestion_queue.active_count(bulk=None)
+    )
+    metrics.registry.gauge("vector_store_chunks", "Chunks in the vector store").set(vector_store.count())
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/chat/scheduler")
+async def scheduler_stats():
+    """
+    Report generation slots in use and requests waiting for one
+    """
+    return chat_service.scheduler.stats()
+
+@app.get("/backends")
+async def backend_stats():
+    """
+    Report health, requests in flight and latency of each Ollama host
+    """
+    return {"chat": chat_pool.stats(), "embedding": embedding_pool.stats()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Report hit rate, size and saved latency of the query embedding, retrieval and answer caches
+    """
+    return {
+        **vector_store.cache_stats(),
+        "answers": answer_cache.stats() if answer_cache else None,
+        "change_feed": change_feed.stats()
+    }
+
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str):
+    """
+    Report progress of a background ingestion job
+    """
+    job = ingestion_queue.get(job_id)
+    if job is not None:
+        return job.to_info()
+    # Accepted by another worker process
+    info = document_processor.store.get_job(job_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return info
+
+@app.delete("/jobs/{job_id}", response_model=JobInfo)
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running ingestion job
+    """
+    job = ingestion_queue.cancel(job_id)
+    if job is not None:
+        return job.to_info()
+    info = _cancel_remote_job(job_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return info
+
 @app.post("/export", response_model=ExportResponse)
 async def export_chat(request: ExportRequest):
     try:
-        # Get conversation history
-        messages = chat_service.get_conversation_history(request.conversation_id)
-        if not messages:
+        # Renders are cached per conversation and message count
+        message_count = chat_service.count_messages(request.conversation_id)
+        if not message_count:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
-        # Export the conversation
-        filename = export_service.export_chat(messages, request.conversation_id, request.format)
+        # Export the conversation (PDF renders run on the export worker pool)
+        filename = await export_service.export_chat_async(
+            lambda: chat_service.get_conversation_history(request.conversation_id, limit=message_count),
+            request.conversation_id,
+            message_count,
+            request.format
+        )
         
         # Return proper response model
         return ExportResponse(file_name=filename)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Export error: {str(e)}")  # Add logging
         raise HTTPException(status_code=500, detail=str(e))
 
+def _iter_conversation(conversation_id: str, message_count: int, page_size: int = 200):
+    """Read a conversation page by page, up to the message count of the export"""
+    for offset in range(0, message_count, page_size):
+        yield from chat_service.get_conversation_history(
+            conversation_id, offset=offset, limit=min(page_size, message_count - offset)
+        )
+
 @app.get("/download/{filename}")
 async def download_file(filename: str):
     try:
+        # Text formats are generated straight into the response
+        parsed = export_service.parse_filename(filename)
+        if parsed and parsed[2] in STREAMING_FORMATS:
+            conversation_id, message_count, format = parsed
+            if not chat_service.count_messages(conversation_id):
+                raise HTTPException(status_code=404, detail="File not found")
+            return StreamingResponse(
+                export_service.iter_export(_iter_conversation(conversation_id, message_count), format),
+                media_type=STREAMING_FORMATS[format],
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            )
+
         file_path = export_service.get_export_path(filename)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
@@ -125,6 +774,8 @@ async def download_file(filename: str):
             filename=filename,
             media_type='application/octet-stream'
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Download error: {str(e)}")  # Add logging
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Literal, Union
 from datetime import datetime
 
 class Source(BaseModel):
@@ -7,15 +7,91 @@ class Source(BaseModel):
     page_number: int
     content_snippet: str
 
+class SearchHit(BaseModel):
+    document_name: str
+    document_id: Optional[str] = None
+    page_number: int
+    content: str
+
+class SearchResponse(BaseModel):
+    query: str
+    mode: str
+    latency_ms: float
+    hits: List[SearchHit]
+
+class RecordFilter(BaseModel):
+    column: str
+    op: Literal["eq", "ne", "lt", "le", "gt", "ge", "contains"] = "eq"
+    value: Union[str, float]
+
+class RecordQuery(BaseModel):
+    filters: List[RecordFilter] = []
+    document_ids: Optional[List[str]] = None
+    limit: int = Field(50, ge=0, le=1000)
+    stats: List[str] = []
+
+class RecordRow(BaseModel):
+    document_id: str
+    row: int
+    key: str
+    values: Dict[str, str]
+
+class RecordDocumentCount(BaseModel):
+    document_id: str
+    matched: int
+
+class ColumnStats(BaseModel):
+    count: int
+    sum: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+
+class RecordQueryResponse(BaseModel):
+    matched: int
+    latency_ms: float
+    documents: List[RecordDocumentCount]
+    rows: List[RecordRow]
+    stats: Dict[str, ColumnStats]
+
 class ChatResponse(BaseModel):
     response: str
     sources: Optional[List[Source]] = None
     conversation_id: Optional[str] = None
     user_message: str
 
+class MessagePage(BaseModel):
+    conversation_id: str
+    total: int
+    offset: int
+    limit: int
+    messages: List[ChatResponse]
+
+class ReasoningTrace(BaseModel):
+    message_index: int
+    reasoning: str
+
+class ReasoningPage(BaseModel):
+    conversation_id: str
+    offset: int
+    limit: int
+    traces: List[ReasoningTrace]
+
+class RetrievalFilter(BaseModel):
+    """Restricts retrieval to a subset of documents; all given conditions must hold"""
+    document_ids: Optional[List[str]] = None
+    document_types: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
+    # "delta" streams only new tokens; "cumulative" is the legacy full-answer-per-line mode
+    stream_protocol: Literal["delta", "cumulative"] = "delta"
+    filters: Optional[RetrievalFilter] = None
+    # Stream the model's <think> reasoning as separate events; it is never part of the answer
+    include_reasoning: bool = False
 
 class DocumentInfo(BaseModel):
     id: str
@@ -26,6 +102,36 @@ class DocumentInfo(BaseModel):
     status: str
     embedding_status: str
     error: Optional[str] = None
+    job_id: Optional[str] = None
+    content_hash: Optional[str] = None
+    vector_collection: Optional[str] = None
+
+class JobInfo(BaseModel):
+    id: str
+    document_id: str
+    filename: str
+    status: Literal["queued", "running", "completed", "failed", "cancelled"]
+    chunks_total: Optional[int] = None
+    chunks_embedded: int = 0
+    chunks_per_second: Optional[float] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class BulkUploadResult(BaseModel):
+    filename: str
+    archive: Optional[str] = None
+    status: Literal["queued", "duplicate", "rejected"]
+    document_id: Optional[str] = None
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkUploadResponse(BaseModel):
+    queued: int
+    duplicates: int
+    rejected: int
+    results: List[BulkUploadResult]
 
 class ExportRequest(BaseModel):
     conversation_id: str
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from uuid import uuid4
+from langchain_core.documents import Document
+from models.schemas import ChatResponse
+from services.metrics import registry
+
+
+def context_key(docs: Sequence[Document]) -> str:
+    """Fingerprint of the retrieved chunks, in order"""
+    digest = hashlib.sha1()
+    for doc in docs:
+        digest.update(str(doc.metadata.get("document_id")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\1")
+    return digest.hexdigest()
+
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class _Entry:
+    __slots__ = ("id", "bucket", "vector", "response", "document_ids", "expires_at", "cost_ms")
+
+    def __init__(self, bucket, vector, response, document_ids, expires_at, cost_ms):
+        self.id = str(uuid4())
+        self.bucket = bucket
+        self.vector = vector
+        self.response = response
+        self.document_ids = document_ids
+        self.expires_at = expires_at
+        self.cost_ms = cost_ms
+
+
+class SemanticAnswerCache:
+    """
+    Finished answers keyed by model and retrieved context, matched on query
+    similarity. A hit needs the exact same chunks in the prompt, so edited
+    or new documents that change retrieval miss automatically; entries that
+    cite a changed document are also dropped by ``invalidate_documents``.
+
+    Only meant for turns without conversation history, where the answer
+    depends on nothing but the question and the context.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, str], List[_Entry]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_ms = 0.0
+
+    def get(self, model: str, docs: Sequence[Document], query_vector: Sequence[float]) -> Optional[ChatResponse]:
+        bucket = (model, context_key(docs))
+        query = _normalize(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            best, best_similarity = None, self.similarity_threshold
+            for entry in list(self._buckets.get(bucket, ())):
+                if entry.expires_at < now:
+                    self._remove(entry)
+                    continue
+                similarity = sum(a * b for a, b in zip(query, entry.vector))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+            if best is None:
+                self.misses += 1
+                registry.counter("answer_cache_requests_total", "Answer cache lookups").inc(result="miss")
+                return None
+            self._entries.move_to_end(best.id)
+            self.hits += 1
+            self.saved_ms += best.cost_ms
+        registry.counter("answer_cache_requests_total", "Answer cache lookups").inc(result="hit")
+        return best.response
+
+    def put(
+        self,
+        model: str,
+        docs: Sequence[Document],
+        query_vector: Sequence[float],
+        response: ChatResponse,
+        cost_ms: float = 0.0
+    ):
+        document_ids = {doc.metadata.get("document_id") for doc in docs} - {None}
+        entry = _Entry(
+            (model, context_key(docs)), _normalize(query_vector), response,
+            document_ids, time.monotonic() + self.ttl_seconds, cost_ms
+        )
+        with self._lock:
+            self._entries[entry.id] = entry
+            self._buckets.setdefault(entry.bucket, []).append(entry)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries.values())))
+                self.evictions += 1
+            registry.gauge("answer_cache_entries", "Cached answers").set(len(self._entries))
+
+    def invalidate_documents(self, document_ids: Iterable[str]):
+        """Drop every answer whose context came from one of these documents"""
+        changed: Set[str] = set(document_ids)
+        if not changed:
+            return
+        with self._lock:
+            stale = [entry for entry in self._entries.values() if entry.document_ids & changed]
+            for entry in stale:
+                self._remove(entry)
+            self.invalidations += len(stale)
+            registry.gauge("answer_cache_entries", "Cached answers").set(len(self._entries))
+
+    def _remove(self, entry: _Entry):
+        self._entries.pop(entry.id, None)
+        bucket = self._buckets.get(entry.bucket)
+        if bucket is not None:
+            if entry in bucket:
+                bucket.remove(entry)
+            if not bucket:
+                del self._buckets[entry.bucket]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "saved_ms": round(self.saved_ms, 1),
+            }
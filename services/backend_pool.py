@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence
+from services.metrics import registry
+
+
+class NoHealthyBackendError(Exception):
+    """Raised when every backend in a pool is marked down"""
+
+
+def is_client_error(error: Optional[BaseException]) -> bool:
+    """An HTTP 4xx other than 429: the request was at fault, not the host"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class Backend:
+    """One Ollama host, with its in-flight count, health and latency stats"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.ewma_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def is_available(self, now: float) -> bool:
+        return self.healthy or now >= self.down_until
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "mean_ms": round(self.total_seconds / self.requests * 1000, 1) if self.requests else None,
+            "ewma_ms": round(self.ewma_seconds * 1000, 1) if self.ewma_seconds is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """
+    Routes requests for one role (``chat`` or ``embedding``) across several
+    Ollama hosts, picking the available backend with the fewest requests in
+    flight and breaking ties by recent latency.
+
+    A backend is taken out of rotation after ``failure_threshold`` errors in
+    a row and tried again after ``cooldown_seconds`` or as soon as a health
+    check (``GET /api/tags``) succeeds. Client errors (4xx, see
+    ``is_client_error``) say nothing about the host and are not counted.
+    Safe to use from worker threads and the event loop alike.
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        role: str = "chat",
+        failure_threshold: int = 2,
+        cooldown_seconds: float = 30.0,
+        health_check_interval: float = 15.0,
+        health_check_timeout: float = 2.0
+    ):
+        if not urls:
+            raise ValueError(f"No backends configured for {role}")
+        self.role = role
+        self.backends: List[Backend] = [Backend(url) for url in urls]
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_seconds = cooldown_seconds
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_urls(cls, urls: str, role: str = "chat", **kwargs) -> "BackendPool":
+        """Build a pool from a comma-separated list of base URLs"""
+        return cls([url.strip() for url in urls.split(",") if url.strip()], role=role, **kwargs)
+
+    def pick(self, exclude: Sequence[Backend] = ()) -> Backend:
+        """Reserve the least-loaded available backend; pair with ``release``"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.is_available(now)]
+            if not candidates:
+                # Everything is down: try the one that failed longest ago rather than nothing
+                candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                raise NoHealthyBackendError(f"No {self.role} backend available")
+            backend = min(
+                candidates,
+                key=lambda b: (b.outstanding, b.ewma_seconds if b.ewma_seconds is not None else 0.0)
+            )
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend: Backend, seconds: Optional[float] = None, error: Optional[BaseException] = None):
+        """Return a reservation, recording its latency or the error it hit"""
+        client_error = is_client_error(error)
+        with self._lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            if client_error:
+                backend.last_error = str(error)
+            elif error is None:
+                backend.consecutive_failures = 0
+                backend.healthy = True
+                if seconds is not None:
+                    backend.total_seconds += seconds
+                    backend.ewma_seconds = seconds if backend.ewma_seconds is None else (
+                        0.8 * backend.ewma_seconds + 0.2 * seconds
+                    )
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                backend.last_error = str(error)
+                if backend.consecutive_failures >= self.failure_threshold:
+                    backend.healthy = False
+                    backend.down_until = time.monotonic() + self.cooldown_seconds
+        labels = {"backend": backend.url, "role": self.role}
+        if error is None and seconds is not None:
+            registry.histogram("backend_request_seconds", "Latency of requests to each Ollama host").observe(
+                seconds, **labels
+            )
+        if error is None:
+            outcome = "ok"
+        else:
+            outcome = "client_error" if client_error else "error"
+        registry.counter("backend_requests_total", "Requests to each Ollama host").inc(outcome=outcome, **labels)
+
+    @contextmanager
+    def acquire(self, exclude: Sequence[Backend] = ()) -> Iterator[Backend]:
+        """Hold a backend for one request, timing it and recording failures"""
+        backend = self.pick(exclude)
+        start = time.perf_counter()
+        try:
+            yield backend
+        except Exception as e:
+            self.release(backend, error=e)
+            raise
+        self.release(backend, time.perf_counter() - start)
+
+    def check_health(self):
+        """Probe every backend once and update its health flag"""
+        for backend in self.backends:
+            try:
+                with urllib.request.urlopen(f"{backend.url}/api/tags", timeout=self.health_check_timeout) as r:
+                    json.loads(r.read())
+                healthy, error = True, None
+            except Exception as e:
+                healthy, error = False, str(e)
+            with self._lock:
+                if healthy:
+                    backend.healthy = True
+                    backend.consecutive_failures = 0
+                elif backend.healthy:
+                    print(f"{self.role} backend {backend.url} failed health check: {error}")
+                    backend.healthy = False
+                    backend.down_until = time.monotonic() + self.cooldown_seconds
+                if error:
+                    backend.last_error = error
+            registry.gauge("backend_healthy", "1 if the Ollama host passed its last check").set(
+                1 if healthy else 0, backend=backend.url, role=self.role
+            )
+
+    def start_health_checks(self):
+        """Probe backends on a daemon thread every ``health_check_interval`` seconds"""
+        if self._health_thread is not None or self.health_check_interval <= 0:
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                self.check_health()
+                self._stop.wait(self.health_check_interval)
+
+        self._health_thread = threading.Thread(target=loop, name=f"{self.role}-health", daemon=True)
+        self._health_thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
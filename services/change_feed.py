@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from uuid import uuid4
+
+
+class ChangeFeed:
+    """
+    Change notifications between worker processes sharing one data
+    directory. A process publishes what it changed as (topic, key) rows in
+    a SQLite table; every other process picks them up on its next poll and
+    hands the keys to the callbacks subscribed to that topic. Processes
+    never see their own rows.
+
+    ``start()`` polls on a background thread every ``poll_interval``
+    seconds; ``poll()`` can also be called directly, e.g. before serving a
+    request. An idle poll costs one ``PRAGMA data_version`` read. Rows are
+    pruned after ``retention_seconds``; a process only replays changes made
+    after it started, since it loads everything older from disk.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.5, retention_seconds: float = 3600):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.origin = f"{os.getpid()}-{uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                key TEXT,
+                origin TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS changes_created_at ON changes (created_at);
+            """
+        )
+        self._conn.commit()
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._subscribers: Dict[str, List[Callable[[Set[Optional[str]]], None]]] = {}
+        self._published = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.applied = 0
+
+    def subscribe(self, topic: str, callback: Callable[[Set[Optional[str]]], None]):
+        """Call ``callback(keys)`` with the keys other processes published on ``topic``"""
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic: str, keys: Iterable[Optional[str]] = ()):
+        """Announce a change; with no keys, subscribers get ``{None}``"""
+        keys = list(keys) or [None]
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO changes (topic, key, origin, created_at) VALUES (?, ?, ?, ?)",
+                [(topic, key, self.origin, now) for key in keys]
+            )
+            self._published += 1
+            if self._published % 256 == 0:
+                self._conn.execute("DELETE FROM changes WHERE created_at < ?", (now - self.retention_seconds,))
+            self._conn.commit()
+
+    def poll(self) -> int:
+        """Apply changes published by other processes since the last poll; returns how many"""
+        with self._poll_lock:
+            with self._lock:
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version == self._data_version:
+                    return 0
+                self._data_version = data_version
+                rows = self._conn.execute(
+                    "SELECT seq, topic, key, origin FROM changes WHERE seq > ? ORDER BY seq", (self._last_seq,)
+                ).fetchall()
+            if not rows:
+                return 0
+            self._last_seq = rows[-1][0]
+            changed: Dict[str, Set[Optional[str]]] = {}
+            for _, topic, key, origin in rows:
+                if origin != self.origin:
+                    changed.setdefault(topic, set()).add(key)
+            # Callbacks run outside the connection lock so they may publish themselves
+            for topic, keys in changed.items():
+                for callback in self._subscribers.get(topic, ()):
+                    try:
+                        callback(keys)
+                    except Exception as e:
+                        print(f"Change feed callback for {topic} failed: {str(e)}")
+            applied = sum(len(keys) for keys in changed.values())
+            self.applied += applied
+            return applied
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                print(f"Change feed poll failed: {str(e)}")
+
+    def stats(self) -> dict:
+        return {"origin": self.origin, "last_seq": self._last_seq, "applied": self.applied}
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 2)
+        with self._lock:
+            self._conn.close()
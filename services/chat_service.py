@@ -1,158 +1,328 @@
+import asyncio
 import os
-from typing import Optional, List, AsyncGenerator
+import time
+from typing import Optional, List, AsyncGenerator, Awaitable, Callable
 from uuid import uuid4
-from fastapi import WebSocket
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, SystemMessage
 from models.schemas import ChatResponse, Source
-from langchain.prompts import ChatPromptTemplate
-import json
-import asyncio
+from services.stream_protocol import (
+    get_stream_encoder, ReasoningSplitter, STREAM_PROTOCOL_DELTA, CHANNEL_REASONING
+)
+from services.embeddings import create_embeddings, DEFAULT_OLLAMA_BASE_URL
+from services.vector_store import SharedVectorStore
+from services.conversation_store import ConversationStore
+from services.prompt_builder import PromptBuilder, PromptResult
+from services.metrics import registry, tracer
+from services.backend_pool import Backend, BackendPool, is_client_error
+from services.reranking import RetrievalPipeline
+from services.answer_cache import SemanticAnswerCache
+from services.generation_scheduler import (
+    GenerationScheduler, SchedulerFullError, QueueTimeoutError, GenerationCancelledError
+)
+
+TOKEN_COUNT_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)
+
 
 class ChatService:
-    def __init__(self, db_directory: str):
+    def __init__(
+        self,
+        db_directory: str,
+        vector_store: Optional[SharedVectorStore] = None,
+        embeddings: Optional[Embeddings] = None,
+        store: Optional[ConversationStore] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        retrieval_k: int = 3,
+        dense_k: int = 20,
+        lexical_k: int = 20,
+        chat_model: str = "deepseek-r1:32b",
+        ollama_base_url: str = DEFAULT_OLLAMA_BASE_URL,
+        scheduler: Optional[GenerationScheduler] = None,
+        disconnect_poll_seconds: float = 1.0,
+        chat_pool: Optional[BackendPool] = None,
+        max_failovers: Optional[int] = None,
+        retrieval_pipeline: Optional[RetrievalPipeline] = None,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        store_reasoning: bool = False
+    ):
         self.db_directory = db_directory
-        self.conversations_dir = os.path.join(db_directory, "conversations")
-        if not os.path.exists(self.conversations_dir):
-            os.makedirs(self.conversations_dir)
-            
-        self.embeddings = OllamaEmbeddings(model="deepseek-r1:32b")
-        self.llm = ChatOllama(
-            model="deepseek-r1:32b",
-            temperature=0.7,
-            streaming=True
-        )
-        self.conversations = self._load_conversations()
+        os.makedirs(db_directory, exist_ok=True)
+
+        self.embeddings = embeddings or (vector_store.embeddings if vector_store else create_embeddings())
+        self.vector_store = vector_store or SharedVectorStore(db_directory, self.embeddings)
+        self.chat_model = chat_model
+        self.chat_pool = chat_pool or BackendPool([ollama_base_url], role="chat")
+        self.max_failovers = len(self.chat_pool.backends) - 1 if max_failovers is None else max_failovers
+        # Chat clients are built per backend on first use (see warm_up)
+        self._llms: dict = {}
+        self.store = store or ConversationStore(db_directory)
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.retrieval_k = retrieval_k
+        self.dense_k = dense_k
+        self.lexical_k = lexical_k
+        self.retrieval_pipeline = retrieval_pipeline
+        self.answer_cache = answer_cache
+        # Keep <think> traces in the conversation store (never in the messages themselves)
+        self.store_reasoning = store_reasoning
+        self.scheduler = scheduler or GenerationScheduler()
+        self.disconnect_poll_seconds = disconnect_poll_seconds
         
         self.system_message = SystemMessage(content="""You are a helpful AI assistant that answers questions based on the provided context. 
 Always provide detailed, accurate responses and cite your sources when possible. 
 When you're thinking or analyzing, start your response with '<think>' and end with '</think>' before providing your final answer.""")
 
-    def _load_conversations(self) -> dict:
-        """Load all conversations from disk"""
-        conversations = {}
-        if os.path.exists(self.conversations_dir):
-            for filename in os.listdir(self.conversations_dir):
-                if filename.endswith('.json'):
-                    conv_id = filename[:-5]  # Remove .json extension
-                    filepath = os.path.join(self.conversations_dir, filename)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            conv_data = json.load(f)
-                            # Reconstruct ChatResponse objects
-                            if 'messages' in conv_data:
-                                conv_data['messages'] = [
-                                    ChatResponse(**msg) if isinstance(msg, dict) else msg 
-                                    for msg in conv_data['messages']
-                                ]
-                            # Initialize vectorstore
-                            conv_data['vectorstore'] = Chroma(
-                                persist_directory=self.db_directory,
-                                embedding_function=self.embeddings
-                            )
-                            conversations[conv_id] = conv_data
-                    except Exception as e:
-                        print(f"Error loading conversation {conv_id}: {str(e)}")
-        return conversations
-
-    def _save_conversation(self, conversation_id: str):
-        """Save a conversation to disk"""
-        if conversation_id in self.conversations:
-            filepath = os.path.join(self.conversations_dir, f"{conversation_id}.json")
-            conv_data = self.conversations[conversation_id].copy()
-            # Remove non-serializable objects
-            conv_data.pop('vectorstore', None)
-            # Convert ChatResponse objects to dicts
-            if 'messages' in conv_data:
-                conv_data['messages'] = [
-                    msg.model_dump() if hasattr(msg, 'model_dump') else msg 
-                    for msg in conv_data['messages']
-                ]
-            try:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(conv_data, f, indent=2, ensure_ascii=False)
-            except Exception as e:
-                print(f"Error saving conversation {conversation_id}: {str(e)}")
+    def _llm_for(self, backend: Backend):
+        llm = self._llms.get(backend.url)
+        if llm is None:
+            # langchain_community is slow to import; defer it to the first chat
+            from langchain_community.chat_models import ChatOllama
+            llm = self._llms[backend.url] = ChatOllama(
+                model=self.chat_model,
+                base_url=backend.url,
+                temperature=0.7,
+                streaming=True
+            )
+        return llm
+
+    def warm_up(self):
+        """Build the chat clients ahead of the first request"""
+        for backend in self.chat_pool.backends:
+            self._llm_for(backend)
 
     def _get_or_create_conversation(self, conversation_id: Optional[str] = None) -> dict:
         """Get or create a conversation with proper initialization"""
-        if conversation_id and conversation_id in self.conversations:
-            return self.conversations[conversation_id]
-        
+        if conversation_id:
+            conversation = self.store.get(conversation_id)
+            if conversation is not None:
+                return conversation
+
         new_id = conversation_id or str(uuid4())
-        vectorstore = Chroma(
-            persist_directory=self.db_directory,
-            embedding_function=self.embeddings
+        return self.store.create(new_id)
+
+    def _build_prompt(self, conversation: dict, message: str, docs: list) -> PromptResult:
+        """
+        Assemble the prompt from persisted messages. Turns older than the
+        verbatim window are folded into a cached running summary first.
+        """
+        conv_id = conversation['id']
+        window = self.prompt_builder.max_history_turns
+        summary, summarized_through = self.store.get_summary(conv_id)
+        cutoff = max(0, conversation['message_count'] - window)
+        if cutoff > summarized_through:
+            older = self.store.get_messages(conv_id, offset=summarized_through, limit=cutoff - summarized_through)
+            summary = self.prompt_builder.update_summary(summary, older)
+            self.store.set_summary(conv_id, summary, cutoff)
+
+        recent = self.store.get_recent_messages(conv_id, window)
+        return self.prompt_builder.build(
+            system_prompt=self.system_message.content,
+            question=message,
+            docs=docs,
+            recent_turns=recent,
+            summary=summary
         )
-        
-        self.conversations[new_id] = {
-            'id': new_id,
-            'vectorstore': vectorstore,
-            'history': [],
-            'messages': []
-        }
-        self._save_conversation(new_id)
-        return self.conversations[new_id]
-
-    async def get_streaming_response(self, message: str, conversation_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+
+    async def get_streaming_response(
+        self,
+        message: str,
+        conversation_id: Optional[str] = None,
+        protocol: str = STREAM_PROTOCOL_DELTA,
+        client_id: Optional[str] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        retrieval_filter: Optional[dict] = None,
+        include_reasoning: bool = False
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream an answer. Generation waits for a slot from the scheduler,
+        queued fairly by ``client_id`` (or the conversation id if not given).
+        ``is_disconnected`` is polled so an abandoned stream stops pulling
+        tokens from the model. ``retrieval_filter`` is a Chroma ``where``
+        clause limiting which chunks can be retrieved.
+
+        The model's ``<think>`` reasoning is split from the answer as tokens
+        arrive; it is streamed only if ``include_reasoning`` is set and is
+        never saved as part of the message.
+        """
+        encoder = None
+        ticket = None
+        request_start = time.perf_counter()
         try:
             # Setup conversation
             conversation = self._get_or_create_conversation(conversation_id)
-            vectorstore = conversation['vectorstore']
-            history = conversation['history']
             conv_id = conversation['id']
 
-            # Search for relevant documents
-            docs = vectorstore.similarity_search(message, k=3)
-            context = "\n".join(doc.page_content for doc in docs)
-            
-            # Create sources list
+            # Search for relevant documents (dense + BM25, fused by rank, then deduped and diversified).
+            # Embedding calls and reranking block, so they run off the event loop serving other streams.
+            retrieval_stages = None
+            with tracer.span("chat.retrieval", conversation_id=conv_id) as retrieval_span:
+                if self.retrieval_pipeline is not None:
+                    result = await asyncio.to_thread(
+                        self.retrieval_pipeline.retrieve, message, k=self.retrieval_k, filter=retrieval_filter
+                    )
+                    docs = result.docs
+                    retrieval_stages = result.timings_ms
+                else:
+                    docs = await asyncio.to_thread(
+                        self.vector_store.hybrid_search,
+                        message,
+                        k=self.retrieval_k,
+                        dense_k=self.dense_k,
+                        lexical_k=self.lexical_k,
+                        filter=retrieval_filter
+                    )
+                retrieval_span.set(chunks=len(docs), filtered=retrieval_filter is not None)
+
+            # Pack system message, context and history into the token budget
+            with tracer.span("chat.prompt_build", conversation_id=conv_id) as build_span:
+                prompt = self._build_prompt(conversation, message, docs)
+                build_span.set(prompt_tokens=prompt.prompt_tokens)
+            registry.histogram(
+                "chat_prompt_tokens", "Prompt size in tokens", buckets=TOKEN_COUNT_BUCKETS
+            ).observe(prompt.prompt_tokens)
+
+            # Create sources list from the chunks that made it into the prompt
             sources = [
                 Source(
                     document_name=doc.metadata.get("document_name", "Unknown"),
                     page_number=doc.metadata.get("page_number", 1),
                     content_snippet=doc.page_content[:200] + "..."
                 )
-                for doc in docs
+                for doc in prompt.context_docs
             ]
 
-            # Send initial thinking state
+            # Send initial thinking state (sources go out once, here)
+            encoder = get_stream_encoder(protocol, sources, conv_id, message)
             thinking_response = "<think>Analyzing the context and formulating a response...</think>\n"
-            yield json.dumps({
-                "response": thinking_response,
-                "sources": [s.model_dump() for s in sources],
-                "conversation_id": conv_id,
-                "user_message": message
-            }) + "\n"
+            yield encoder.start(thinking_response)
+
+            # A first question over the same context as an earlier one can reuse its answer
+            query_vector = None
+            if self.answer_cache is not None and conversation['message_count'] == 0:
+                query_vector = await asyncio.to_thread(self.vector_store.embed_query, message)
+                cached = await asyncio.to_thread(
+                    self.answer_cache.get, self.chat_model, prompt.context_docs, query_vector
+                )
+                if cached is not None:
+                    yield encoder.token(cached.response)
+                    chat_response = ChatResponse(
+                        response=cached.response,
+                        sources=sources,
+                        conversation_id=conv_id,
+                        user_message=message
+                    )
+                    with tracer.span("chat.save_conversation", conversation_id=conv_id):
+                        self.store.append_message(conv_id, chat_response)
+                    total_s = time.perf_counter() - request_start
+                    registry.histogram("chat_request_seconds", "Whole /chat stream duration").observe(total_s)
+                    registry.counter("chat_requests_total", "Finished chat requests").inc(outcome="cached")
+                    final_line = encoder.end(chat_response, {
+                        "answer_cache_hit": True,
+                        "context_chunks": len(prompt.context_docs),
+                        "retrieval_ms": round(retrieval_span.duration * 1000, 2),
+                        "total_ms": round(total_s * 1000, 1)
+                    })
+                    if final_line:
+                        yield final_line
+                    return
 
             # Small delay to show thinking state
             await asyncio.sleep(0.5)
 
-            try:
-                # Create message list with system message and context
-                messages = [
-                    self.system_message,
-                    HumanMessage(content=f"Context: {context}\n\nQuestion: {message}")
-                ]
-
-                # Add conversation history if it exists
-                if history:
-                    messages.extend(history[-4:])  # Add last 2 exchanges (4 messages)
+            # Wait for a generation slot, telling the client where it is in line
+            ticket = self.scheduler.enqueue(client_id or conv_id)
+            async for position in self.scheduler.wait(ticket, is_disconnected=is_disconnected):
+                if position > 0:
+                    yield encoder.queued(position)
 
+            try:
                 # Start the streaming response
-                full_response = ""
-                async for chunk in self.llm.astream(messages):
-                    if hasattr(chunk, 'content'):
-                        full_response += chunk.content
-                        yield json.dumps({
-                            "response": full_response,
-                            "sources": [s.model_dump() for s in sources],
-                            "conversation_id": conv_id,
-                            "user_message": message
-                        }) + "\n"
+                first_token_at = None
+                completion_tokens = 0
+                next_disconnect_check = time.perf_counter() + self.disconnect_poll_seconds
+                failed_backends: List[Backend] = []
+                splitter = ReasoningSplitter()
+                while True:
+                    exclude = failed_backends if len(failed_backends) < len(self.chat_pool.backends) else []
+                    backend = self.chat_pool.pick(exclude=exclude)
+                    messages = prompt.messages
+                    if splitter.raw:
+                        # Failing over mid-answer: Ollama continues a trailing assistant message
+                        messages = messages + [AIMessage(content=splitter.raw)]
+                    backend_start = time.perf_counter()
+                    stream = self._llm_for(backend).astream(messages)
+                    try:
+                        async for chunk in stream:
+                            if hasattr(chunk, 'content') and chunk.content:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                completion_tokens += 1
+                                for channel, text in splitter.feed(chunk.content):
+                                    if channel != CHANNEL_REASONING:
+                                        yield encoder.token(text)
+                                    elif include_reasoning:
+                                        yield encoder.reasoning(text)
+                            if is_disconnected is not None and time.perf_counter() >= next_disconnect_check:
+                                next_disconnect_check = time.perf_counter() + self.disconnect_poll_seconds
+                                if await is_disconnected():
+                                    raise GenerationCancelledError("Client disconnected mid-stream")
+                    except GenerationCancelledError:
+                        self.chat_pool.release(backend, time.perf_counter() - backend_start)
+                        raise
+                    except Exception as e:
+                        self.chat_pool.release(backend, error=e)
+                        # A rejected request (e.g. unknown model) would be rejected by every host
+                        if is_client_error(e):
+                            raise
+                        failed_backends.append(backend)
+                        if len(failed_backends) > self.max_failovers:
+                            raise
+                        print(f"Chat backend {backend.url} failed ({str(e)}), failing over")
+                        registry.counter("chat_failovers_total", "Generations moved to another backend").inc()
+                        continue
+                    except BaseException:
+                        # Cancelled or closed by the server; the backend did nothing wrong
+                        self.chat_pool.release(backend, time.perf_counter() - backend_start)
+                        raise
+                    finally:
+                        # Closing the stream drops the Ollama connection, which stops generation
+                        await stream.aclose()
+                    self.chat_pool.release(backend, time.perf_counter() - backend_start)
+                    break
+                for channel, text in splitter.flush():
+                    if channel != CHANNEL_REASONING:
+                        yield encoder.token(text)
+                    elif include_reasoning:
+                        yield encoder.reasoning(text)
+                generation_end = time.perf_counter()
+                full_response = splitter.answer
+
+                first_token_ms = None
+                tokens_per_second = None
+                if first_token_at is not None:
+                    first_token_ms = (first_token_at - request_start) * 1000
+                    registry.histogram(
+                        "chat_time_to_first_token_seconds", "Request start to first streamed token"
+                    ).observe(first_token_ms / 1000)
+                    if generation_end > first_token_at and completion_tokens > 1:
+                        # Chunks from Ollama carry one token each
+                        tokens_per_second = (completion_tokens - 1) / (generation_end - first_token_at)
+                        registry.histogram(
+                            "chat_tokens_per_second", "Generation rate after the first token",
+                            buckets=TOKEN_RATE_BUCKETS
+                        ).observe(tokens_per_second)
+                registry.histogram(
+                    "chat_completion_tokens", "Streamed tokens per answer", buckets=TOKEN_COUNT_BUCKETS
+                ).observe(completion_tokens)
+                # Reasoning left out of the saved answer is prompt budget later turns don't spend on it
+                reasoning = splitter.reasoning
+                reasoning_tokens = self.prompt_builder.counter.count(reasoning)
+                registry.histogram(
+                    "chat_reasoning_tokens", "Reasoning tokens per answer", buckets=TOKEN_COUNT_BUCKETS
+                ).observe(reasoning_tokens)
+                registry.counter(
+                    "chat_history_tokens_saved_total", "Reasoning tokens kept out of stored history"
+                ).inc(reasoning_tokens)
 
                 # Create the final chat response
                 chat_response = ChatResponse(
@@ -162,40 +332,89 @@ When you're thinking or analyzing, start your response with '<think>' and end wi
                     user_message=message
                 )
 
-                # Update conversation history
-                history.extend([
-                    HumanMessage(content=message),
-                    AIMessage(content=full_response)
-                ])
-                
-                # Store the complete message and save
-                conversation['messages'].append(chat_response)
-                self._save_conversation(conv_id)
+                # Append the complete message to the conversation log
+                with tracer.span("chat.save_conversation", conversation_id=conv_id):
+                    self.store.append_message(
+                        conv_id, chat_response, reasoning=reasoning if self.store_reasoning else None
+                    )
+
+                total_s = time.perf_counter() - request_start
+                if query_vector is not None:
+                    self.answer_cache.put(
+                        self.chat_model, prompt.context_docs, query_vector, chat_response, cost_ms=total_s * 1000
+                    )
+                registry.histogram("chat_request_seconds", "Whole /chat stream duration").observe(total_s)
+                registry.counter("chat_requests_total", "Finished chat requests").inc(outcome="ok")
+                stats = {
+                    "prompt_tokens": prompt.prompt_tokens,
+                    "context_chunks": len(prompt.context_docs),
+                    "history_turns": prompt.history_turns,
+                    "summary_included": prompt.summary_included,
+                    "retrieval_ms": round(retrieval_span.duration * 1000, 2),
+                    "retrieval_stages_ms": retrieval_stages,
+                    "prompt_build_ms": round(build_span.duration * 1000, 2),
+                    "queue_wait_ms": round(ticket.wait_seconds * 1000, 1),
+                    "backend": backend.url,
+                    "failovers": len(failed_backends),
+                    "time_to_first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+                    "completion_tokens": completion_tokens,
+                    "reasoning_tokens": reasoning_tokens,
+                    "tokens_per_second": round(tokens_per_second, 2) if tokens_per_second else None,
+                    "total_ms": round(total_s * 1000, 1)
+                }
+
+                final_line = encoder.end(chat_response, stats)
+                if final_line:
+                    yield final_line
 
+            except GenerationCancelledError:
+                raise
             except Exception as e:
                 print(f"Streaming error: {str(e)}")
                 raise
 
+        except (GenerationCancelledError, asyncio.CancelledError) as e:
+            # Nobody is listening any more; don't save a half answer
+            print(f"Chat stream cancelled: {str(e) or 'client disconnected'}")
+            registry.counter("chat_requests_total", "Finished chat requests").inc(outcome="cancelled")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        except (SchedulerFullError, QueueTimeoutError) as e:
+            print(f"Chat request shed: {str(e)}")
+            registry.counter("chat_requests_total", "Finished chat requests").inc(outcome="shed")
+            if encoder is None:
+                encoder = get_stream_encoder(protocol, [], conv_id, message)
+            yield encoder.error("The assistant is busy right now. Please try again in a moment.")
         except Exception as e:
             print(f"Error during chat: {str(e)}")
-            error_response = {
-                "response": "I apologize, but I encountered an error while processing your request.",
-                "sources": [s.model_dump() for s in sources] if 'sources' in locals() else [],
-                "conversation_id": conv_id if 'conv_id' in locals() else str(uuid4()),
-                "user_message": message
-            }
-            yield json.dumps(error_response) + "\n"
-
-    def get_conversation_history(self, conversation_id: str) -> list[ChatResponse]:
-        """Get the complete conversation history"""
-        if conversation_id not in self.conversations:
+            registry.counter("chat_requests_total", "Finished chat requests").inc(outcome="error")
+            error_message = "I apologize, but I encountered an error while processing your request."
+            if encoder is None:
+                encoder = get_stream_encoder(
+                    protocol,
+                    sources if 'sources' in locals() else [],
+                    conv_id if 'conv_id' in locals() else str(uuid4()),
+                    message
+                )
+            yield encoder.error(error_message)
+        finally:
+            if ticket is not None:
+                self.scheduler.release(ticket)
+
+    def get_conversation_history(
+        self,
+        conversation_id: str,
+        offset: int = 0,
+        limit: Optional[int] = None
+    ) -> list[ChatResponse]:
+        """Get the conversation history, optionally one page at a time"""
+        if not self.store.exists(conversation_id):
             print(f"Conversation {conversation_id} not found")
-            print(f"Available conversations: {list(self.conversations.keys())}")
             return []
-            
-        conversation = self.conversations[conversation_id]
-        if 'messages' not in conversation:
-            print(f"No messages in conversation {conversation_id}")
-            return []
-            
-        return conversation['messages'] 
\ No newline at end of file
+        return self.store.get_messages(conversation_id, offset=offset, limit=limit)
+
+    def count_messages(self, conversation_id: str) -> Optional[int]:
+        """Number of stored messages, or None if the conversation does not exist"""
+        if not self.store.exists(conversation_id):
+            return None
+        return self.store.count_messages(conversation_id)
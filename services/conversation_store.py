@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+from models.schemas import ChatResponse
+
+
+class ConversationStore:
+    """
+    SQLite-backed conversation storage.
+
+    Conversations are loaded only when first accessed and kept in a
+    bounded LRU of hot conversations. Each answer is appended as one row,
+    so the cost of a turn does not grow with the length of the history.
+    JSON files from the old one-file-per-conversation layout are imported
+    lazily the first time their conversation is requested.
+
+    Model reasoning is kept out of the messages table; when it is stored
+    at all it goes in ``reasoning``, keyed by the message it belongs to.
+
+    Several worker processes can share the database. Appends allocate
+    their sequence number inside an IMMEDIATE transaction, and the hot
+    cache is dropped whenever ``PRAGMA data_version`` shows another
+    process has committed, so cached message counts never go stale.
+    """
+
+    def __init__(self, db_directory: str, cache_size: int = 256):
+        self.db_directory = db_directory
+        self.legacy_dir = os.path.join(db_directory, "conversations")
+        self.path = os.path.join(db_directory, "conversations.sqlite3")
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS reasoning (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                trace TEXT NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS summaries (
+                conversation_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                summarized_through INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _drop_cache_if_changed_elsewhere(self):
+        """Forget cached conversations if another process wrote to the database"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._cache.clear()
+
+    def _legacy_path(self, conversation_id: str) -> str:
+        return os.path.join(self.legacy_dir, f"{conversation_id}.json")
+
+    def _import_legacy(self, conversation_id: str) -> bool:
+        """Import an old-style JSON conversation file into the database"""
+        filepath = self._legacy_path(conversation_id)
+        if not os.path.exists(filepath):
+            return False
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                conv_data = json.load(f)
+        except FileNotFoundError:
+            # Another worker imported it between the check and the open
+            with self._lock:
+                return self._exists_in_db(conversation_id)
+        except Exception as e:
+            print(f"Error loading conversation {conversation_id}: {str(e)}")
+            return False
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO conversations (id, created_at) VALUES (?, ?)",
+                (conversation_id, now)
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO messages (conversation_id, seq, payload, created_at) VALUES (?, ?, ?, ?)",
+                [
+                    (conversation_id, seq, json.dumps(msg, ensure_ascii=False), now)
+                    for seq, msg in enumerate(conv_data.get('messages', []))
+                ]
+            )
+            self._conn.commit()
+        # Both inserts ignore rows that exist, so a worker importing the same file concurrently is harmless
+        try:
+            os.replace(filepath, filepath + ".imported")
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _exists_in_db(self, conversation_id: str) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return row is not None
+
+    def exists(self, conversation_id: str) -> bool:
+        with self._lock:
+            if conversation_id in self._cache or self._exists_in_db(conversation_id):
+                return True
+        return self._import_legacy(conversation_id)
+
+    def _remember(self, conversation: dict):
+        self._cache[conversation['id']] = conversation
+        self._cache.move_to_end(conversation['id'])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, conversation_id: str) -> Optional[dict]:
+        """Return the hot state of a conversation, loading it on first access"""
+        with self._lock:
+            self._drop_cache_if_changed_elsewhere()
+            conversation = self._cache.get(conversation_id)
+            if conversation is not None:
+                self._cache.move_to_end(conversation_id)
+                return conversation
+        if not self.exists(conversation_id):
+            return None
+        conversation = {
+            'id': conversation_id,
+            'message_count': self.count_messages(conversation_id)
+        }
+        with self._lock:
+            self._remember(conversation)
+        return conversation
+
+    def create(self, conversation_id: str) -> dict:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO conversations (id, created_at) VALUES (?, ?)",
+                (conversation_id, time.time())
+            )
+            self._conn.commit()
+            conversation = {'id': conversation_id, 'message_count': 0}
+            self._remember(conversation)
+        return conversation
+
+    def append_message(self, conversation_id: str, message: ChatResponse, reasoning: Optional[str] = None):
+        """Append one finished turn to a conversation, with its reasoning trace if given"""
+        payload = json.dumps(message.model_dump(), ensure_ascii=False)
+        with self._lock:
+            # Take the write lock before reading MAX(seq), so two workers cannot pick the same one
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE conversation_id = ?", (conversation_id,)
+                ).fetchone()[0]
+                self._conn.execute(
+                    "INSERT INTO messages (conversation_id, seq, payload, created_at) VALUES (?, ?, ?, ?)",
+                    (conversation_id, seq, payload, time.time())
+                )
+                if reasoning:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO reasoning (conversation_id, seq, trace) VALUES (?, ?, ?)",
+                        (conversation_id, seq, reasoning)
+                    )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            conversation = self._cache.get(conversation_id)
+            if conversation is not None:
+                conversation['message_count'] += 1
+
+    def count_messages(self, conversation_id: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()[0]
+
+    def get_messages(self, conversation_id: str, offset: int = 0, limit: Optional[int] = None) -> List[ChatResponse]:
+        """Return messages in order, optionally one page at a time"""
+        self.exists(conversation_id)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM messages WHERE conversation_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (conversation_id, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [ChatResponse(**json.loads(payload)) for (payload,) in rows]
+
+    def get_recent_messages(self, conversation_id: str, count: int) -> List[ChatResponse]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+                (conversation_id, count)
+            ).fetchall()
+        return [ChatResponse(**json.loads(payload)) for (payload,) in reversed(rows)]
+
+    def get_reasoning(self, conversation_id: str, offset: int = 0, limit: Optional[int] = None) -> List[tuple[int, str]]:
+        """Return stored (message index, reasoning trace) pairs, in order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, trace FROM reasoning WHERE conversation_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (conversation_id, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [(seq, trace) for seq, trace in rows]
+
+    def get_summary(self, conversation_id: str) -> tuple[str, int]:
+        """Return the running summary and the number of leading messages it covers"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summarized_through FROM summaries WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def set_summary(self, conversation_id: str, summary: str, summarized_through: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (conversation_id, summary, summarized_through) VALUES (?, ?, ?)",
+                (conversation_id, summary, summarized_through)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,176 +1,478 @@
 import os
-import json
-import pandas as pd
-import docx2txt
-from pypdf import PdfReader
+import asyncio
+import hashlib
+import threading
+import time
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, Optional
+from concurrent.futures import ProcessPoolExecutor
 from fastapi import UploadFile
 from datetime import datetime
 from uuid import uuid4
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from models.schemas import DocumentInfo
+from langchain_core.embeddings import Embeddings
+from models.schemas import DocumentInfo, RetrievalFilter
+from services.ingestion_queue import JobCancelledError
+from services.embeddings import create_embeddings
+from services.vector_store import SharedVectorStore
+from services.document_store import DocumentStore
+from services.uploads import copy_stream
+from services.metrics import registry, tracer
+from services.extraction import (
+    STRUCTURED_CHUNK_TOKENS, Segment, count_pdf_pages, iter_pdf_segments, iter_docx_segments, iter_csv_segments,
+    iter_json_segments, iter_csv_records, iter_json_records, iter_record_segments
+)
+
+# numpy-backed; imported on first use
+if TYPE_CHECKING:
+    from services.structured_index import ColumnarWriter, StructuredIndex
+
+
+def _chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
 
 class DocumentProcessor:
-    def __init__(self, upload_dir: str, db_directory: str):
+    def __init__(
+        self,
+        upload_dir: str,
+        db_directory: str,
+        vector_store: Optional[SharedVectorStore] = None,
+        embeddings: Optional[Embeddings] = None,
+        embedding_batch_size: int = 128,
+        pdf_workers: int = 0,
+        pdf_parallel_min_pages: int = 20,
+        store: Optional[DocumentStore] = None,
+        max_upload_bytes: Optional[int] = None,
+        structured_ingestion: bool = True,
+        structured_chunk_tokens: int = STRUCTURED_CHUNK_TOKENS,
+        structured_index: Optional["StructuredIndex"] = None
+    ):
         self.upload_dir = upload_dir
         self.db_directory = db_directory
-        self.embeddings = OllamaEmbeddings(model="deepseek-r1:32b")
+        self.embeddings = embeddings or (vector_store.embeddings if vector_store else create_embeddings())
         self.metadata_file = os.path.join(upload_dir, "metadata.json")
+        self.embedding_batch_size = embedding_batch_size
+        self.pdf_workers = pdf_workers or min(4, os.cpu_count() or 1)
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        self.max_upload_bytes = max_upload_bytes
+        self.structured_ingestion = structured_ingestion
+        self.structured_chunk_tokens = structured_chunk_tokens
+        self._count_tokens: Optional[Callable[[str], int]] = None
+        self._pdf_executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.RLock()
         self._ensure_directories()
-        self.metadata = self._load_metadata()
+        self.vector_store = vector_store or SharedVectorStore(db_directory, self.embeddings)
+        # Shared with the other worker processes; metadata.json is only read to import it
+        self.store = store or DocumentStore(db_directory, legacy_metadata_file=self.metadata_file)
+        self._structured_index = structured_index
+        self._backfill_content_hashes()
         
+    @property
+    def structured_index(self) -> "StructuredIndex":
+        """Column files of CSV/JSON records, for filters that need no retrieval; opened on first use"""
+        if self._structured_index is None:
+            from services.structured_index import StructuredIndex
+            with self._lock:
+                if self._structured_index is None:
+                    self._structured_index = StructuredIndex(os.path.join(self.db_directory, "structured"))
+        return self._structured_index
+
     def _ensure_directories(self):
         """Create necessary directories if they don't exist"""
         os.makedirs(self.upload_dir, exist_ok=True)
         os.makedirs(self.db_directory, exist_ok=True)
         
-    def _load_metadata(self) -> dict:
-        """Load document metadata from file"""
-        if os.path.exists(self.metadata_file):
-            with open(self.metadata_file, 'r') as f:
-                return json.load(f)
-        return {}
-    
-    def _save_metadata(self):
-        """Save document metadata to file"""
-        with open(self.metadata_file, 'w') as f:
-            json.dump(self.metadata, f, indent=2, default=str)
-    
-    async def process_document(self, file: UploadFile) -> DocumentInfo:
-        """Process an uploaded document"""
+    def _update_metadata(self, doc_id: str, **fields):
+        """Update a document's metadata entry and persist it"""
+        self.store.update(doc_id, **fields)
+
+    def _file_path(self, doc_id: str, filename: str) -> str:
+        return os.path.join(self.upload_dir, f"{doc_id}_{filename}")
+
+    def _hash_file(self, file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _backfill_content_hashes(self):
+        """Hash documents uploaded before content hashes were recorded"""
+        for doc_data in self.store.all():
+            if doc_data.get("content_hash"):
+                continue
+            file_path = self._file_path(doc_data["id"], doc_data["filename"])
+            if os.path.exists(file_path):
+                self._update_metadata(doc_data["id"], content_hash=self._hash_file(file_path))
+
+    def find_by_content_hash(self, content_hash: str) -> Optional[DocumentInfo]:
+        """Return a live document with identical file content, if any"""
+        doc_data = self.store.find_by_content_hash(content_hash, self.vector_store.collection_name)
+        return DocumentInfo(**doc_data) if doc_data else None
+
+    def claim_for_reembedding(self) -> list[DocumentInfo]:
+        """
+        Documents embedded into another collection (by an earlier embedding
+        model), marked pending so the caller can queue them for ingestion
+        into the current one
+        """
+        return [
+            DocumentInfo(**doc_data)
+            for doc_data in self.store.claim_for_reembedding(self.vector_store.collection_name)
+        ]
+
+    async def save_upload(self, file: UploadFile) -> tuple[DocumentInfo, bool]:
+        """
+        Write an upload to disk and register it as pending, without embedding it.
+        Returns ``(doc_info, is_duplicate)``; for a file whose content was
+        already uploaded, the existing document is returned and nothing is stored.
+        """
+        return await asyncio.to_thread(self.save_stream, file.file, file.filename)
+
+    def save_stream(self, source: BinaryIO, filename: str) -> tuple[DocumentInfo, bool]:
+        """
+        Blocking half of ``save_upload`` for any readable binary stream (an
+        upload's spooled file or a zip member). The stream is copied in
+        fixed-size chunks and hashed on the way, so memory use does not
+        depend on the file size; raises UploadTooLargeError past
+        ``max_upload_bytes``.
+        """
+        print(f"Saving upload: {filename}")
+
+        # Generate unique ID for the document
+        doc_id = str(uuid4())
+        file_path = self._file_path(doc_id, filename)
+        print(f"Saving file to: {file_path}")
+
+        tmp_path = file_path + ".part"
+        content_hash, _ = copy_stream(source, tmp_path, self.max_upload_bytes)
+        os.replace(tmp_path, file_path)
+
+        doc_info = DocumentInfo(
+            id=doc_id,
+            filename=filename,
+            document_type=filename.split('.')[-1],
+            upload_date=datetime.now(),
+            total_pages=None,
+            status="queued",
+            embedding_status="pending",
+            content_hash=content_hash
+        )
+        existing = self.store.add_unless_duplicate(doc_info.model_dump(), self.vector_store.collection_name)
+        if existing is not None:
+            print(f"Duplicate of document {existing['id']}, skipping ingestion")
+            os.remove(file_path)
+            return DocumentInfo(**existing), True
+        return doc_info, False
+
+    def get_document(self, doc_id: str) -> Optional[DocumentInfo]:
+        doc_data = self.store.get(doc_id)
+        return DocumentInfo(**doc_data) if doc_data else None
+
+    def resolve_filter(self, retrieval_filter: Optional[RetrievalFilter]) -> Optional[dict]:
+        """
+        Turn a request's document filter into a Chroma ``where`` clause on
+        ``document_id``. Types and upload dates are matched against the
+        document metadata here, so chunks need no extra fields.
+        """
+        if retrieval_filter is None:
+            return None
+        f = retrieval_filter
+        if f.document_types is None and f.uploaded_after is None and f.uploaded_before is None:
+            if f.document_ids is None:
+                return None
+            return {"document_id": {"$in": list(f.document_ids)}}
+
+        def naive(value: datetime) -> datetime:
+            return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+        types = {t.lower().lstrip('.') for t in f.document_types} if f.document_types is not None else None
+        after = naive(f.uploaded_after) if f.uploaded_after else None
+        before = naive(f.uploaded_before) if f.uploaded_before else None
+        wanted = set(f.document_ids) if f.document_ids is not None else None
+        documents = [DocumentInfo(**doc_data) for doc_data in self.store.all()]
+        document_ids = [
+            doc.id for doc in documents
+            if (wanted is None or doc.id in wanted)
+            and (types is None or doc.document_type.lower() in types)
+            and (after is None or doc.upload_date >= after)
+            and (before is None or doc.upload_date <= before)
+        ]
+        return {"document_id": {"$in": document_ids}}
+
+    async def save_replacement(self, doc_id: str, file: UploadFile) -> tuple[DocumentInfo, bool]:
+        """
+        Store a revised file for an existing document and mark it pending.
+        Returns ``(doc_info, is_unchanged)``; an identical file is dropped.
+        The previous file is removed once the new one is in place.
+        """
+        old = self.get_document(doc_id)
+        if old is None:
+            raise KeyError(doc_id)
+
+        file_path = self._file_path(doc_id, file.filename)
+        tmp_path = file_path + ".part"
+        content_hash, _ = await asyncio.to_thread(copy_stream, file.file, tmp_path, self.max_upload_bytes)
+        collection = self.vector_store.collection_name
+        if content_hash == old.content_hash and self.store.is_live(old.model_dump(), collection):
+            os.remove(tmp_path)
+            return old, True
+
+        os.replace(tmp_path, file_path)
+        if file.filename != old.filename:
+            old_path = self._file_path(doc_id, old.filename)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        self._update_metadata(
+            doc_id,
+            filename=file.filename,
+            document_type=file.filename.split('.')[-1],
+            upload_date=datetime.now(),
+            status="queued",
+            embedding_status="pending",
+            content_hash=content_hash,
+            error=None
+        )
+        return self.get_document(doc_id), False
+
+    def delete_document(self, doc_id: str) -> Optional[DocumentInfo]:
+        """Remove a document's chunks, its uploaded file and its metadata entry"""
+        doc_data = self.store.delete(doc_id)
+        if doc_data is None:
+            return None
+        removed = self.vector_store.delete_document(doc_id)
+        file_path = self._file_path(doc_id, doc_data["filename"])
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self.structured_index.delete(doc_id)
+        print(f"Deleted document {doc_data['filename']} ({removed} chunks)")
+        self.vector_store.maybe_compact()
+        return DocumentInfo(**doc_data)
+
+    def set_job_id(self, doc_id: str, job_id: str):
+        self._update_metadata(doc_id, job_id=job_id)
+
+    def mark_cancelled(self, doc_id: str):
+        self._update_metadata(doc_id, status="cancelled", embedding_status="cancelled")
+
+    def ingest_document(
+        self,
+        doc_id: str,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None
+    ) -> DocumentInfo:
+        """
+        Extract, split and embed a saved upload as a streaming pipeline:
+        page-tagged segments are split as they are extracted and embedded
+        in batches, so memory stays bounded regardless of file size.
+
+        This is blocking and is meant to run on an ingestion worker thread;
+        ``progress(done, total)`` is called after each embedding batch, with
+        ``total`` left as None until extraction has finished.
+
+        Chunks already stored for the document (from an earlier version of
+        the file) are matched by content hash and kept without re-embedding;
+        those that no longer occur are deleted at the end.
+
+        CSV and JSON files are read as records (see ``iter_record_segments``)
+        unless ``structured_ingestion`` is off; their fields also go into
+        the document's columns in the structured index.
+        """
+        doc_data = self.store.get(doc_id)
+        if doc_data is None:
+            raise JobCancelledError(f"Document {doc_id} was deleted")
+        doc_info = DocumentInfo(**doc_data)
+        file_path = self._file_path(doc_id, doc_info.filename)
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            length_function=len,
+        )
+        columnar = None
         try:
-            print(f"Starting to process document: {file.filename}")
-            
-            # Generate unique ID for the document
-            doc_id = str(uuid4())
-            print(f"Generated document ID: {doc_id}")
-            
-            # Save file
-            file_path = os.path.join(self.upload_dir, f"{doc_id}_{file.filename}")
-            print(f"Saving file to: {file_path}")
-            
-            with open(file_path, 'wb') as f:
-                content = await file.read()
-                f.write(content)
-            
-            print(f"File saved successfully")
-            
-            # Extract text based on file type
-            filename_lower = file.filename.lower()
-            if filename_lower.endswith('.pdf'):
-                text, total_pages = self._process_pdf(file_path)
-            elif filename_lower.endswith('.docx'):
-                text, total_pages = self._process_docx(file_path)
-            elif filename_lower.endswith('.json'):
-                text, total_pages = self._process_json(file_path)
-            elif filename_lower.endswith('.csv'):
-                text, total_pages = self._process_csv(file_path)
-            else:
-                raise ValueError(f"Unsupported file type. File must be one of: PDF, DOCX, JSON, CSV")
-            
-            print(f"Text extracted successfully. Total pages: {total_pages}")
-            
-            # Split text into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-            )
-            chunks = text_splitter.split_text(text)
-            print(f"Text split into {len(chunks)} chunks")
-            
-            # Create document metadata
-            doc_info = DocumentInfo(
-                id=doc_id,
-                filename=file.filename,
-                document_type=file.filename.split('.')[-1],
-                upload_date=datetime.now(),
-                total_pages=total_pages,
-                status="processed",
-                embedding_status="pending"
+            print(f"Starting to process document: {doc_info.filename}")
+            self._update_metadata(doc_id, status="processing")
+            if self.structured_ingestion and doc_info.filename.lower().endswith(('.csv', '.json')):
+                columnar = self.structured_index.writer(doc_id)
+            total_pages, segments = self._iter_segments(file_path, doc_info.filename, columnar)
+            if progress:
+                progress(0, None)
+
+            # Previous version's chunks, by content, so unchanged ones skip embedding
+            reusable: dict[str, list[str]] = {}
+            old_ids, old_texts, old_metadatas = self.vector_store.get_chunks({"document_id": doc_id})
+            for chunk_id, text, metadata in zip(old_ids, old_texts, old_metadatas):
+                chunk_hash = metadata.get("chunk_hash") or _chunk_hash(text)
+                reusable.setdefault(chunk_hash, []).append(chunk_id)
+            reused_count = 0
+
+            chunk_count = 0
+            last_page = 0
+            batch_texts: list[str] = []
+            batch_metadata: list[dict] = []
+            stage_seconds = {"extract": 0.0, "split": 0.0, "embed": 0.0}
+
+            def check_not_deleted(undo: bool = False):
+                if self.store.get(doc_id) is not None:
+                    return
+                if undo:
+                    # delete_document drops the row before the chunks, so writes that raced it end up here
+                    self.vector_store.delete_document(doc_id)
+                    self.structured_index.delete(doc_id)
+                raise JobCancelledError(f"Document {doc_id} was deleted")
+
+            def flush():
+                nonlocal reused_count
+                check_not_deleted()
+                start = time.perf_counter()
+                new_texts, new_metadata, kept_ids, kept_metadata = [], [], [], []
+                for text, metadata in zip(batch_texts, batch_metadata):
+                    matches = reusable.get(metadata["chunk_hash"])
+                    if matches:
+                        kept_ids.append(matches.pop())
+                        kept_metadata.append(metadata)
+                    else:
+                        new_texts.append(text)
+                        new_metadata.append(metadata)
+                self.vector_store.add_texts(texts=new_texts, metadatas=new_metadata)
+                self.vector_store.update_metadatas(kept_ids, kept_metadata)
+                check_not_deleted(undo=True)
+                reused_count += len(kept_ids)
+                stage_seconds["embed"] += time.perf_counter() - start
+                batch_texts.clear()
+                batch_metadata.clear()
+                if progress:
+                    progress(chunk_count, None)
+
+            with tracer.span("ingest.document", document_id=doc_id, filename=doc_info.filename) as span:
+                segment_iter = iter(segments)
+                while True:
+                    # Extraction is lazy, so time each pull from the segment stream
+                    start = time.perf_counter()
+                    segment = next(segment_iter, None)
+                    stage_seconds["extract"] += time.perf_counter() - start
+                    if segment is None:
+                        break
+                    last_page = segment.page_number
+
+                    start = time.perf_counter()
+                    chunks = [segment.text] if segment.presplit else text_splitter.split_text(segment.text)
+                    stage_seconds["split"] += time.perf_counter() - start
+                    for chunk in chunks:
+                        batch_texts.append(chunk)
+                        batch_metadata.append({
+                            "document_name": doc_info.filename,
+                            "document_id": doc_id,
+                            "chunk": chunk_count,
+                            "chunk_hash": _chunk_hash(chunk),
+                            **segment.metadata()
+                        })
+                        chunk_count += 1
+                        if len(batch_texts) >= self.embedding_batch_size:
+                            flush()
+                if batch_texts:
+                    flush()
+                stale_ids = [chunk_id for ids in reusable.values() for chunk_id in ids]
+                self.vector_store.delete(stale_ids)
+                self.vector_store.flush()
+                if columnar is not None:
+                    self.structured_index.commit(doc_id, columnar)
+                    columnar = None
+                else:
+                    # A previous version may have been a CSV or JSON file
+                    self.structured_index.delete(doc_id)
+                check_not_deleted(undo=True)
+                span.set(chunks=chunk_count, reused=reused_count, removed=len(stale_ids), **{f"{stage}_s": round(v, 3) for stage, v in stage_seconds.items()})
+
+            document_type = doc_info.document_type.lower()
+            for stage, seconds in stage_seconds.items():
+                registry.histogram(
+                    f"ingest_{stage}_seconds", f"Time per document spent in the {stage} stage"
+                ).observe(seconds, document_type=document_type)
+            registry.counter("ingest_chunks_total", "Chunks ingested").inc(chunk_count, document_type=document_type)
+            if reused_count:
+                registry.counter(
+                    "ingest_chunks_reused_total", "Unchanged chunks kept from a previous version"
+                ).inc(reused_count, document_type=document_type)
+
+            total_pages = total_pages or max(1, last_page)
+            if progress:
+                progress(chunk_count, chunk_count)
+            print(f"Embedded {chunk_count - reused_count} chunks from {total_pages} pages"
+                  f" ({reused_count} unchanged, {len(stale_ids)} removed)")
+            if stale_ids:
+                self.vector_store.maybe_compact()
+
+            # Update document and embedding status
+            doc_info.total_pages = total_pages
+            doc_info.status = "processed"
+            doc_info.embedding_status = "completed"
+            doc_info.vector_collection = self.vector_store.collection_name
+            self._update_metadata(
+                doc_id, total_pages=total_pages, status="processed", embedding_status="completed",
+                vector_collection=doc_info.vector_collection
             )
-            
-            # Store metadata
-            self.metadata[doc_id] = doc_info.model_dump()
-            self._save_metadata()
-            print(f"Metadata saved successfully")
-            
-            # Create embeddings and store in vector database
-            try:
-                metadata_list = [
-                    {
-                        "document_name": file.filename,
-                        "document_id": doc_id,
-                        "page_number": i + 1,
-                        "chunk": i,
-                    }
-                    for i in range(len(chunks))
-                ]
-                
-                print(f"Creating vector store...")
-                vectorstore = Chroma(
-                    persist_directory=self.db_directory,
-                    embedding_function=self.embeddings
-                )
-                
-                print(f"Adding texts to vector store...")
-                vectorstore.add_texts(
-                    texts=chunks,
-                    metadatas=metadata_list
-                )
-                
-                # Update embedding status
-                doc_info.embedding_status = "completed"
-                self.metadata[doc_id].update({"embedding_status": "completed"})
-                self._save_metadata()
-                print(f"Document processing completed successfully")
-                
-            except Exception as e:
-                print(f"Error creating embeddings: {str(e)}")
-                doc_info.embedding_status = "failed"
-                self.metadata[doc_id].update({"embedding_status": "failed"})
-                self._save_metadata()
-                raise Exception(f"Failed to create embeddings: {str(e)}")
-            
-            return doc_info
-            
-        except Exception as e:
-            print(f"Error in process_document: {str(e)}")
+            print("Document processing completed successfully")
+
+        except JobCancelledError:
             raise
-    
-    def _process_pdf(self, file_path: str) -> tuple[str, int]:
-        """Extract text from PDF file"""
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text, len(reader.pages)
-    
-    def _process_docx(self, file_path: str) -> tuple[str, int]:
-        """Extract text from DOCX file"""
-        text = docx2txt.process(file_path)
-        # Approximate page count based on characters (average 3000 chars per page)
-        total_pages = max(1, len(text) // 3000)
-        return text, total_pages
-    
-    def _process_json(self, file_path: str) -> tuple[str, int]:
-        """Extract text from JSON file"""
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        text = json.dumps(data, indent=2)
-        # Consider each top-level key as a page
-        total_pages = max(1, len(data.keys()) if isinstance(data, dict) else 1)
-        return text, total_pages
-    
-    def _process_csv(self, file_path: str) -> tuple[str, int]:
-        """Extract text from CSV file"""
-        df = pd.read_csv(file_path)
-        text = df.to_string()
-        # Consider each 100 rows as a page
-        total_pages = max(1, len(df) // 100)
-        return text, total_pages
-    
+        except Exception as e:
+            print(f"Error in ingest_document: {str(e)}")
+            doc_info.embedding_status = "failed"
+            self._update_metadata(doc_id, status="failed", embedding_status="failed", error=str(e))
+            raise Exception(f"Failed to process document: {str(e)}")
+        finally:
+            if columnar is not None:
+                self.structured_index.abort(columnar)
+
+        return doc_info
+
+    def _get_pdf_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.pdf_workers <= 1:
+            return None
+        with self._lock:
+            if self._pdf_executor is None:
+                self._pdf_executor = ProcessPoolExecutor(max_workers=self.pdf_workers)
+        return self._pdf_executor
+
+    def _token_counter(self) -> Callable[[str], int]:
+        if self._count_tokens is None:
+            from services.prompt_builder import TokenCounter
+            self._count_tokens = TokenCounter().count
+        return self._count_tokens
+
+    def _iter_segments(
+        self,
+        file_path: str,
+        filename: str,
+        columnar: Optional["ColumnarWriter"] = None
+    ) -> tuple[Optional[int], Iterator[Segment]]:
+        """Return (total pages if known up front, page-tagged segment iterator)"""
+        filename_lower = filename.lower()
+        if self.structured_ingestion and filename_lower.endswith(('.json', '.csv')):
+            records = iter_json_records(file_path) if filename_lower.endswith('.json') else iter_csv_records(file_path)
+            return None, iter_record_segments(
+                records,
+                max_tokens=self.structured_chunk_tokens,
+                count_tokens=self._token_counter(),
+                on_record=columnar.add if columnar is not None else None
+            )
+        if filename_lower.endswith('.pdf'):
+            total_pages = count_pdf_pages(file_path)
+            # Small PDFs are not worth the process-pool round trips
+            executor = self._get_pdf_executor() if total_pages >= self.pdf_parallel_min_pages else None
+            return total_pages, iter_pdf_segments(file_path, total_pages, executor=executor)
+        elif filename_lower.endswith('.docx'):
+            return None, iter_docx_segments(file_path)
+        elif filename_lower.endswith('.json'):
+            return None, iter_json_segments(file_path)
+        elif filename_lower.endswith('.csv'):
+            return None, iter_csv_segments(file_path)
+        raise ValueError("Unsupported file type. File must be one of: PDF, DOCX, JSON, CSV")
+
+    def shutdown(self):
+        if self._pdf_executor is not None:
+            self._pdf_executor.shutdown(wait=False, cancel_futures=True)
+
     async def list_documents(self) -> list[DocumentInfo]:
         """List all processed documents"""
-        return [DocumentInfo(**doc_data) for doc_data in self.metadata.values()] 
\ No newline at end of file
+        return [DocumentInfo(**doc_data) for doc_data in self.store.all()] 
\ No newline at end of file
@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+from models.schemas import JobInfo
+from services.vector_store import LEGACY_COLLECTION_NAME
+
+
+class DocumentStore:
+    """
+    Document metadata and ingestion job records in SQLite (WAL mode), so
+    several worker processes can serve the same uploads. Every call reads
+    the database, which makes a write in one worker visible to the next
+    request in any other; read-modify-write updates run in an IMMEDIATE
+    transaction so concurrent uploads cannot overwrite each other.
+
+    Documents are stored as the same JSON dicts ``metadata.json`` used to
+    hold; an existing ``metadata.json`` is imported once and renamed.
+
+    A completed document records the vector collection its chunks went to
+    (``vector_collection``; documents from before this were in the legacy
+    one). Passing the current collection to the lookups below makes a
+    document embedded for another model count as not live, so the same
+    file can be ingested again.
+    """
+
+    LIVE_STATUSES = ("pending", "completed")
+
+    def __init__(self, db_directory: str, legacy_metadata_file: Optional[str] = None):
+        self.path = os.path.join(db_directory, "documents.sqlite3")
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                content_hash TEXT,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                document_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        if legacy_metadata_file:
+            self._import_legacy(legacy_metadata_file)
+
+    @contextmanager
+    def _write(self):
+        """Serialize a read-modify-write against every other process"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    @staticmethod
+    def _dumps(doc: dict) -> str:
+        return json.dumps(doc, default=str)
+
+    def _import_legacy(self, metadata_file: str):
+        """Move documents from the old ``metadata.json`` into the database, once"""
+        if not os.path.exists(metadata_file):
+            return
+        with self._write() as conn:
+            if conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is not None:
+                return
+            try:
+                with open(metadata_file, 'r') as f:
+                    metadata = json.load(f)
+            except FileNotFoundError:
+                # Another worker imported it first
+                return
+            conn.executemany(
+                "INSERT OR IGNORE INTO documents (id, content_hash, payload) VALUES (?, ?, ?)",
+                [(doc_id, doc.get("content_hash"), self._dumps(doc)) for doc_id, doc in metadata.items()]
+            )
+        try:
+            os.replace(metadata_file, metadata_file + ".imported")
+        except FileNotFoundError:
+            pass
+        print(f"Imported {len(metadata)} documents from {metadata_file}")
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT payload FROM documents ORDER BY rowid").fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    @classmethod
+    def is_live(cls, doc: dict, collection: Optional[str] = None) -> bool:
+        """Pending, or completed into ``collection`` (any collection if None)"""
+        if doc.get("embedding_status") not in cls.LIVE_STATUSES:
+            return False
+        if collection is None or doc.get("embedding_status") != "completed":
+            return True
+        return (doc.get("vector_collection") or LEGACY_COLLECTION_NAME) == collection
+
+    def find_by_content_hash(self, content_hash: str, collection: Optional[str] = None) -> Optional[dict]:
+        """A live document (pending or completed) with this file content, if any"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchall()
+        for (payload,) in rows:
+            doc = json.loads(payload)
+            if self.is_live(doc, collection):
+                return doc
+        return None
+
+    def add_unless_duplicate(self, doc: dict, collection: Optional[str] = None) -> Optional[dict]:
+        """
+        Insert a document unless a live one has the same content hash, in
+        one transaction so two workers cannot both accept the same file.
+        Returns the existing document if there was one, else None.
+        """
+        with self._write() as conn:
+            for (payload,) in conn.execute(
+                "SELECT payload FROM documents WHERE content_hash = ?", (doc.get("content_hash"),)
+            ).fetchall():
+                existing = json.loads(payload)
+                if self.is_live(existing, collection):
+                    return existing
+            conn.execute(
+                "INSERT INTO documents (id, content_hash, payload) VALUES (?, ?, ?)",
+                (doc["id"], doc.get("content_hash"), self._dumps(doc))
+            )
+        return None
+
+    def update(self, doc_id: str, **fields) -> Optional[dict]:
+        """Merge fields into a document's entry; returns the new entry, or None if it is gone"""
+        with self._write() as conn:
+            row = conn.execute("SELECT payload FROM documents WHERE id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            doc = {**json.loads(row[0]), **fields}
+            conn.execute(
+                "UPDATE documents SET content_hash = ?, payload = ? WHERE id = ?",
+                (doc.get("content_hash"), self._dumps(doc), doc_id)
+            )
+        return doc
+
+    def claim_for_reembedding(self, collection: str) -> List[dict]:
+        """
+        Mark completed documents whose chunks are in another collection as
+        pending again and return them, for the caller to queue. One
+        transaction, so with several workers each document is claimed once.
+        """
+        claimed = []
+        with self._write() as conn:
+            for doc_id, payload in conn.execute("SELECT id, payload FROM documents ORDER BY rowid").fetchall():
+                doc = json.loads(payload)
+                if doc.get("embedding_status") != "completed" or self.is_live(doc, collection):
+                    continue
+                doc.update(status="queued", embedding_status="pending", job_id=None)
+                conn.execute("UPDATE documents SET payload = ? WHERE id = ?", (self._dumps(doc), doc_id))
+                claimed.append(doc)
+        return claimed
+
+    def delete(self, doc_id: str) -> Optional[dict]:
+        with self._write() as conn:
+            row = conn.execute("SELECT payload FROM documents WHERE id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        return json.loads(row[0])
+
+    def save_job(self, job: JobInfo):
+        """Record a job's latest state so any worker can report on it"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, document_id, payload, updated_at) VALUES (?, ?, ?, ?)",
+                (job.id, job.document_id, json.dumps(job.model_dump(), default=str), time.time())
+            )
+            self._conn.commit()
+
+    def get_job(self, job_id: str) -> Optional[JobInfo]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return JobInfo(**json.loads(row[0])) if row else None
+
+    def prune_jobs(self, max_age_seconds: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - max_age_seconds,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
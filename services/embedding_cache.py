@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed store of embeddings, keyed by
+    (embedding model, sha256 of the chunk text). Vectors are stored as
+    float32 blobs in SQLite.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        hashes = list(hashes)
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for row_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[row_hash] = vector.tolist()
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]):
+        rows = [(model, h, array("f", vector).tobytes()) for h, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def record(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def count(self, model: Optional[str] = None) -> int:
+        with self._lock:
+            if model is None:
+                return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "entries": self.count(),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding backend so identical chunk texts are only ever
+    embedded once per model, within a call and across uploads.
+    """
+
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache, model: Optional[str] = None):
+        self.inner = inner
+        self.cache = cache
+        self.model = model or getattr(inner, "model", inner.__class__.__name__)
+
+    @property
+    def stats(self):
+        return getattr(self.inner, "stats", None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        hashes = [text_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model, set(hashes))
+
+        # Embed each distinct missing text once
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            new_vectors = self.inner.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(self.model, fresh.items())
+            cached.update(fresh)
+
+        self.cache.record(hits=len(texts) - len(missing), misses=len(missing))
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from services.metrics import registry
+from services.backend_pool import BackendPool, is_client_error
+
+DEFAULT_OLLAMA_BASE_URL = "http://localhost:11434"
+DEFAULT_EMBEDDING_MODEL = "nomic-embed-text"
+
+
+class EmbeddingError(Exception):
+    """Raised when the embedding backend keeps failing after all retries"""
+
+
+class EmbeddingStats:
+    """Thread-safe counters for embedding throughput"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts_embedded = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+
+    def record(self, texts: int, seconds: float, retries: int):
+        with self._lock:
+            self.texts_embedded += texts
+            self.requests += 1
+            self.retries += retries
+            self.busy_seconds += seconds
+
+    def record_failure(self, retries: int):
+        with self._lock:
+            self.failures += 1
+            self.retries += retries
+
+    def chunks_per_second(self) -> Optional[float]:
+        if self.busy_seconds <= 0:
+            return None
+        return round(self.texts_embedded / self.busy_seconds, 2)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "texts_embedded": self.texts_embedded,
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "chunks_per_second": self.chunks_per_second(),
+            }
+
+
+class OllamaBatchEmbeddings(Embeddings):
+    """
+    Embeddings client for Ollama's ``/api/embed`` endpoint.
+
+    Texts are sent ``batch_size`` at a time, with up to ``concurrency``
+    requests in flight. Connection errors and 5xx replies are retried with
+    exponential backoff; a 4xx is raised at once. Meant to point at a small
+    dedicated embedding model rather than the chat LLM.
+
+    With a ``pool`` of several hosts each batch goes to the least-busy one,
+    and a retry prefers a host that has not failed this batch yet.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_EMBEDDING_MODEL,
+        base_url: str = DEFAULT_OLLAMA_BASE_URL,
+        batch_size: int = 32,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        timeout: float = 120.0,
+        pool: Optional[BackendPool] = None
+    ):
+        self.model = model
+        self.pool = pool or BackendPool([base_url], role="embedding")
+        self.base_url = self.pool.backends[0].url
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.stats = EmbeddingStats()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+
+    def _post(self, base_url: str, texts: List[str]) -> List[List[float]]:
+        body = json.dumps({"model": self.model, "input": texts}).encode("utf-8")
+        request = urllib.request.Request(
+            f"{base_url}/api/embed",
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = json.loads(response.read())
+        embeddings = payload.get("embeddings")
+        if not embeddings or len(embeddings) != len(texts):
+            raise EmbeddingError(
+                f"Expected {len(texts)} embeddings from {self.model}, got {len(embeddings or [])}"
+            )
+        return embeddings
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        failed = []
+        while True:
+            exclude = failed if len(failed) < len(self.pool.backends) else []
+            backend = self.pool.pick(exclude=exclude)
+            start = time.perf_counter()
+            try:
+                embeddings = self._post(backend.url, texts)
+                elapsed = time.perf_counter() - start
+                self.pool.release(backend, elapsed)
+                self.stats.record(len(texts), elapsed, attempt)
+                registry.histogram(
+                    "embedding_request_seconds", "Latency of one embedding request"
+                ).observe(elapsed, model=self.model)
+                registry.counter("embedding_texts_total", "Texts embedded").inc(len(texts), model=self.model)
+                return embeddings
+            except (urllib.error.URLError, TimeoutError, ConnectionError, EmbeddingError, ValueError) as e:
+                self.pool.release(backend, error=e)
+                # A bad model name or oversized input fails the same way on every host
+                if is_client_error(e):
+                    self.stats.record_failure(attempt)
+                    raise EmbeddingError(f"Embedding request rejected: {str(e)}") from e
+                failed.append(backend)
+                if attempt >= self.max_retries:
+                    self.stats.record_failure(attempt)
+                    raise EmbeddingError(
+                        f"Embedding request failed after {attempt + 1} attempts: {str(e)}"
+                    ) from e
+                delay = self.backoff_seconds * (2 ** attempt)
+                print(f"Embedding request failed ({str(e)}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in batches, running up to ``concurrency`` batches at once"""
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        results: List[List[float]] = []
+        for batch_embeddings in self._executor.map(self._embed_batch, batches):
+            results.extend(batch_embeddings)
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+
+def create_embeddings(
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    base_url: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    max_retries: Optional[int] = None,
+    pool: Optional[BackendPool] = None
+) -> Embeddings:
+    """
+    Build the embedding backend. Arguments default to the ``EMBEDDING_*``
+    and ``OLLAMA_BASE_URL`` environment variables; ``pool`` spreads
+    requests over several hosts instead of ``base_url``.
+
+    ``provider`` is ``ollama`` (batched client above) or ``langchain``
+    (LangChain's one-request-per-text OllamaEmbeddings).
+    """
+    provider = provider or os.getenv("EMBEDDING_PROVIDER", "ollama")
+    model = model or os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+    base_url = base_url or os.getenv("OLLAMA_BASE_URL", DEFAULT_OLLAMA_BASE_URL)
+
+    if provider == "ollama":
+        return OllamaBatchEmbeddings(
+            model=model,
+            base_url=base_url,
+            pool=pool,
+            batch_size=batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+            concurrency=concurrency or int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+            max_retries=max_retries if max_retries is not None else int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+        )
+    if provider == "langchain":
+        from langchain_community.embeddings import OllamaEmbeddings
+        return OllamaEmbeddings(model=model, base_url=pool.backends[0].url if pool else base_url)
+    raise ValueError(f"Unsupported embedding provider: {provider}")
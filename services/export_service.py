@@ -1,17 +1,165 @@
 import os
-from typing import Optional
+import re
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
 from datetime import datetime
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from xml.sax.saxutils import escape
 from models.schemas import ChatResponse
+from services.prompt_builder import strip_reasoning
+
+# Formats generated on the fly by /download; only PDF is rendered to a file
+STREAMING_FORMATS = {"txt": "text/plain", "md": "text/markdown", "jsonl": "application/x-ndjson"}
+RENDERED_FORMATS = {"pdf": "application/pdf"}
+CACHED_FILENAME = re.compile(r"^chat_export_(?P<conversation_id>[\w-]+)_n(?P<message_count>\d+)\.(?P<format>\w+)$")
+
+
+# Answers saved before reasoning was split off still carry their <think> block
+def format_txt(msg: ChatResponse) -> str:
+    lines = [f"User: {msg.user_message}\n\n", f"Assistant: {strip_reasoning(msg.response)}\n"]
+    if msg.sources:
+        lines.append("\nSources:\n")
+        lines.extend(f"- {source.document_name} (Page {source.page_number})\n" for source in msg.sources)
+    lines.append("\n" + "-"*80 + "\n\n")
+    return "".join(lines)
+
+
+def format_md(msg: ChatResponse) -> str:
+    lines = [f"### User\n\n{msg.user_message}\n\n", f"### Assistant\n\n{strip_reasoning(msg.response)}\n\n"]
+    if msg.sources:
+        lines.append("**Sources:**\n\n")
+        lines.extend(f"- {source.document_name} (Page {source.page_number})\n" for source in msg.sources)
+        lines.append("\n")
+    lines.append("---\n\n")
+    return "".join(lines)
+
+
+def format_jsonl(msg: ChatResponse) -> str:
+    return json.dumps(msg.model_dump(), ensure_ascii=False) + "\n"
+
+
+FORMATTERS = {"txt": format_txt, "md": format_md, "jsonl": format_jsonl}
+
 
 class ExportService:
-    def __init__(self, export_dir: str = "exports"):
+    def __init__(
+        self,
+        export_dir: str = "exports",
+        max_workers: int = 2,
+        retention_seconds: float = 7 * 24 * 3600,
+        max_files: int = 200
+    ):
         self.export_dir = export_dir
         if not os.path.exists(export_dir):
             os.makedirs(export_dir)
+        self.retention_seconds = retention_seconds
+        self.max_files = max_files
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def cached_filename(self, conversation_id: str, message_count: int, format: str) -> str:
+        """Deterministic name, so an unchanged conversation maps to the same export"""
+        return f"chat_export_{conversation_id}_n{message_count}.{format}"
+
+    def parse_filename(self, filename: str) -> Optional[tuple[str, int, str]]:
+        """Return (conversation_id, message_count, format) for a cached export name"""
+        match = CACHED_FILENAME.match(filename)
+        if not match:
+            return None
+        return match["conversation_id"], int(match["message_count"]), match["format"]
+
+    def iter_export(self, messages: Iterable[ChatResponse], format: str) -> Iterator[str]:
+        """Yield a text export message by message, without a temp file"""
+        formatter = FORMATTERS.get(format)
+        if formatter is None:
+            raise ValueError(f"Unsupported export format: {format}")
+        if format == "md":
+            yield "# Chat Export\n\n"
+        for msg in messages:
+            yield formatter(msg if isinstance(msg, ChatResponse) else ChatResponse(**msg))
+
+    async def export_chat_async(
+        self,
+        fetch_messages: Callable[[], list[ChatResponse]],
+        conversation_id: str,
+        message_count: int,
+        format: str = "pdf"
+    ) -> str:
+        """
+        Return the name of an export for the conversation as of
+        ``message_count`` messages. Text formats are streamed on download,
+        so nothing is rendered here. PDFs are rendered once on the export
+        worker pool and reused until the conversation changes.
+        """
+        format = format.lower()
+        filename = self.cached_filename(conversation_id, message_count, format)
+        if format in STREAMING_FORMATS:
+            return filename
+        if format not in RENDERED_FORMATS:
+            raise ValueError(f"Unsupported export format: {format}")
+
+        filepath = self.get_export_path(filename)
+        if os.path.exists(filepath):
+            os.utime(filepath)
+            return filename
+
+        # Concurrent requests for the same render share one job
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._inflight.get(filename)
+            if future is None:
+                future = loop.run_in_executor(
+                    self._executor, self._render_pdf_file, fetch_messages, filepath
+                )
+                self._inflight[filename] = future
+        try:
+            await future
+        finally:
+            with self._lock:
+                self._inflight.pop(filename, None)
+        return filename
+
+    def _render_pdf_file(self, fetch_messages: Callable[[], list[ChatResponse]], filepath: str):
+        # Per process, since another worker may be rendering the same export
+        tmp_path = f"{filepath}.{os.getpid()}.part"
+        try:
+            self._build_pdf(fetch_messages(), tmp_path)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.apply_retention()
+
+    def apply_retention(self):
+        """Delete exports older than the retention period, then the oldest beyond max_files"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.export_dir):
+            path = os.path.join(self.export_dir, name)
+            if not os.path.isfile(path) or name.endswith(".part"):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime > self.retention_seconds:
+                    os.remove(path)
+                else:
+                    entries.append((mtime, path))
+            except FileNotFoundError:
+                # Removed by another worker's retention pass
+                continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_files:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
     def _create_filename(self, conversation_id: str, format: str) -> str:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -22,27 +170,23 @@ class ExportService:
         filepath = os.path.join(self.export_dir, filename)
         
         with open(filepath, 'w', encoding='utf-8') as f:
-            for msg in messages:
-                # Write user message
-                f.write(f"User: {msg.user_message}\n\n")
-                
-                # Write assistant response
-                f.write(f"Assistant: {msg.response}\n")
-                
-                # Write sources if available
-                if msg.sources:
-                    f.write("\nSources:\n")
-                    for source in msg.sources:
-                        f.write(f"- {source.document_name} (Page {source.page_number})\n")
-                
-                f.write("\n" + "-"*80 + "\n\n")
+            f.writelines(self.iter_export(messages, "txt"))
         
         return filename
 
     def export_to_pdf(self, messages: list[ChatResponse], conversation_id: str) -> str:
         filename = self._create_filename(conversation_id, "pdf")
         filepath = os.path.join(self.export_dir, filename)
-        
+        self._build_pdf(messages, filepath)
+        return filename
+
+    def _build_pdf(self, messages: list[ChatResponse], filepath: str):
+        # reportlab is only needed for PDF, so it is not imported at startup
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
         # Create PDF document
         doc = SimpleDocTemplate(
             filepath,
@@ -91,17 +235,17 @@ class ExportService:
         
         for msg in messages:
             # Add user message
-            content.append(Paragraph(f"User: {msg.user_message}", user_style))
+            content.append(Paragraph(f"User: {escape(msg.user_message)}", user_style))
             
             # Add assistant response
-            content.append(Paragraph(f"Assistant: {msg.response}", assistant_style))
+            content.append(Paragraph(f"Assistant: {escape(strip_reasoning(msg.response))}", assistant_style))
             
             # Add sources if available
             if msg.sources:
                 content.append(Paragraph("Sources:", source_style))
                 for source in msg.sources:
                     content.append(Paragraph(
-                        f"• {source.document_name} (Page {source.page_number})",
+                        f"• {escape(source.document_name)} (Page {source.page_number})",
                         source_style
                     ))
             
@@ -109,7 +253,6 @@ class ExportService:
         
         # Build PDF
         doc.build(content)
-        return filename
 
     def export_chat(self, messages: list[ChatResponse], conversation_id: str, format: str = "pdf") -> str:
         """Export chat conversation to the specified format"""
@@ -134,4 +277,4 @@ class ExportService:
 
     def get_export_path(self, filename: str) -> str:
         """Get the full path of an exported file"""
-        return os.path.join(self.export_dir, filename) 
\ No newline at end of file
+        return os.path.join(self.export_dir, os.path.basename(filename)) 
\ No newline at end of file
@@ -0,0 +1,386 @@
+import csv
+import io
+import json
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional, TextIO, Tuple, Union
+
+# Characters treated as one "page" for formats without real pages
+DOCX_CHARS_PER_PAGE = 3000
+CSV_ROWS_PER_PAGE = 100
+# Rows per pandas read in structured CSV ingestion; only bounds memory
+CSV_READ_ROWS = 10000
+STRUCTURED_CHUNK_TOKENS = 256
+
+RecordKey = Union[int, str]
+
+
+class Segment(NamedTuple):
+    """A run of extracted text tagged with where it came from"""
+    text: str
+    page_number: int
+    row_start: Optional[int] = None
+    row_end: Optional[int] = None
+    key_start: Optional[str] = None
+    key_end: Optional[str] = None
+    columns: Optional[str] = None
+    # Already a chunk of the right size; the text splitter leaves it whole
+    presplit: bool = False
+
+    def metadata(self) -> dict:
+        metadata = {"page_number": self.page_number}
+        if self.row_start is not None:
+            metadata.update({"row_start": self.row_start, "row_end": self.row_end})
+        if self.key_start is not None:
+            metadata.update({"key_start": self.key_start, "key_end": self.key_end})
+        if self.columns is not None:
+            metadata["columns"] = self.columns
+        return metadata
+
+
+# Process-pool workers only: the PDF each worker last read, reused across its page batches
+_worker_reader = {}
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> list[str]:
+    """Process-pool task: extract text for pages [start, end) of a PDF; not for use in the main process"""
+    from pypdf import PdfReader
+    reader = _worker_reader.get(file_path)
+    if reader is None:
+        # Keep only the most recent document open in each worker
+        _worker_reader.clear()
+        reader = _worker_reader[file_path] = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def count_pdf_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def iter_pdf_segments(
+    file_path: str,
+    total_pages: int,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = 4,
+    window: int = 8
+) -> Iterator[Segment]:
+    """
+    Yield one segment per PDF page, in page order.
+
+    With an executor, pages are extracted in parallel in batches of
+    ``pages_per_task``, with at most ``window`` batches in flight, so
+    memory is bounded by the window rather than the file size.
+    """
+    if executor is None:
+        # On an ingestion thread: a reader of its own, released with the iterator
+        from pypdf import PdfReader
+        reader = PdfReader(file_path)
+        for page_number in range(1, total_pages + 1):
+            yield Segment(text=reader.pages[page_number - 1].extract_text() or "", page_number=page_number)
+        return
+
+    pending = deque()
+    next_start = 0
+
+    def submit_more():
+        nonlocal next_start
+        while next_start < total_pages and len(pending) < window:
+            end = min(next_start + pages_per_task, total_pages)
+            pending.append((next_start, executor.submit(_extract_pdf_pages, file_path, next_start, end)))
+            next_start = end
+
+    try:
+        submit_more()
+        while pending:
+            start, future = pending.popleft()
+            pages = future.result()
+            submit_more()
+            for i, text in enumerate(pages):
+                yield Segment(text=text, page_number=start + i + 1)
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def iter_docx_segments(file_path: str) -> Iterator[Segment]:
+    """DOCX has no stored pagination; split on paragraphs into ~3000-char pages"""
+    import docx2txt
+    text = docx2txt.process(file_path)
+    page, size, page_number = [], 0, 1
+    for paragraph in text.split("\n"):
+        page.append(paragraph)
+        size += len(paragraph) + 1
+        if size >= DOCX_CHARS_PER_PAGE:
+            yield Segment(text="\n".join(page), page_number=page_number)
+            page, size, page_number = [], 0, page_number + 1
+    if any(p.strip() for p in page):
+        yield Segment(text="\n".join(page), page_number=page_number)
+
+
+def iter_csv_segments(file_path: str, rows_per_page: int = CSV_ROWS_PER_PAGE) -> Iterator[Segment]:
+    """Read the CSV in row blocks; each block is a page tagged with its row range"""
+    import pandas as pd
+    row_start = 0
+    for page_number, frame in enumerate(pd.read_csv(file_path, chunksize=rows_per_page), start=1):
+        row_end = row_start + len(frame)
+        yield Segment(
+            text=frame.to_csv(index=False),
+            page_number=page_number,
+            row_start=row_start,
+            row_end=row_end - 1
+        )
+        row_start = row_end
+
+
+def iter_json_segments(file_path: str) -> Iterator[Segment]:
+    with open(file_path, 'r') as f:
+        data = json.load(f)
+    yield Segment(text=json.dumps(data, indent=2), page_number=1)
+
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def iter_csv_records(file_path: str, read_rows: int = CSV_READ_ROWS) -> Iterator[Tuple[int, dict]]:
+    """Stream ``(row number, {column: cell text})``; cells keep their original text"""
+    import pandas as pd
+    row = 0
+    for frame in pd.read_csv(file_path, chunksize=read_rows, dtype=str, keep_default_na=False):
+        columns = [str(column) for column in frame.columns]
+        for values in frame.itertuples(index=False, name=None):
+            yield row, dict(zip(columns, values))
+            row += 1
+
+
+class _JsonStream:
+    """
+    Incremental reader for the top level of a JSON document: values are
+    decoded one at a time with ``raw_decode`` from a buffer that is
+    refilled as needed, so a large array never has to be loaded whole.
+    """
+
+    def __init__(self, f: TextIO, read_size: int = 1 << 16):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: Optional[int] = None) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(size or self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, without consuming it ("" at the end)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected '{char}', found '{found or 'end of file'}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        read_size = self.read_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number ending at the buffer's end may continue in the next read
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow the reads so one very large value is not re-parsed once per block
+            self._fill(read_size)
+            read_size *= 2
+
+    def array_of_objects_ahead(self) -> bool:
+        """Whether the next value is an array whose first element is an object"""
+        if self.peek() != "[":
+            return False
+        offset = 1
+        while True:
+            i = self.pos + offset
+            while i < len(self.buffer) and self.buffer[i] in " \t\r\n":
+                i += 1
+            if i < len(self.buffer):
+                return self.buffer[i] == "{"
+            offset = i - self.pos
+            if not self._fill():
+                return False
+
+    def array(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+    def members(self) -> Iterator[str]:
+        """Yield each key of an object; the caller reads its value before asking for the next"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def flatten_record(value: Any, prefix: str = "") -> dict:
+    """Nested objects become dotted columns; lists and scalars stay as values"""
+    if not isinstance(value, dict):
+        return {prefix or "value": value}
+    flat = {}
+    for key, item in value.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(item, dict) and item:
+            flat.update(flatten_record(item, name))
+        else:
+            flat[name] = item
+    return flat
+
+
+def iter_json_records(file_path: str) -> Iterator[Tuple[RecordKey, dict]]:
+    """
+    Stream the records of a JSON document as ``(key, flat fields)``. A
+    top-level array gives one record per element, keyed by index; a
+    top-level object gives one record per member, keyed by name, and an
+    array of objects under a member is streamed element by element
+    (``"items[3]"``). Any other document is a single record.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        first = stream.peek()
+        if first == "[":
+            for index, element in enumerate(stream.array()):
+                yield index, flatten_record(element)
+        elif first == "{":
+            for key in stream.members():
+                if stream.array_of_objects_ahead():
+                    for index, element in enumerate(stream.array()):
+                        yield f"{key}[{index}]", flatten_record(element)
+                    continue
+                value = stream.value()
+                if isinstance(value, dict):
+                    yield key, {"key": key, **flatten_record(value)}
+                else:
+                    yield key, {"key": key, "value": value}
+        else:
+            yield 0, flatten_record(stream.value())
+        if stream.peek():
+            raise ValueError("Invalid JSON: unexpected data after the top-level value")
+
+
+def cell_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return str(value)
+
+
+def iter_record_segments(
+    records: Iterable[Tuple[RecordKey, dict]],
+    max_tokens: int = STRUCTURED_CHUNK_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    on_record: Optional[Callable[[RecordKey, dict], None]] = None
+) -> Iterator[Segment]:
+    """
+    Group whole records into chunks of about ``max_tokens``, each written
+    as compact CSV under a header of its own columns, and tagged with its
+    row (or key) range. A record that does not fit in a chunk on its own
+    is left for the text splitter. ``on_record(key, fields)`` sees every
+    record as it streams past, e.g. to build a column index.
+    """
+    columns: list[str] = []
+    column_set: set[str] = set()
+    rows: list[dict] = []
+    keys: list[RecordKey] = []
+    tokens = 0
+    page_number = 0
+    line_buffer = io.StringIO()
+    line_writer = csv.writer(line_buffer, lineterminator="\n")
+
+    def csv_line(values: Iterable[Any]) -> str:
+        line_buffer.seek(0)
+        line_buffer.truncate()
+        line_writer.writerow([cell_text(value) for value in values])
+        return line_buffer.getvalue()
+
+    def emit(presplit: bool = True) -> Segment:
+        nonlocal tokens, page_number
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([cell_text(row.get(column)) for column in columns])
+        page_number += 1
+        if isinstance(keys[0], int) and isinstance(keys[-1], int):
+            ranges = {"row_start": keys[0], "row_end": keys[-1]}
+        else:
+            ranges = {"key_start": str(keys[0]), "key_end": str(keys[-1])}
+        segment = Segment(
+            text=buffer.getvalue(), page_number=page_number, columns=",".join(columns), presplit=presplit, **ranges
+        )
+        columns.clear()
+        column_set.clear()
+        rows.clear()
+        keys.clear()
+        tokens = 0
+        return segment
+
+    for key, fields in records:
+        if on_record:
+            on_record(key, fields)
+        row_tokens = count_tokens(csv_line(fields.values()))
+        new_columns = [column for column in fields if column not in column_set]
+        header_tokens = count_tokens(",".join(new_columns)) if new_columns else 0
+        # Start over when full, or when the record brings new columns and the chunk is already half full
+        if rows and (tokens + row_tokens + header_tokens > max_tokens or (new_columns and tokens > max_tokens // 2)):
+            yield emit()
+            new_columns = list(fields)
+            header_tokens = count_tokens(",".join(new_columns))
+        columns.extend(new_columns)
+        column_set.update(new_columns)
+        rows.append(fields)
+        keys.append(key)
+        tokens += row_tokens + header_tokens
+        if len(rows) == 1 and tokens > max_tokens:
+            yield emit(presplit=False)
+    if rows:
+        yield emit()
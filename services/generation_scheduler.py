@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Optional
+from services.metrics import registry
+
+
+class SchedulerFullError(Exception):
+    """Raised when too many generations are already waiting for a slot"""
+
+
+class QueueTimeoutError(Exception):
+    """Raised when a request waited longer than the queue timeout and was shed"""
+
+
+class GenerationCancelledError(Exception):
+    """Raised when the client went away while the request was still queued"""
+
+
+class GenerationTicket:
+    def __init__(self, key: str):
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.granted = asyncio.Event()
+        self.released = False
+
+    @property
+    def wait_seconds(self) -> float:
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+class GenerationScheduler:
+    """
+    Caps how many LLM generations run at once and queues the rest fairly.
+
+    Waiting requests are grouped by key (conversation or client) and slots
+    are handed out round-robin across keys, so one busy conversation cannot
+    starve the others. Requests that wait longer than ``queue_timeout`` are
+    shed instead of being served minutes late.
+
+    Lives on the event loop; all methods must be called from it.
+    """
+
+    def __init__(self, max_in_flight: int = 2, max_queue_depth: int = 64, queue_timeout: float = 120.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._queues: "OrderedDict[str, Deque[GenerationTicket]]" = OrderedDict()
+        self._queued = 0
+
+    def queued_count(self) -> int:
+        return self._queued
+
+    def is_full(self) -> bool:
+        return self._queued >= self.max_queue_depth
+
+    def enqueue(self, key: str) -> GenerationTicket:
+        """Reserve a place in line; the ticket may be granted immediately"""
+        if self.is_full():
+            raise SchedulerFullError(
+                f"Too many chat requests waiting ({self.max_queue_depth}). Try again later."
+            )
+        ticket = GenerationTicket(key)
+        self._queues.setdefault(key, deque()).append(ticket)
+        self._queued += 1
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: GenerationTicket) -> int:
+        """1-based place in the round-robin order; 0 once the ticket holds a slot"""
+        if ticket.granted.is_set():
+            return 0
+        queue = self._queues.get(ticket.key)
+        if not queue:
+            return 0
+        index = queue.index(ticket)
+        ahead = index
+        before_own_key = True
+        for key, other in self._queues.items():
+            if key == ticket.key:
+                before_own_key = False
+                continue
+            # Keys earlier in the rotation get one more turn before ours comes up
+            ahead += min(len(other), index + 1 if before_own_key else index)
+        return ahead + 1
+
+    async def wait(
+        self,
+        ticket: GenerationTicket,
+        poll_seconds: float = 1.0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> AsyncIterator[int]:
+        """
+        Wait for the ticket's slot, yielding its queue position whenever it
+        changes. Raises QueueTimeoutError when the request goes stale and
+        GenerationCancelledError when the client disconnects meanwhile.
+        """
+        last_position = None
+        while not ticket.granted.is_set():
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            remaining = self.queue_timeout - ticket.wait_seconds
+            if remaining <= 0:
+                self.release(ticket)
+                registry.counter("chat_queue_shed_total", "Queued chat requests dropped after timing out").inc()
+                raise QueueTimeoutError(f"Waited {ticket.wait_seconds:.1f}s for a generation slot")
+            try:
+                await asyncio.wait_for(ticket.granted.wait(), timeout=min(poll_seconds, remaining))
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    self.release(ticket)
+                    raise GenerationCancelledError("Client disconnected while queued")
+
+    def release(self, ticket: GenerationTicket):
+        """Give back the slot, or leave the queue if it was never granted. Idempotent."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted.is_set():
+            self.in_flight -= 1
+        else:
+            queue = self._queues.get(ticket.key)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.key]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # Round-robin: this key goes to the back of the rotation
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self.in_flight += 1
+            ticket.granted_at = time.monotonic()
+            ticket.granted.set()
+            registry.histogram("chat_queue_wait_seconds", "Time spent waiting for a generation slot").observe(
+                ticket.wait_seconds
+            )
+        registry.gauge("chat_generations_in_flight", "LLM generations currently streaming").set(self.in_flight)
+        registry.gauge("chat_generations_queued", "Chat requests waiting for a generation slot").set(self._queued)
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "queued_keys": len(self._queues),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_timeout_seconds": self.queue_timeout,
+        }
@@ -0,0 +1,223 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+from typing import Callable, Optional
+from uuid import uuid4
+from models.schemas import JobInfo
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue has reached its maximum depth"""
+
+
+class JobCancelledError(Exception):
+    """Raised inside a worker when its job has been cancelled"""
+
+
+class IngestionJob:
+    def __init__(self, document_id: str, filename: str, bulk: bool = False):
+        self.id = str(uuid4())
+        self.document_id = document_id
+        self.filename = filename
+        self.bulk = bulk
+        self.status = "queued"
+        self.chunks_total: Optional[int] = None
+        self.chunks_embedded = 0
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+        self.on_cancel: Optional[Callable[[], None]] = None
+        self.on_update: Optional[Callable[["IngestionJob"], None]] = None
+        self._last_update = 0.0
+        self._started_monotonic: Optional[float] = None
+        self._finished_monotonic: Optional[float] = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def report_progress(self, chunks_embedded: int, chunks_total: Optional[int]):
+        """Progress callback handed to the document processor; total is None while still extracting"""
+        if self.cancel_event.is_set():
+            raise JobCancelledError(f"Job {self.id} was cancelled")
+        self.chunks_embedded = chunks_embedded
+        self.chunks_total = chunks_total
+        if time.monotonic() - self._last_update >= 1.0:
+            self.notify()
+
+    def notify(self):
+        """Pass the job's state to ``on_update`` (e.g. to share it with other workers)"""
+        self._last_update = time.monotonic()
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(self)
+        except Exception as e:
+            print(f"Could not record state of job {self.id}: {str(e)}")
+
+    def chunks_per_second(self) -> Optional[float]:
+        if self._started_monotonic is None:
+            return None
+        end = self._finished_monotonic or time.monotonic()
+        elapsed = end - self._started_monotonic
+        if elapsed <= 0:
+            return None
+        return round(self.chunks_embedded / elapsed, 2)
+
+    def to_info(self) -> JobInfo:
+        return JobInfo(
+            id=self.id,
+            document_id=self.document_id,
+            filename=self.filename,
+            status=self.status,
+            chunks_total=self.chunks_total,
+            chunks_embedded=self.chunks_embedded,
+            chunks_per_second=self.chunks_per_second(),
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            error=self.error
+        )
+
+
+class IngestionQueue:
+    """
+    Runs document extraction and embedding on a bounded pool of worker
+    threads so the event loop stays free to serve /chat streams.
+
+    Jobs live in the process that accepted the upload. ``on_update(job)``
+    is called on every status change and at most once a second with
+    progress, so the state can be published where other workers see it.
+
+    Bulk jobs (many files from one request) run on their own
+    ``bulk_workers`` threads and count against ``max_bulk_jobs`` instead
+    of ``max_queue_depth``, so a large batch neither fills the queue for
+    interactive uploads nor waits behind it.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queue_depth: int = 32,
+        max_finished_jobs: int = 1000,
+        on_update: Optional[Callable[[IngestionJob], None]] = None,
+        bulk_workers: int = 1,
+        max_bulk_jobs: int = 1000
+    ):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.max_finished_jobs = max_finished_jobs
+        self.on_update = on_update
+        self.bulk_workers = bulk_workers
+        self.max_bulk_jobs = max_bulk_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._bulk_executor = ThreadPoolExecutor(max_workers=bulk_workers, thread_name_prefix="ingest-bulk")
+        self._jobs: dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        document_id: str,
+        filename: str,
+        work: Callable[[Callable[[int, Optional[int]], None]], None],
+        on_cancel: Optional[Callable[[], None]] = None,
+        bulk: bool = False
+    ) -> IngestionJob:
+        """
+        Queue ``work(progress)`` for a document. ``progress(done, total)``
+        raises JobCancelledError once the job is cancelled, which unwinds
+        the worker between embedding batches.
+        """
+        limit = self.max_bulk_jobs if bulk else self.max_queue_depth
+        with self._lock:
+            if self._active_count(bulk) >= limit:
+                raise QueueFullError(
+                    f"Ingestion queue is full ({limit} {'bulk ' if bulk else ''}jobs). Try again later."
+                )
+            job = IngestionJob(document_id, filename, bulk=bulk)
+            job.on_cancel = on_cancel
+            job.on_update = self.on_update
+            self._jobs[job.id] = job
+            self._prune_finished()
+        job.notify()
+
+        executor = self._bulk_executor if bulk else self._executor
+        job.future = executor.submit(self._run, job, work)
+        return job
+
+    def _mark_cancelled(self, job: IngestionJob):
+        job.status = "cancelled"
+        if job.on_cancel:
+            job.on_cancel()
+
+    def _run(self, job: IngestionJob, work):
+        if job.cancel_event.is_set():
+            self._mark_cancelled(job)
+            job.finished_at = datetime.now()
+            job.notify()
+            return
+        job.status = "running"
+        job.started_at = datetime.now()
+        job._started_monotonic = time.monotonic()
+        job.notify()
+        try:
+            work(job.report_progress)
+            job.status = "completed"
+        except JobCancelledError:
+            self._mark_cancelled(job)
+        except Exception as e:
+            print(f"Ingestion job {job.id} failed: {str(e)}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now()
+            job._finished_monotonic = time.monotonic()
+            job.notify()
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        """Cancel a queued or running job. Returns None if the job is unknown."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.is_active:
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # Never started, so the worker will not run the cancel hook itself
+            self._mark_cancelled(job)
+            job.finished_at = datetime.now()
+            job.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_count(self, bulk: Optional[bool] = False) -> int:
+        """Queued or running jobs of one lane; ``bulk=None`` counts both"""
+        with self._lock:
+            return self._active_count(bulk)
+
+    def _active_count(self, bulk: Optional[bool]) -> int:
+        # Caller holds the lock; submit() runs on bulk-upload threads
+        return sum(1 for job in self._jobs.values() if job.is_active and (bulk is None or job.bulk == bulk))
+
+    def _prune_finished(self):
+        finished = [job for job in self._jobs.values() if not job.is_active]
+        overflow = len(finished) - self.max_finished_jobs
+        if overflow > 0:
+            finished.sort(key=lambda job: job.created_at)
+            for job in finished[:overflow]:
+                self._jobs.pop(job.id, None)
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._bulk_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,287 @@
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound codes such as "GS18", "CS20" or
+    "772-451" are kept whole and also indexed by their parts.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-_./]", token) if part)
+    return tokens
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    """Evaluate the equality / ``$in`` subset of Chroma's ``where`` syntax"""
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict) and "$in" in condition:
+            if value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def filter_document_ids(filter: Optional[dict]) -> Optional[Set[str]]:
+    """Document ids a filter is restricted to, or None if it does not restrict them"""
+    if not filter or "document_id" not in filter:
+        return None
+    condition = filter["document_id"]
+    if isinstance(condition, dict):
+        return set(condition["$in"]) if "$in" in condition else None
+    return {condition}
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index over chunk texts, keyed by the same ids
+    as the vector store. Snapshots are pickled to ``path`` on ``flush()``.
+
+    Removed chunks leave empty slots behind; ``compact()`` renumbers the
+    live ones once enough have accumulated.
+
+    Positions are also grouped by ``document_id`` so a search scoped to a
+    few documents only scores their chunks.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._ids: List[Optional[str]] = []
+        self._lengths: List[int] = []
+        self._texts: List[Optional[str]] = []
+        self._metadatas: List[Optional[dict]] = []
+        self._positions: Dict[str, int] = {}
+        self._by_document: Dict[str, Set[int]] = {}
+        self._total_length = 0
+        self._dirty = False
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def dead_ratio(self) -> float:
+        """Fraction of slots left empty by removals"""
+        if not self._ids:
+            return 0.0
+        return 1 - len(self._positions) / len(self._ids)
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            self._postings = state["postings"]
+            self._ids = state["ids"]
+            self._lengths = state["lengths"]
+            self._texts = state["texts"]
+            self._metadatas = state["metadatas"]
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(self._ids) if chunk_id is not None}
+            self._index_documents()
+            self._total_length = sum(self._lengths)
+        except Exception as e:
+            print(f"Error loading lexical index, it will be rebuilt: {str(e)}")
+            self.clear()
+
+    def _index_documents(self):
+        self._by_document = {}
+        for position in self._positions.values():
+            document_id = (self._metadatas[position] or {}).get("document_id")
+            if document_id is not None:
+                self._by_document.setdefault(document_id, set()).add(position)
+
+    def _set_document(self, position: int, old: Optional[dict], new: Optional[dict]):
+        old_id = (old or {}).get("document_id")
+        new_id = (new or {}).get("document_id")
+        if old_id == new_id:
+            return
+        if old_id is not None:
+            positions = self._by_document.get(old_id)
+            if positions is not None:
+                positions.discard(position)
+                if not positions:
+                    del self._by_document[old_id]
+        if new_id is not None:
+            self._by_document.setdefault(new_id, set()).add(position)
+
+    def flush(self):
+        """Write a snapshot if anything changed since the last one"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {
+                "postings": self._postings,
+                "ids": self._ids,
+                "lengths": self._lengths,
+                "texts": self._texts,
+                "metadatas": self._metadatas,
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._ids = []
+            self._lengths = []
+            self._texts = []
+            self._metadatas = []
+            self._positions = {}
+            self._by_document = {}
+            self._total_length = 0
+            self._dirty = True
+
+    def add(self, ids: Iterable[str], texts: Iterable[str], metadatas: Optional[Iterable[dict]] = None):
+        metadatas = list(metadatas) if metadatas is not None else None
+        with self._lock:
+            for i, (chunk_id, text) in enumerate(zip(ids, texts)):
+                if chunk_id in self._positions:
+                    continue
+                position = len(self._ids)
+                terms = Counter(tokenize(text))
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[position] = tf
+                length = sum(terms.values())
+                self._ids.append(chunk_id)
+                self._lengths.append(length)
+                self._texts.append(text)
+                self._metadatas.append(metadatas[i] if metadatas else {})
+                self._set_document(position, None, self._metadatas[position])
+                self._positions[chunk_id] = position
+                self._total_length += length
+            self._dirty = True
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """Drop chunks from the index; returns how many were present"""
+        removed = 0
+        with self._lock:
+            for chunk_id in ids:
+                position = self._positions.pop(chunk_id, None)
+                if position is None:
+                    continue
+                for term in set(tokenize(self._texts[position])):
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(position, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_length -= self._lengths[position]
+                self._set_document(position, self._metadatas[position], None)
+                self._ids[position] = None
+                self._texts[position] = None
+                self._metadatas[position] = None
+                self._lengths[position] = 0
+                removed += 1
+            if removed:
+                self._dirty = True
+        return removed
+
+    def document_of(self, chunk_id: str) -> Optional[str]:
+        with self._lock:
+            position = self._positions.get(chunk_id)
+            if position is None:
+                return None
+            return (self._metadatas[position] or {}).get("document_id")
+
+    def document_chunk_ids(self, document_id: str) -> List[str]:
+        with self._lock:
+            return [self._ids[position] for position in self._by_document.get(document_id, ())]
+
+    def update_metadata(self, ids: Iterable[str], metadatas: Iterable[dict]):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                position = self._positions.get(chunk_id)
+                if position is not None:
+                    self._set_document(position, self._metadatas[position], metadata)
+                    self._metadatas[position] = metadata
+            self._dirty = True
+
+    def compact(self):
+        """Renumber live chunks so empty slots stop costing memory"""
+        with self._lock:
+            if len(self._positions) == len(self._ids):
+                return
+            live = [p for p, chunk_id in enumerate(self._ids) if chunk_id is not None]
+            renumber = {old: new for new, old in enumerate(live)}
+            self._postings = {
+                term: {renumber[p]: tf for p, tf in postings.items()}
+                for term, postings in self._postings.items()
+            }
+            self._ids = [self._ids[p] for p in live]
+            self._lengths = [self._lengths[p] for p in live]
+            self._texts = [self._texts[p] for p in live]
+            self._metadatas = [self._metadatas[p] for p in live]
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+            self._index_documents()
+            self._dirty = True
+
+    def search(self, query: str, k: int = 10, filter: Optional[dict] = None) -> List[Tuple[str, float, str, dict]]:
+        """Return up to ``k`` (id, score, text, metadata) tuples, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._positions)
+            if not terms or n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+            # Scoped to a few documents: walk their chunks instead of whole posting lists
+            allowed: Optional[Set[int]] = None
+            document_ids = filter_document_ids(filter)
+            if document_ids is not None:
+                allowed = set()
+                for document_id in document_ids:
+                    allowed |= self._by_document.get(document_id, set())
+                if not allowed:
+                    return []
+
+            scores: Dict[int, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                if allowed is not None and len(allowed) < len(postings):
+                    candidates = ((p, postings[p]) for p in allowed if p in postings)
+                else:
+                    candidates = postings.items()
+                for position, tf in candidates:
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[position] / avg_length)
+                    scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+            if filter:
+                scores = {p: s for p, s in scores.items() if matches_filter(self._metadatas[p], filter)}
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [
+                (self._ids[p], score, self._texts[p], self._metadatas[p])
+                for p, score in best
+            ]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists: score(id) = sum over lists of 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
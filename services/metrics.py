@@ -0,0 +1,215 @@
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (made cumulative on render), sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}"
+            yield f"{self.name}_sum{_format_labels(key)} {total}"
+            yield f"{self.name}_count{_format_labels(key)} {count}"
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry; metrics are created on first use"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Times named stages into ``<name>_seconds`` histograms. Every span is
+    counted; only a ``sample_rate`` fraction is also logged as a JSON line.
+    """
+
+    def __init__(self, registry: MetricsRegistry, sample_rate: float = 0.0):
+        self.registry = registry
+        self.sample_rate = sample_rate
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        span = Span(name, attributes)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            metric_name = name.replace(".", "_") + "_seconds"
+            self.registry.histogram(metric_name, f"Duration of {name}").observe(span.duration)
+            if error:
+                self.registry.counter("span_errors_total", "Spans that raised").inc(span=name, error=error)
+            if self.sample_rate and random.random() < self.sample_rate:
+                print(json.dumps({
+                    "span": name,
+                    "duration_ms": round(span.duration * 1000, 3),
+                    "error": error,
+                    **span.attributes
+                }, default=str))
+
+
+registry = MetricsRegistry()
+tracer = Tracer(registry)
+
+
+class RequestMetricsMiddleware:
+    """
+    Counts HTTP requests by route and status and times them until the
+    response has been sent. Plain ASGI, so streamed bodies (``/chat``)
+    pass straight through instead of via the extra task and memory
+    stream of an ``@app.middleware("http")`` function.
+    """
+
+    def __init__(self, app, metrics: MetricsRegistry = registry):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Set by the router once it has matched the request
+            route = scope.get("route")
+            labels = {"method": scope["method"], "path": route.path if route is not None else "unmatched"}
+            self.metrics.histogram(
+                "http_request_seconds", "Time until the response is sent, by route"
+            ).observe(time.perf_counter() - start, **labels)
+            self.metrics.counter("http_requests_total", "Requests by route and status").inc(status=status, **labels)
+
+
+def configure(sample_rate: float):
+    """Set the fraction of spans written to the log"""
+    tracer.sample_rate = max(0.0, min(1.0, sample_rate))
@@ -0,0 +1,738 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import uuid4
+import numpy as np
+
+VECTOR_DTYPE = np.float16
+NORM_DTYPE = np.float32
+LIST_DTYPE = np.int32
+FILE_KINDS = ("vectors.f16", "norms.f32", "lists.i32", "centroids.f32")
+# Rows appended since the per-list row index was built; past this many it is rebuilt
+LIST_INDEX_TAIL = 65536
+
+
+class _View:
+    """One consistent mapping of a collection's files, swapped as a whole"""
+
+    __slots__ = ("generation", "version", "rows", "vectors", "norms", "alive", "lists", "centroids", "list_index")
+
+    def __init__(
+        self, generation: int, version: int, rows: int, vectors, norms, alive,
+        lists=None, centroids=None, list_index=None
+    ):
+        self.generation = generation
+        self.version = version
+        self.rows = rows
+        self.vectors = vectors
+        self.norms = norms
+        self.alive = alive
+        self.lists = lists
+        self.centroids = centroids
+        # (rows sorted by list, start of each list in them, rows covered); built on first IVF search
+        self.list_index = list_index
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest centroid for each row"""
+    distances = np.square(centroids).sum(axis=1)[None, :] - 2 * (vectors @ centroids.T)
+    return np.argmin(distances, axis=1).astype(LIST_DTYPE)
+
+
+def _where_sql(where: Optional[dict]) -> Tuple[str, list]:
+    """Equality / ``$in`` subset of Chroma's ``where`` syntax as an SQL condition"""
+    if not where:
+        return "1", []
+    clauses, params = [], []
+    for key, condition in where.items():
+        if not re.fullmatch(r"\w+", key):
+            raise ValueError(f"Unsupported filter key: {key}")
+        column = "document_id" if key == "document_id" else f"json_extract(metadata, '$.{key}')"
+        if isinstance(condition, dict) and "$in" in condition:
+            values = list(condition["$in"])
+            if not values:
+                return "0", []
+            clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        elif isinstance(condition, dict):
+            raise ValueError(f"Unsupported filter on {key}: {condition}")
+        else:
+            clauses.append(f"{column} = ?")
+            params.append(condition)
+    return " AND ".join(clauses), params
+
+
+class MmapCollection:
+    """
+    Vector index over a float16 matrix in a memory-mapped file, with ids,
+    texts and metadata in a SQLite sidecar. Speaks the subset of the
+    Chroma collection API that ``SharedVectorStore`` uses.
+
+    Appends write new rows at the end of the files without touching
+    existing ones. Deletes only drop the sidecar row; ``compact()`` writes
+    the files again without the holes.
+
+    The files are mapped read-only, so several worker processes searching
+    the same collection share one copy in the OS page cache. Files are
+    named by a generation number that changes whenever they are rewritten
+    (compaction, IVF training), so a query always maps the files matching
+    the sidecar snapshot it reads; other processes pick up appends and new
+    generations on their next query. Deletes are also logged as tombstones
+    by version, so a process catching up with another's writes applies
+    just those instead of re-reading every live row. Distances are squared
+    L2, as with Chroma's default space.
+
+    Search is exact until the collection holds ``ivf_min_rows`` live rows.
+    Then k-means centroids are trained on a sample, every row is tagged
+    with its nearest one, and a query only scores the rows of its
+    ``nprobe`` nearest lists (IVF), found through the rows sorted by list and each list's
+    offset in them. The centroids are retrained whenever the collection has
+    grown fourfold. Training runs after the write that triggers it, outside
+    any transaction; only the switch to the new generation takes the write
+    lock. Queries limited to a few documents stay exact, over just
+    their rows.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        name: str,
+        block_rows: int = 8192,
+        nprobe: int = 16,
+        ivf_min_rows: int = 50000
+    ):
+        self.directory = directory
+        self.name = name
+        self.block_rows = block_rows
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.sidecar_path = os.path.join(directory, "chunks.sqlite3")
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document_id TEXT,
+                document TEXT,
+                metadata TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (document_id);
+            CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS tombstones (version INTEGER NOT NULL, row INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS tombstones_version ON tombstones (version);
+            INSERT OR IGNORE INTO info (key, value) VALUES
+                ('dim', 0), ('rows', 0), ('version', 0), ('generation', 0), ('nlist', 0), ('trained_rows', 0);
+            """
+        )
+        self._view: Optional[_View] = None
+        self._train_lock = threading.Lock()
+        self.inode = os.stat(self.sidecar_path).st_ino
+
+    def is_stale(self) -> bool:
+        """True once another process has deleted (and maybe recreated) this collection"""
+        try:
+            return os.stat(self.sidecar_path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.sidecar_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _path(self, kind: str, generation: int) -> str:
+        stem, suffix = kind.split(".")
+        return os.path.join(self.directory, f"{stem}.{generation}.{suffix}")
+
+    def _remove_generation(self, generation: int):
+        """Unlink a replaced generation; processes that still map it keep their pages"""
+        for kind in FILE_KINDS:
+            path = self._path(kind, generation)
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _info(conn: sqlite3.Connection) -> Dict[str, int]:
+        return dict(conn.execute("SELECT key, value FROM info").fetchall())
+
+    def _map(self, kind: str, generation: int, dtype, shape: tuple):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._path(kind, generation), dtype=dtype, mode="r", shape=shape)
+
+    def _load_centroids(self, info: Dict[str, int]) -> np.ndarray:
+        return np.fromfile(
+            self._path("centroids.f32", info["generation"]), dtype=np.float32
+        ).reshape(info["nlist"], info["dim"])
+
+    def _load_view(self, conn: sqlite3.Connection, info: Dict[str, int]) -> _View:
+        rows, dim, generation = info["rows"], info["dim"], info["generation"]
+        alive = np.zeros(rows, dtype=bool)
+        live_rows = np.fromiter((row for (row,) in conn.execute("SELECT row FROM chunks")), dtype=np.int64)
+        alive[live_rows[live_rows < rows]] = True
+        lists, centroids = None, None
+        if info["nlist"]:
+            lists = self._map("lists.i32", generation, LIST_DTYPE, (rows,))
+            centroids = self._load_centroids(info)
+        return _View(
+            generation, info["version"], rows,
+            self._map("vectors.f16", generation, VECTOR_DTYPE, (rows, dim)),
+            self._map("norms.f32", generation, NORM_DTYPE, (rows,)),
+            alive, lists, centroids
+        )
+
+    def _current_view(self, conn: sqlite3.Connection, info: Dict[str, int]) -> _View:
+        """View matching the snapshot ``conn`` is reading, remapping if it moved on"""
+        view = self._view
+        if view is not None and view.generation == info["generation"] and view.version == info["version"]:
+            return view
+        if view is not None and view.generation == info["generation"] and view.version < info["version"]:
+            # Another process appended or deleted: apply only its changes
+            removed = np.fromiter(
+                (row for (row,) in conn.execute("SELECT row FROM tombstones WHERE version > ?", (view.version,))),
+                dtype=np.int64
+            )
+            view = self._extend_view(view, info, removed)
+        else:
+            view = self._load_view(conn, info)
+        with self._lock:
+            current = self._view
+            if current is None or (current.generation, current.version) < (view.generation, view.version):
+                self._view = view
+        return view
+
+    def _advance_view(self, before: Dict[str, int], after: Dict[str, int], removed: Sequence[int] = ()):
+        """
+        Carry the mapped view across a write made by this process, so the
+        next query does not reload it. If another process wrote in between,
+        or the files were rewritten, leave it for the next query to reload.
+        """
+        view = self._view
+        if view is None or (view.generation, view.version) != (before["generation"], before["version"]):
+            return
+        if after["generation"] != before["generation"]:
+            self._view = None
+            return
+        self._view = self._extend_view(view, after, removed)
+
+    def _extend_view(self, view: _View, after: Dict[str, int], removed: Sequence[int] = ()) -> _View:
+        """``view`` with the rows appended since, minus ``removed``; same generation only"""
+        rows, generation = after["rows"], after["generation"]
+        alive = np.zeros(rows, dtype=bool)
+        alive[:view.rows] = view.alive
+        alive[view.rows:] = True
+        if len(removed):
+            alive[np.asarray(removed, dtype=np.int64)] = False
+        vectors, norms, lists = view.vectors, view.norms, view.lists
+        if rows != view.rows:
+            vectors = self._map("vectors.f16", generation, VECTOR_DTYPE, (rows, after["dim"]))
+            norms = self._map("norms.f32", generation, NORM_DTYPE, (rows,))
+            if lists is not None:
+                lists = self._map("lists.i32", generation, LIST_DTYPE, (rows,))
+        return _View(
+            generation, after["version"], rows, vectors, norms, alive, lists, view.centroids, view.list_index
+        )
+
+    @staticmethod
+    def _log_removed(conn: sqlite3.Connection, version: int, removed: Sequence[int]):
+        conn.executemany("INSERT INTO tombstones (version, row) VALUES (?, ?)", [(version, row) for row in removed])
+
+    def _read(self, work):
+        """
+        Run ``work(conn, info)`` inside one read snapshot. If a writer
+        removed the snapshot's files before they were mapped, start over.
+        """
+        conn = self._reader()
+        for attempt in range(3):
+            conn.execute("BEGIN")
+            try:
+                return work(conn, self._info(conn))
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+            finally:
+                conn.execute("COMMIT")
+
+    def _rows_of(self, conn: sqlite3.Connection, ids: Sequence[str]) -> List[int]:
+        rows = []
+        for offset in range(0, len(ids), 500):
+            part = list(ids[offset:offset + 500])
+            rows.extend(row for (row,) in conn.execute(
+                f"SELECT row FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+            ))
+        return rows
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: Sequence[Sequence[float]],
+        metadatas: Optional[List[dict]] = None,
+        documents: Optional[List[str]] = None
+    ):
+        if not ids:
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or [None for _ in ids]
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                info = self._info(conn)
+                dim = info["dim"] or matrix.shape[1]
+                if matrix.shape[1] != dim:
+                    raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match collection dimension {dim}")
+                # Replaced ids get a fresh row at the end; their old row becomes a hole
+                removed = self._rows_of(conn, ids)
+                conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+                self._log_removed(conn, info["version"] + 1, removed)
+                start = info["rows"]
+                lists = None
+                if info["nlist"]:
+                    lists = _nearest(matrix.astype(VECTOR_DTYPE).astype(np.float32), self._load_centroids(info))
+                self._write_rows(info["generation"], start, matrix, lists)
+                conn.executemany(
+                    "INSERT INTO chunks (row, id, document_id, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (start + i, chunk_id, (metadata or {}).get("document_id"), text, json.dumps(metadata or {}))
+                        for i, (chunk_id, metadata, text) in enumerate(zip(ids, metadatas, documents))
+                    ]
+                )
+                after = {**info, "dim": dim, "rows": start + len(ids), "version": info["version"] + 1}
+                # Live rows, not slots: replaced and deleted rows leave holes until compaction
+                live = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+                train = bool(self.ivf_min_rows) and live >= self.ivf_min_rows and live >= 4 * info["trained_rows"]
+                conn.executemany("UPDATE info SET value = ? WHERE key = ?", [
+                    (value, key) for key, value in after.items()
+                ])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._advance_view(info, after, removed)
+        if train:
+            self._train()
+
+    def _write_rows(self, generation: int, start: int, matrix: np.ndarray, lists: Optional[np.ndarray] = None):
+        """Write vectors, norms and list ids at their row offsets, past everything already committed"""
+        vectors = matrix.astype(VECTOR_DTYPE)
+        # Norms of the stored (rounded) vectors, so distances are exact for what is searched
+        norms = np.square(vectors.astype(np.float32)).sum(axis=1).astype(NORM_DTYPE)
+        files = [("vectors.f16", vectors), ("norms.f32", norms)]
+        if lists is not None:
+            files.append(("lists.i32", lists))
+        for kind, data in files:
+            data = np.ascontiguousarray(data)
+            row_bytes = data.itemsize * (data.shape[1] if data.ndim > 1 else 1)
+            fd = os.open(self._path(kind, generation), os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.pwrite(fd, data.tobytes(), start * row_bytes)
+            finally:
+                os.close(fd)
+
+    def _train(self, iterations: int = 8):
+        """
+        Fit IVF centroids by k-means on a sample of live rows and tag every
+        row with its list, as a new generation of files. The work is done
+        against a read snapshot; the generation is switched in a short
+        write transaction that also tags rows appended meanwhile, and is
+        dropped if another writer changed the generation first.
+        """
+        if not self._train_lock.acquire(blocking=False):
+            return
+        lists_tmp = os.path.join(self.directory, f"lists.{uuid4().hex[:8]}.tmp")
+        try:
+            info, view = self._read(lambda conn, info: (info, self._load_view(conn, {**info, "nlist": 0})))
+            live = np.flatnonzero(view.alive)
+            # Another process may have trained, or rows were deleted since the write
+            if len(live) < max(1, self.ivf_min_rows) or len(live) < 4 * info["trained_rows"]:
+                return
+            nlist = min(len(live), int(min(4096, max(16, np.sqrt(len(live))))))
+            rng = np.random.default_rng(len(live))
+            sample = np.sort(rng.choice(live, min(len(live), nlist * 40), replace=False))
+            points = view.vectors[sample].astype(np.float32)
+            centroids = points[rng.choice(len(points), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = _nearest(points, centroids)
+                counts = np.bincount(assignment, minlength=nlist)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, points)
+                filled = counts > 0
+                # Empty lists keep their previous centroid
+                centroids[filled] = sums[filled] / counts[filled, None]
+            with open(lists_tmp, "wb") as f:
+                self._write_lists(f, view.vectors, 0, view.rows, centroids)
+            self._switch_to_trained(info, view.rows, centroids, lists_tmp, len(live))
+        except Exception as e:
+            print(f"IVF training failed for collection {self.name}: {str(e)}")
+        finally:
+            if os.path.exists(lists_tmp):
+                os.remove(lists_tmp)
+            self._train_lock.release()
+
+    def _write_lists(self, f, vectors, start: int, stop: int, centroids: np.ndarray):
+        for offset in range(start, stop, self.block_rows):
+            block = vectors[offset:min(offset + self.block_rows, stop)].astype(np.float32)
+            f.write(_nearest(block, centroids).tobytes())
+
+    def _switch_to_trained(
+        self, trained: Dict[str, int], tagged_rows: int, centroids: np.ndarray, lists_tmp: str, live: int
+    ):
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                info = self._info(conn)
+                if info["generation"] != trained["generation"]:
+                    # Compacted or trained elsewhere meanwhile; row numbers may have moved
+                    conn.execute("ROLLBACK")
+                    return
+                generation = info["generation"] + 1
+                # Leftovers of an attempt that never committed
+                self._remove_generation(generation)
+                # The vectors themselves are unchanged: link them into the new generation
+                for kind in ("vectors.f16", "norms.f32"):
+                    os.link(self._path(kind, info["generation"]), self._path(kind, generation))
+                if info["rows"] > tagged_rows:
+                    vectors = self._map("vectors.f16", generation, VECTOR_DTYPE, (info["rows"], info["dim"]))
+                    with open(lists_tmp, "ab") as f:
+                        self._write_lists(f, vectors, tagged_rows, info["rows"], centroids)
+                os.replace(lists_tmp, self._path("lists.i32", generation))
+                centroids.tofile(self._path("centroids.f32", generation))
+                # Readers reload a new generation in full, so the delete log can start over
+                conn.execute("DELETE FROM tombstones")
+                after = {**info, "nlist": len(centroids), "trained_rows": live, "generation": generation}
+                conn.executemany("UPDATE info SET value = ? WHERE key = ?", [
+                    (value, key) for key, value in after.items()
+                ])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._remove_generation(info["generation"])
+            self._advance_view(info, after)
+        print(f"Trained {len(centroids)} IVF lists over {live} vectors in collection {self.name}")
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                info = self._info(conn)
+                conn.executemany(
+                    "UPDATE chunks SET document_id = ?, metadata = ? WHERE id = ?",
+                    [((m or {}).get("document_id"), json.dumps(m or {}), chunk_id) for chunk_id, m in zip(ids, metadatas)]
+                )
+                conn.execute("UPDATE info SET value = value + 1 WHERE key = 'version'")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._advance_view(info, {**info, "version": info["version"] + 1})
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None):
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                info = self._info(conn)
+                if ids is not None:
+                    removed = self._rows_of(conn, ids)
+                    conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+                else:
+                    clause, params = _where_sql(where)
+                    removed = [row for (row,) in conn.execute(f"SELECT row FROM chunks WHERE {clause}", params)]
+                    conn.execute(f"DELETE FROM chunks WHERE {clause}", params)
+                self._log_removed(conn, info["version"] + 1, removed)
+                conn.execute("UPDATE info SET value = value + 1 WHERE key = 'version'")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._advance_view(info, {**info, "version": info["version"] + 1}, removed)
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[dict] = None,
+        include: Iterable[str] = ("documents", "metadatas"),
+        limit: Optional[int] = None,
+        offset: Optional[int] = None
+    ) -> dict:
+        include = set(include)
+        clause, params = _where_sql(where)
+        if ids is not None:
+            clause += f" AND id IN ({','.join('?' * len(ids))})" if ids else " AND 0"
+            params = params + list(ids)
+
+        def work(conn: sqlite3.Connection, info: Dict[str, int]) -> dict:
+            rows = conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE {clause} ORDER BY row LIMIT ? OFFSET ?",
+                params + [-1 if limit is None else limit, offset or 0]
+            ).fetchall()
+            result = {"ids": [chunk_id for _, chunk_id, _, _ in rows]}
+            if "documents" in include:
+                result["documents"] = [text for _, _, text, _ in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [json.loads(metadata) if metadata else {} for _, _, _, metadata in rows]
+            if "embeddings" in include:
+                view = self._current_view(conn, info)
+                positions = np.array([row for row, _, _, _ in rows], dtype=np.int64)
+                result["embeddings"] = view.vectors[positions].astype(np.float32).tolist() if len(positions) else []
+            return result
+
+        return self._read(work)
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 10,
+        where: Optional[dict] = None,
+        include: Iterable[str] = ("documents", "metadatas", "distances")
+    ) -> dict:
+        """Top ``n_results`` rows per query, as lists of lists like Chroma"""
+        include = set(include)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+
+        def work(conn: sqlite3.Connection, info: Dict[str, int]):
+            view = self._current_view(conn, info)
+            candidates = None
+            if where:
+                clause, params = _where_sql(where)
+                candidates = np.fromiter(
+                    (row for (row,) in conn.execute(f"SELECT row FROM chunks WHERE {clause}", params)),
+                    dtype=np.int64
+                )
+                candidates = candidates[candidates < view.rows]
+            distances, positions = self.search(view, queries, n_results, candidates)
+
+            found = sorted({int(p) for p in positions.ravel() if p >= 0})
+            records = {}
+            for offset in range(0, len(found), 500):
+                part = found[offset:offset + 500]
+                for row, chunk_id, text, metadata in conn.execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(part))})", part
+                ):
+                    records[row] = (chunk_id, text, json.loads(metadata) if metadata else {})
+            return distances, positions, records
+
+        distances, positions, records = self._read(work)
+        result = {key: [] for key in ("ids", "documents", "metadatas", "distances") if key == "ids" or key in include}
+        for query_distances, query_positions in zip(distances, positions):
+            hits = [(float(d), records[int(p)]) for d, p in zip(query_distances, query_positions) if int(p) in records]
+            result["ids"].append([record[0] for _, record in hits])
+            if "documents" in result:
+                result["documents"].append([record[1] for _, record in hits])
+            if "metadatas" in result:
+                result["metadatas"].append([record[2] for _, record in hits])
+            if "distances" in result:
+                result["distances"].append([distance for distance, _ in hits])
+        return result
+
+    def search(
+        self,
+        view: _View,
+        queries: np.ndarray,
+        k: int,
+        candidates: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched top-k by squared L2 over live rows (or only ``candidates``).
+        Returns (distances, rows), each shaped (queries, <= k); missing
+        results have row -1.
+        """
+        if k <= 0 or not view.rows:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        if candidates is not None:
+            candidates = candidates[view.alive[candidates]]
+            # A handful of rows: gather them instead of scanning the matrix
+            if len(candidates) * 4 < view.rows:
+                return self._top_k(view, queries, k, self._gather_blocks(candidates))
+            mask = np.zeros(view.rows, dtype=bool)
+            mask[candidates] = True
+        else:
+            mask = view.alive
+
+        if view.centroids is None or not self.nprobe or self.nprobe >= len(view.centroids):
+            return self._top_k(view, queries, k, self._scan_blocks(view.rows, mask))
+
+        # IVF: each query scores only the rows in its nearest lists
+        probes = np.argsort(
+            np.square(view.centroids).sum(axis=1)[None, :] - 2 * (queries @ view.centroids.T), axis=1
+        )[:, :self.nprobe]
+        order, offsets, indexed = self._list_index(view)
+        tail_lists = view.lists[indexed:view.rows] if indexed < view.rows else None
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, probe in enumerate(probes):
+            parts = [order[offsets[l]:offsets[l + 1]] for l in probe]
+            if tail_lists is not None:
+                parts.append(indexed + np.flatnonzero(np.isin(tail_lists, probe)))
+            selected = np.concatenate(parts)
+            # Sorted, so the gathers walk the mapped files forwards
+            selected = np.sort(selected[mask[selected]])
+            d, r = self._top_k(view, queries[i:i + 1], k, self._gather_blocks(selected))
+            distances[i, :d.shape[1]] = d[0]
+            rows[i, :r.shape[1]] = r[0]
+        return distances, rows
+
+    @staticmethod
+    def _list_index(view: _View) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        (rows sorted by IVF list, offset of each list in them, rows
+        covered). Rows appended later are matched by scanning their list
+        ids until there are ``LIST_INDEX_TAIL`` of them; then it is rebuilt.
+        """
+        index = view.list_index
+        if index is None or view.rows - index[2] > LIST_INDEX_TAIL:
+            lists = np.asarray(view.lists[:view.rows])
+            offsets = np.zeros(len(view.centroids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(lists, minlength=len(view.centroids)), out=offsets[1:])
+            index = view.list_index = (np.argsort(lists, kind="stable"), offsets, view.rows)
+        return index
+
+    def _top_k(self, view: _View, queries: np.ndarray, k: int, blocks) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge per-block top-k over (rows, mask) blocks, each scored for every query at once"""
+        query_norms = np.square(queries).sum(axis=1)[:, None]
+        best_d = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_r = np.full((len(queries), 0), -1, dtype=np.int64)
+        for rows, keep in blocks:
+            block = view.vectors[rows].astype(np.float32)
+            norms = view.norms[rows]
+            if isinstance(rows, slice):
+                rows = np.arange(rows.start, rows.stop)
+            distances = query_norms + norms[None, :] - 2 * (queries @ block.T)
+            if keep is not None:
+                distances[:, ~keep] = np.inf
+            take = min(k, distances.shape[1])
+            part = np.argpartition(distances, take - 1, axis=1)[:, :take]
+            best_d = np.concatenate([best_d, np.take_along_axis(distances, part, axis=1)], axis=1)
+            best_r = np.concatenate([best_r, rows[part]], axis=1)
+            if best_d.shape[1] > k:
+                part = np.argpartition(best_d, k - 1, axis=1)[:, :k]
+                best_d = np.take_along_axis(best_d, part, axis=1)
+                best_r = np.take_along_axis(best_r, part, axis=1)
+
+        order = np.argsort(best_d, axis=1)
+        best_d = np.take_along_axis(best_d, order, axis=1)
+        best_r = np.take_along_axis(best_r, order, axis=1)
+        best_r[~np.isfinite(best_d)] = -1
+        return np.maximum(best_d, 0), best_r
+
+    def _gather_blocks(self, rows: np.ndarray):
+        for start in range(0, len(rows), self.block_rows):
+            yield rows[start:start + self.block_rows], None
+
+    def _scan_blocks(self, rows: int, mask: np.ndarray):
+        """(row slice, mask or None) per block, skipping blocks with nothing to score"""
+        for start in range(0, rows, self.block_rows):
+            stop = min(start + self.block_rows, rows)
+            keep = mask[start:stop]
+            if keep.any():
+                yield slice(start, stop), (None if keep.all() else keep)
+
+    def compact(self):
+        """Write the files again without deleted rows, as a new generation, and renumber the sidecar"""
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                info = self._info(conn)
+                live = [row for (row,) in conn.execute("SELECT row FROM chunks ORDER BY row")]
+                if len(live) == info["rows"]:
+                    conn.execute("COMMIT")
+                    return
+                view = self._load_view(conn, info)
+                generation = info["generation"] + 1
+                live_rows = np.array(live, dtype=np.int64)
+                arrays = [("vectors.f16", view.vectors), ("norms.f32", view.norms)]
+                if view.lists is not None:
+                    arrays.append(("lists.i32", view.lists))
+                    view.centroids.tofile(self._path("centroids.f32", generation))
+                for kind, array in arrays:
+                    with open(self._path(kind, generation), "wb") as f:
+                        for i in range(0, len(live_rows), self.block_rows):
+                            f.write(np.ascontiguousarray(array[live_rows[i:i + self.block_rows]]).tobytes())
+                # Ascending order, so a row never lands on one not yet moved
+                conn.executemany("UPDATE chunks SET row = ? WHERE row = ?", [
+                    (new, old) for new, old in enumerate(live) if new != old
+                ])
+                conn.executemany("UPDATE info SET value = ? WHERE key = ?", [
+                    (len(live), "rows"), (info["version"] + 1, "version"), (generation, "generation")
+                ])
+                conn.execute("DELETE FROM tombstones")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._remove_generation(info["generation"])
+            self._view = None
+
+    def disk_bytes(self) -> int:
+        return sum(
+            os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+        )
+
+    def close(self):
+        with self._lock:
+            self._writer.close()
+            self._view = None
+
+
+class MmapVectorClient:
+    """Directory of ``MmapCollection``s, one subdirectory each, with Chroma's client calls"""
+
+    def __init__(self, directory: str, **collection_options):
+        self.directory = directory
+        self.collection_options = collection_options
+        os.makedirs(directory, exist_ok=True)
+        self._collections: Dict[str, MmapCollection] = {}
+        self._lock = threading.Lock()
+
+    def list_collections(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.isdir(os.path.join(self.directory, name))
+        )
+
+    def get_collection(self, name: str) -> MmapCollection:
+        if not os.path.isdir(os.path.join(self.directory, name)):
+            raise ValueError(f"Collection {name} does not exist")
+        return self.get_or_create_collection(name)
+
+    def get_or_create_collection(self, name: str) -> MmapCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None and collection.is_stale():
+                collection.close()
+                collection = None
+            if collection is None:
+                collection = self._collections[name] = MmapCollection(
+                    os.path.join(self.directory, name), name, **self.collection_options
+                )
+            return collection
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            collection = self._collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
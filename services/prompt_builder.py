@@ -0,0 +1,151 @@
+import re
+from typing import List, Optional, Sequence
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from models.schemas import ChatResponse
+
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken, falling back to ~4 chars/token if it is unavailable"""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self._encoding = None
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            print(f"tiktoken unavailable ({str(e)}), estimating tokens from characters")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return max(1, len(text) // 4)
+
+
+def strip_reasoning(text: str) -> str:
+    return THINK_BLOCK.sub("", text).strip()
+
+
+def condense_turn(message: ChatResponse, max_chars: int = 240) -> str:
+    """One-line extractive summary of a finished turn"""
+    answer = " ".join(strip_reasoning(message.response).split())
+    question = " ".join(message.user_message.split())
+    if len(answer) > max_chars:
+        answer = answer[:max_chars].rsplit(" ", 1)[0] + "..."
+    if len(question) > max_chars:
+        question = question[:max_chars].rsplit(" ", 1)[0] + "..."
+    return f"- User asked: {question} | Assistant answered: {answer}"
+
+
+class PromptResult:
+    def __init__(self, messages: List[BaseMessage], prompt_tokens: int, context_docs: List[Document],
+                 history_turns: int, summary_included: bool):
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.context_docs = context_docs
+        self.history_turns = history_turns
+        self.summary_included = summary_included
+
+
+class PromptBuilder:
+    """
+    Packs the system message, retrieved context and conversation history
+    into a fixed token budget.
+
+    Message order is: system, summary of older turns, recent turns (oldest
+    first), then the retrieved context together with the current question,
+    so the question is always the last thing the model reads.
+
+    ``history_share`` of the budget is held back for history while context
+    is packed; any budget context leaves unused also goes to history.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 6000,
+        history_share: float = 0.3,
+        max_history_turns: int = 10,
+        summary_max_tokens: int = 400,
+        counter: Optional[TokenCounter] = None
+    ):
+        self.token_budget = token_budget
+        self.history_share = history_share
+        self.max_history_turns = max_history_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.counter = counter or TokenCounter()
+
+    def update_summary(self, summary: str, older_turns: Sequence[ChatResponse]) -> str:
+        """
+        Fold turns that have left the verbatim window into the running
+        summary, dropping the oldest lines once it exceeds its token cap.
+        """
+        lines = [line for line in summary.split("\n") if line] if summary else []
+        lines.extend(condense_turn(turn) for turn in older_turns)
+        while len(lines) > 1 and self.counter.count("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def build(
+        self,
+        system_prompt: str,
+        question: str,
+        docs: Sequence[Document],
+        recent_turns: Sequence[ChatResponse],
+        summary: str = ""
+    ) -> PromptResult:
+        count = self.counter.count
+        question_template = "Context: {context}\n\nQuestion: {question}"
+        fixed = count(system_prompt) + count(question_template.format(context="", question=question))
+        remaining = max(0, self.token_budget - fixed)
+        available = remaining
+        history_reserve = int(remaining * self.history_share)
+
+        # Context, in retrieval rank order, skipping chunks that do not fit
+        context_docs: List[Document] = []
+        context_budget = remaining - history_reserve
+        used = 0
+        for doc in docs:
+            cost = count(doc.page_content) + 1
+            if used + cost <= context_budget:
+                context_docs.append(doc)
+                used += cost
+        remaining -= used
+
+        # Summary of older turns, then as many recent turns as fit, newest first
+        summary_message = None
+        if summary:
+            summary_text = f"Summary of the earlier conversation:\n{summary}"
+            cost = count(summary_text)
+            if cost <= remaining:
+                summary_message = SystemMessage(content=summary_text)
+                remaining -= cost
+
+        history_messages: List[BaseMessage] = []
+        history_turns = 0
+        for turn in reversed(list(recent_turns)[-self.max_history_turns:]):
+            answer = strip_reasoning(turn.response)
+            cost = count(turn.user_message) + count(answer)
+            if cost > remaining:
+                break
+            history_messages[:0] = [HumanMessage(content=turn.user_message), AIMessage(content=answer)]
+            history_turns += 1
+            remaining -= cost
+
+        context = "\n".join(doc.page_content for doc in context_docs)
+        messages: List[BaseMessage] = [SystemMessage(content=system_prompt)]
+        if summary_message is not None:
+            messages.append(summary_message)
+        messages.extend(history_messages)
+        messages.append(HumanMessage(content=question_template.format(context=context, question=question)))
+
+        return PromptResult(
+            messages=messages,
+            prompt_tokens=fixed + available - remaining,
+            context_docs=context_docs,
+            history_turns=history_turns,
+            summary_included=summary_message is not None
+        )
@@ -0,0 +1,84 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def normalize_query(text: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question"""
+    return re.sub(r"\s+", " ", text.lower()).strip().rstrip("?!. ")
+
+
+class BoundedTTLCache:
+    """
+    LRU cache bounded by entry count and approximate bytes, with a TTL.
+
+    Each entry remembers how long it took to compute, so hits can report
+    the latency they saved.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple[Any, int, float, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_ms = 0.0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, cost_ms, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += cost_ms
+            return value
+
+    def put(self, key: Hashable, value: Any, size_bytes: int, cost_ms: float = 0.0):
+        if size_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size_bytes, cost_ms, time.monotonic() + self.ttl_seconds)
+            self._bytes += size_bytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+                "saved_ms": round(self.saved_ms, 1),
+            }
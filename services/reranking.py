@@ -0,0 +1,261 @@
+import json
+import math
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from services.lexical_index import tokenize
+from services.query_cache import normalize_query
+from services.metrics import tracer
+
+Candidate = Tuple[str, Document]
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = text.lower().split()
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _trim_overlap(earlier: str, later: str, probe: int = 50, min_overlap: int = 20) -> int:
+    """
+    Length of the prefix of ``later`` that repeats the end of ``earlier``,
+    as produced by the splitter's chunk overlap; 0 if they do not overlap.
+    """
+    head = later[:probe]
+    if len(head) < min_overlap:
+        return 0
+    # Scan forward so the longest matching overlap wins
+    start = earlier.find(head, max(0, len(earlier) - len(later)))
+    while start != -1:
+        overlap = len(earlier) - start
+        if overlap < min_overlap:
+            break
+        if later.startswith(earlier[start:]):
+            return overlap
+        start = earlier.find(head, start + 1)
+    return 0
+
+
+def dedupe_chunks(candidates: List[Candidate], threshold: float = 0.8) -> List[Candidate]:
+    """
+    Drop chunks whose word shingles are mostly contained in a better-ranked
+    chunk, and cut the overlapping text off neighbouring chunks of the same
+    document so the prompt does not carry it twice.
+    """
+    kept: List[Candidate] = []
+    kept_shingles: List[set] = []
+    for chunk_id, doc in candidates:
+        shingles = _shingles(doc.page_content)
+        if shingles and any(
+            len(shingles & other) / min(len(shingles), len(other)) >= threshold
+            for other in kept_shingles if other
+        ):
+            continue
+
+        text = doc.page_content
+        document_id = doc.metadata.get("document_id")
+        chunk = doc.metadata.get("chunk")
+        if document_id is not None and chunk is not None:
+            for _, other in kept:
+                if other.metadata.get("document_id") != document_id or other.metadata.get("chunk") is None:
+                    continue
+                if other.metadata["chunk"] == chunk - 1:
+                    text = text[_trim_overlap(other.page_content, text):]
+                elif other.metadata["chunk"] == chunk + 1:
+                    overlap = _trim_overlap(text, other.page_content)
+                    if overlap:
+                        text = text[:-overlap]
+        if not text.strip():
+            continue
+        if text != doc.page_content:
+            doc = Document(page_content=text, metadata={**doc.metadata, "trimmed_chars": len(doc.page_content) - len(text)})
+        kept.append((chunk_id, doc))
+        kept_shingles.append(shingles)
+    return kept
+
+
+def maximal_marginal_relevance(
+    query_vector: Sequence[float],
+    vectors: Sequence[Sequence[float]],
+    k: int,
+    lambda_mult: float = 0.7
+) -> List[int]:
+    """
+    Indexes of ``k`` vectors chosen greedily for relevance to the query
+    (weight ``lambda_mult``) minus similarity to those already chosen.
+    """
+    if not len(vectors) or k <= 0:
+        return []
+    import numpy as np
+    matrix = np.array(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    query = np.array(query_vector, dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-12
+    relevance = matrix @ query
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = matrix @ matrix[selected[0]]
+    while len(selected) < min(k, len(matrix)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, matrix @ matrix[best])
+    return selected
+
+
+class LexicalReranker:
+    """
+    CPU-only rescoring of a small candidate pool: BM25 weights computed over
+    the pool itself, plus bonuses for exact model/part codes and for query
+    word pairs that appear side by side.
+    """
+
+    name = "lexical"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.5, code_bonus: float = 1.0, phrase_bonus: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        self.code_bonus = code_bonus
+        self.phrase_bonus = phrase_bonus
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        query_terms = tokenize(query)
+        if not query_terms or not texts:
+            return [0.0] * len(texts)
+        unique_terms = set(query_terms)
+        codes = {t for t in unique_terms if any(c.isdigit() for c in t)}
+        query_pairs = set(zip(query_terms, query_terms[1:]))
+        tokenized = [tokenize(text) for text in texts]
+        counts = [Counter(tokens) for tokens in tokenized]
+        avg_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1.0
+        n = len(texts)
+        idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term in unique_terms
+            for df in [sum(1 for c in counts if term in c)]
+        }
+
+        scores = []
+        for tokens, tf in zip(tokenized, counts):
+            norm = self.k1 * (1 - self.b + self.b * len(tokens) / avg_length)
+            score = sum(idf[t] * tf[t] * (self.k1 + 1) / (tf[t] + norm) for t in unique_terms if tf[t])
+            score += self.code_bonus * sum(1 for code in codes if tf[code])
+            if query_pairs:
+                score += self.phrase_bonus * len(query_pairs & set(zip(tokens, tokens[1:])))
+            scores.append(score)
+        return scores
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a sentence-transformers cross-encoder on CPU"""
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        return [float(s) for s in self.model.predict([(query, text) for text in texts])]
+
+
+def create_reranker(kind: str, model_name: Optional[str] = None):
+    """``none``, ``lexical`` or ``cross-encoder`` (needs sentence-transformers)"""
+    if kind in ("", "none"):
+        return None
+    if kind == "lexical":
+        return LexicalReranker()
+    if kind == "cross-encoder":
+        return CrossEncoderReranker(model_name) if model_name else CrossEncoderReranker()
+    raise ValueError(f"Unsupported reranker: {kind}")
+
+
+class RetrievalResult(NamedTuple):
+    docs: List[Document]
+    timings_ms: Dict[str, float]
+    cached: bool = False
+
+
+class RetrievalPipeline:
+    """
+    Over-fetch with hybrid search, drop duplicate and overlapping chunks,
+    pick a diverse set by MMR on the stored vectors, then optionally rerank.
+    Each stage runs in a ``retrieval.<stage>`` span, and results are cached
+    in the vector store's retrieval cache, keyed on the collection version.
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        fetch_k: int = 30,
+        dense_k: int = 30,
+        lexical_k: int = 30,
+        dedupe_threshold: float = 0.8,
+        mmr_lambda: float = 0.7,
+        reranker=None,
+        rerank_pool: int = 2
+    ):
+        self.vector_store = vector_store
+        self.fetch_k = fetch_k
+        self.dense_k = dense_k
+        self.lexical_k = lexical_k
+        self.dedupe_threshold = dedupe_threshold
+        self.mmr_lambda = mmr_lambda
+        self.reranker = reranker
+        # With a reranker, MMR keeps rerank_pool * k chunks for it to order
+        self.rerank_pool = rerank_pool
+
+    def retrieve(self, query: str, k: int = 3, filter: Optional[dict] = None) -> RetrievalResult:
+        store = self.vector_store
+        key = (
+            "pipeline", normalize_query(query), store.version, k, self.fetch_k, self.dense_k, self.lexical_k,
+            self.dedupe_threshold, self.mmr_lambda, getattr(self.reranker, "name", None),
+            json.dumps(filter, sort_keys=True, default=str) if filter else None
+        )
+        cached = store.retrieval_cache.get(key)
+        if cached is not None:
+            return RetrievalResult(list(cached), {}, cached=True)
+
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        with tracer.span("retrieval.candidates") as span:
+            candidates = store.hybrid_search_with_ids(
+                query, k=self.fetch_k, dense_k=self.dense_k, lexical_k=self.lexical_k, filter=filter
+            )
+            span.set(candidates=len(candidates))
+        timings["candidates"] = span.duration * 1000
+
+        with tracer.span("retrieval.dedupe") as span:
+            candidates = dedupe_chunks(candidates, self.dedupe_threshold)
+            span.set(kept=len(candidates))
+        timings["dedupe"] = span.duration * 1000
+
+        pool_size = k * self.rerank_pool if self.reranker else k
+        with tracer.span("retrieval.mmr") as span:
+            if len(candidates) > pool_size:
+                vectors = store.get_vectors([chunk_id for chunk_id, _ in candidates])
+                with_vectors = [(c, vectors[c[0]]) for c in candidates if vectors.get(c[0]) is not None]
+                order = maximal_marginal_relevance(
+                    store.embed_query(query), [v for _, v in with_vectors], pool_size, self.mmr_lambda
+                )
+                candidates = [with_vectors[i][0] for i in order]
+            span.set(kept=len(candidates))
+        timings["mmr"] = span.duration * 1000
+
+        if self.reranker is not None and len(candidates) > 1:
+            with tracer.span("retrieval.rerank", reranker=self.reranker.name) as span:
+                scores = self.reranker.score(query, [doc.page_content for _, doc in candidates])
+                ranked = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+                candidates = [candidates[i] for i in ranked]
+            timings["rerank"] = span.duration * 1000
+
+        docs = [doc for _, doc in candidates[:k]]
+        cost_ms = (time.perf_counter() - start) * 1000
+        size = sum(len(doc.page_content) + 256 for doc in docs) + 128
+        store.retrieval_cache.put(key, tuple(docs), size, cost_ms)
+        return RetrievalResult(docs, {stage: round(ms, 2) for stage, ms in timings.items()})
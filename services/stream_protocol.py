@@ -0,0 +1,196 @@
+import json
+from typing import Optional, List, Tuple
+from models.schemas import ChatResponse, Source
+
+STREAM_PROTOCOL_DELTA = "delta"
+STREAM_PROTOCOL_CUMULATIVE = "cumulative"
+STREAM_PROTOCOLS = (STREAM_PROTOCOL_DELTA, STREAM_PROTOCOL_CUMULATIVE)
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+CHANNEL_ANSWER = "answer"
+CHANNEL_REASONING = "reasoning"
+
+
+class ReasoningSplitter:
+    """
+    Splits streamed model output into reasoning (inside ``<think>`` blocks)
+    and answer text as tokens arrive. A tag cut across two tokens is held
+    back until the next token shows whether it is one.
+    """
+
+    def __init__(self):
+        self._raw: List[str] = []
+        self._answer: List[str] = []
+        self._reasoning: List[str] = []
+        self._pending = ""
+        self._in_reasoning = False
+
+    @property
+    def raw(self) -> str:
+        """Everything the model produced, tags included"""
+        return "".join(self._raw)
+
+    @property
+    def answer(self) -> str:
+        return "".join(self._answer)
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self._reasoning).strip()
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Return the (channel, text) pieces that can be emitted after this token"""
+        self._raw.append(text)
+        buffer = self._pending + text
+        self._pending = ""
+        pieces: List[Tuple[str, str]] = []
+        while buffer:
+            tag = THINK_CLOSE if self._in_reasoning else THINK_OPEN
+            index = buffer.find(tag)
+            if index == -1:
+                # Keep back a tail that could be the start of the tag
+                keep = next((n for n in range(min(len(tag) - 1, len(buffer)), 0, -1) if tag.startswith(buffer[-n:])), 0)
+                self._emit(pieces, buffer[:len(buffer) - keep])
+                self._pending = buffer[len(buffer) - keep:]
+                break
+            self._emit(pieces, buffer[:index])
+            self._in_reasoning = not self._in_reasoning
+            buffer = buffer[index + len(tag):]
+        return pieces
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """Emit whatever was held back once the stream has ended"""
+        pieces: List[Tuple[str, str]] = []
+        self._emit(pieces, self._pending)
+        self._pending = ""
+        return pieces
+
+    def _emit(self, pieces: List[Tuple[str, str]], text: str):
+        if self._in_reasoning:
+            if text:
+                self._reasoning.append(text)
+                pieces.append((CHANNEL_REASONING, text))
+            return
+        if not self._answer:
+            # Drop the blank lines the model puts between </think> and the answer
+            text = text.lstrip()
+        if text:
+            self._answer.append(text)
+            pieces.append((CHANNEL_ANSWER, text))
+
+
+class CumulativeStreamEncoder:
+    """
+    Legacy protocol: every line repeats the whole answer and all sources.
+    Reasoning, when sent, is shown as a leading ``<think>`` block.
+    """
+
+    def __init__(self, sources: List[Source], conversation_id: str, user_message: str):
+        self.conversation_id = conversation_id
+        self.user_message = user_message
+        self.sources = [s.model_dump() for s in sources]
+        self._parts: List[str] = []
+        self._reasoning_parts: List[str] = []
+
+    @property
+    def response(self) -> str:
+        return "".join(self._parts)
+
+    def _display(self) -> str:
+        if not self._reasoning_parts:
+            return self.response
+        return f"<think>{''.join(self._reasoning_parts)}</think>\n\n{self.response}"
+
+    def _line(self, response: str) -> str:
+        return json.dumps({
+            "response": response,
+            "sources": self.sources,
+            "conversation_id": self.conversation_id,
+            "user_message": self.user_message
+        }) + "\n"
+
+    def start(self, thinking: str) -> str:
+        return self._line(thinking)
+
+    def queued(self, position: int) -> str:
+        return self._line(f"<think>Waiting for a free model slot (position {position} in queue)...</think>\n")
+
+    def token(self, delta: str) -> str:
+        self._parts.append(delta)
+        return self._line(self._display())
+
+    def reasoning(self, delta: str) -> str:
+        self._reasoning_parts.append(delta)
+        return self._line(self._display())
+
+    def end(self, chat_response: ChatResponse, stats: Optional[dict] = None) -> Optional[str]:
+        # The last token line already carried the full answer
+        return None
+
+    def error(self, message: str) -> str:
+        return self._line(message)
+
+
+class DeltaStreamEncoder:
+    """
+    Protocol v2: sources are sent once in a ``start`` event, then only the
+    new text of each token in ``delta`` events, then an ``end`` event that
+    carries the finished message. ``queued`` events report the request's
+    place in line while it waits for a generation slot, and ``reasoning``
+    events carry the model's thinking when the client asked for it.
+    """
+
+    def __init__(self, sources: List[Source], conversation_id: str, user_message: str):
+        self.conversation_id = conversation_id
+        self.user_message = user_message
+        self.sources = [s.model_dump() for s in sources]
+        self._parts: List[str] = []
+
+    @property
+    def response(self) -> str:
+        return "".join(self._parts)
+
+    def start(self, thinking: str) -> str:
+        return json.dumps({
+            "event": "start",
+            "protocol": STREAM_PROTOCOL_DELTA,
+            "response": thinking,
+            "sources": self.sources,
+            "conversation_id": self.conversation_id,
+            "user_message": self.user_message
+        }) + "\n"
+
+    def queued(self, position: int) -> str:
+        return json.dumps({"event": "queued", "position": position}) + "\n"
+
+    def token(self, delta: str) -> str:
+        self._parts.append(delta)
+        return json.dumps({"event": "delta", "delta": delta}) + "\n"
+
+    def reasoning(self, delta: str) -> str:
+        return json.dumps({"event": "reasoning", "delta": delta}) + "\n"
+
+    def end(self, chat_response: ChatResponse, stats: Optional[dict] = None) -> str:
+        payload = {"event": "end", **chat_response.model_dump()}
+        if stats:
+            payload["stats"] = stats
+        return json.dumps(payload) + "\n"
+
+    def error(self, message: str) -> str:
+        return json.dumps({
+            "event": "error",
+            "response": message,
+            "sources": self.sources,
+            "conversation_id": self.conversation_id,
+            "user_message": self.user_message
+        }) + "\n"
+
+
+def get_stream_encoder(protocol: str, sources: List[Source], conversation_id: str, user_message: str):
+    """Return the encoder for the requested streaming protocol"""
+    if protocol == STREAM_PROTOCOL_CUMULATIVE:
+        return CumulativeStreamEncoder(sources, conversation_id, user_message)
+    if protocol == STREAM_PROTOCOL_DELTA:
+        return DeltaStreamEncoder(sources, conversation_id, user_message)
+    raise ValueError(f"Unsupported stream protocol: {protocol}")
@@ -0,0 +1,394 @@
+import json
+import math
+import os
+import shutil
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+import numpy as np
+from services.extraction import RecordKey, cell_text
+
+FILTER_OPS = ("eq", "ne", "lt", "le", "gt", "ge", "contains")
+
+
+def _number(value: Any) -> float:
+    """The numeric value of a cell, or NaN if it has none"""
+    if isinstance(value, bool) or value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        try:
+            number = float(str(value).strip())
+        except ValueError:
+            return math.nan
+    return number if math.isfinite(number) else math.nan
+
+
+class ColumnarWriter:
+    """
+    Builds one document's column files while its records stream past.
+    Every column gets a float64 file (NaN where a cell is not a number)
+    and an int32 file of codes into a dictionary of its distinct cell
+    texts (-1 where the record has no such field). Values are buffered
+    and appended every ``flush_rows`` rows, so only the dictionaries grow
+    with the document.
+    """
+
+    def __init__(self, directory: str, max_columns: int, flush_rows: int = 65536):
+        self.directory = directory
+        self.max_columns = max_columns
+        self.flush_rows = flush_rows
+        self.rows = 0
+        # Row numbers for CSV and JSON arrays need no storing; only keyed JSON records do
+        self.keys: Optional[List[str]] = None
+        self._columns: Dict[str, dict] = {}
+        self._pending = 0
+        os.makedirs(directory)
+
+    def _add_column(self, name: str) -> Optional[dict]:
+        if len(self._columns) >= self.max_columns:
+            return None
+        index = len(self._columns)
+        column = self._columns[name] = {
+            "name": name,
+            "file": f"c{index}",
+            "numbers": array("d"),
+            "codes": array("i"),
+            "dictionary": {},
+            # Parsed once per distinct value rather than once per cell
+            "code_numbers": [],
+            "present": 0,
+            "numeric": 0,
+        }
+        # Earlier records did not have this field
+        self._pad(column, self.rows - self._pending)
+        column["numbers"].extend([math.nan] * self._pending)
+        column["codes"].extend([-1] * self._pending)
+        return column
+
+    def _pad(self, column: dict, count: int):
+        for start in range(0, count, self.flush_rows):
+            size = min(self.flush_rows, count - start)
+            with open(self._path(column, "f64"), "ab") as f:
+                array("d", [math.nan] * size).tofile(f)
+            with open(self._path(column, "i32"), "ab") as f:
+                array("i", [-1] * size).tofile(f)
+
+    def _path(self, column: dict, kind: str) -> str:
+        return os.path.join(self.directory, f"{column['file']}.{kind}")
+
+    def add(self, key: RecordKey, fields: dict):
+        for name, value in fields.items():
+            column = self._columns.get(name) or self._add_column(name)
+            if column is None:
+                continue
+            if value is None:
+                column["numbers"].append(math.nan)
+                column["codes"].append(-1)
+                continue
+            dictionary = column["dictionary"]
+            text = value if isinstance(value, str) else cell_text(value)
+            code = dictionary.get(text)
+            if code is None:
+                code = dictionary[text] = len(dictionary)
+                column["code_numbers"].append(_number(value))
+            number = column["code_numbers"][code]
+            column["numbers"].append(number)
+            column["codes"].append(code)
+            column["present"] += 1
+            if number == number:
+                column["numeric"] += 1
+        if self.keys is None and key != self.rows:
+            self.keys = [str(i) for i in range(self.rows)]
+        if self.keys is not None:
+            self.keys.append(str(key))
+        self.rows += 1
+        self._pending += 1
+        # Fields this record lacks
+        for column in self._columns.values():
+            if len(column["codes"]) < self._pending:
+                column["numbers"].append(math.nan)
+                column["codes"].append(-1)
+        if self._pending >= self.flush_rows:
+            self._flush()
+
+    def _flush(self):
+        for column in self._columns.values():
+            with open(self._path(column, "f64"), "ab") as f:
+                column["numbers"].tofile(f)
+            with open(self._path(column, "i32"), "ab") as f:
+                column["codes"].tofile(f)
+            column["numbers"] = array("d")
+            column["codes"] = array("i")
+        self._pending = 0
+
+    def finish(self) -> dict:
+        """Write the remaining rows and the manifest; returns the manifest"""
+        self._flush()
+        columns = []
+        for column in self._columns.values():
+            dictionary = list(column["dictionary"])
+            with open(self._path(column, "dict.json"), "w", encoding="utf-8") as f:
+                json.dump(dictionary, f, ensure_ascii=False)
+            present, numeric = column["present"], column["numeric"]
+            columns.append({
+                "name": column["name"],
+                "file": column["file"],
+                "present": present,
+                "numeric": numeric,
+                "distinct": len(dictionary),
+                "type": "number" if present and numeric == present else "text",
+            })
+        manifest = {"rows": self.rows, "columns": columns, "keys": self.keys}
+        with open(os.path.join(self.directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        return manifest
+
+
+class _Table:
+    """One document's columns, memory-mapped, with dictionaries loaded on first use"""
+
+    def __init__(self, directory: str, manifest: dict, signature: tuple):
+        self.directory = directory
+        self.rows = manifest["rows"]
+        self.keys = manifest.get("keys")
+        self.columns = {column["name"]: column for column in manifest["columns"]}
+        self.signature = signature
+        self._arrays: Dict[Tuple[str, str], np.ndarray] = {}
+        self._dictionaries: Dict[str, List[str]] = {}
+
+    def _array(self, name: str, kind: str) -> np.ndarray:
+        cached = self._arrays.get((name, kind))
+        if cached is None:
+            dtype = np.float64 if kind == "f64" else np.int32
+            path = os.path.join(self.directory, f"{self.columns[name]['file']}.{kind}")
+            cached = np.memmap(path, dtype=dtype, mode="r") if self.rows else np.empty(0, dtype=dtype)
+            self._arrays[(name, kind)] = cached
+        return cached
+
+    def numbers(self, name: str) -> np.ndarray:
+        return self._array(name, "f64")
+
+    def codes(self, name: str) -> np.ndarray:
+        return self._array(name, "i32")
+
+    def dictionary(self, name: str) -> List[str]:
+        cached = self._dictionaries.get(name)
+        if cached is None:
+            path = os.path.join(self.directory, f"{self.columns[name]['file']}.dict.json")
+            with open(path, encoding="utf-8") as f:
+                cached = self._dictionaries[name] = json.load(f)
+        return cached
+
+    def text_mask(self, name: str, predicate) -> np.ndarray:
+        """Rows whose cell text satisfies ``predicate``, tested once per distinct value"""
+        dictionary = self.dictionary(name)
+        # The extra False at the end is what code -1 (no value) indexes
+        table = np.fromiter((predicate(value) for value in dictionary), dtype=bool, count=len(dictionary))
+        return np.append(table, False)[self.codes(name)]
+
+    def mask(self, name: str, op: str, value: Any) -> np.ndarray:
+        if name not in self.columns:
+            return np.zeros(self.rows, dtype=bool)
+        number = _number(value)
+        if op == "contains":
+            needle = cell_text(value).lower()
+            return self.text_mask(name, lambda text: needle in text.lower())
+        if op in ("eq", "ne"):
+            if not math.isnan(number) and self.columns[name]["numeric"]:
+                matched = self.numbers(name) == number
+            else:
+                target = cell_text(value)
+                matched = self.text_mask(name, lambda text: text == target)
+            return matched if op == "eq" else ~matched & (self.codes(name) >= 0)
+        compare = {"lt": np.less, "le": np.less_equal, "gt": np.greater, "ge": np.greater_equal}[op]
+        if not math.isnan(number):
+            # NaN compares false, so cells that are not numbers never match
+            return compare(self.numbers(name), number)
+        # Text order, e.g. ISO dates
+        target = cell_text(value)
+        return self.text_mask(name, lambda text: bool(compare(text, target)))
+
+    def row(self, index: int) -> Tuple[RecordKey, dict]:
+        values = {}
+        for name in self.columns:
+            code = int(self.codes(name)[index])
+            if code >= 0:
+                values[name] = self.dictionary(name)[code]
+        return (self.keys[index] if self.keys else index), values
+
+
+class StructuredIndex:
+    """
+    Columnar side index over the records of CSV and JSON documents, so
+    filters on their fields (``status = service``, ``firmware >= 2``) are
+    answered directly from the data instead of through retrieval and the
+    LLM.
+
+    Each document has a directory of column files (see ColumnarWriter)
+    built during ingestion and moved into place when it succeeds, so a
+    re-ingested document is replaced in one step. Readers memory-map the
+    files and notice replacements by the manifest's inode and mtime, which
+    keeps worker processes in step without coordination.
+    """
+
+    def __init__(self, directory: str, max_columns: int = 256):
+        self.directory = directory
+        self.max_columns = max_columns
+        self._tables: Dict[str, _Table] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _document_dir(self, document_id: str) -> str:
+        # Ids arrive in request bodies; keep them to one plain entry of the index directory
+        if (
+            not document_id
+            or document_id.startswith(".")
+            or ".." in document_id
+            or os.sep in document_id
+            or (os.altsep and os.altsep in document_id)
+        ):
+            raise ValueError(f"Invalid document id '{document_id}'")
+        return os.path.join(self.directory, document_id)
+
+    def writer(self, document_id: str) -> ColumnarWriter:
+        self._document_dir(document_id)
+        staging = os.path.join(self.directory, f".{document_id}.{uuid4().hex[:8]}.tmp")
+        return ColumnarWriter(staging, self.max_columns)
+
+    def commit(self, document_id: str, writer: ColumnarWriter):
+        """Finish a writer and make it the document's index, replacing any previous one"""
+        manifest = writer.finish()
+        target = self._document_dir(document_id)
+        retired = None
+        if os.path.exists(target):
+            retired = os.path.join(self.directory, f".{document_id}.{uuid4().hex[:8]}.old")
+            os.replace(target, retired)
+        os.replace(writer.directory, target)
+        if retired:
+            # Open memory maps keep the old files readable until they are dropped
+            shutil.rmtree(retired, ignore_errors=True)
+        print(f"Indexed {manifest['rows']} records in {len(manifest['columns'])} columns for {document_id}")
+
+    def abort(self, writer: ColumnarWriter):
+        shutil.rmtree(writer.directory, ignore_errors=True)
+
+    def delete(self, document_id: str):
+        with self._lock:
+            self._tables.pop(document_id, None)
+        shutil.rmtree(self._document_dir(document_id), ignore_errors=True)
+
+    def document_ids(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.directory) if not name.startswith("."))
+
+    def _table(self, document_id: str) -> Optional[_Table]:
+        directory = self._document_dir(document_id)
+        manifest_path = os.path.join(directory, "manifest.json")
+        try:
+            stat = os.stat(manifest_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._tables.pop(document_id, None)
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            table = self._tables.get(document_id)
+            if table is not None and table.signature == signature:
+                return table
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                table = _Table(directory, json.load(f), signature)
+        except FileNotFoundError:
+            # Replaced between the stat and the open; the next query sees the new one
+            return None
+        with self._lock:
+            self._tables[document_id] = table
+        return table
+
+    def columns(self, document_id: str) -> Optional[dict]:
+        try:
+            table = self._table(document_id)
+        except ValueError:
+            return None
+        if table is None:
+            return None
+        return {
+            "document_id": document_id,
+            "rows": table.rows,
+            "columns": [
+                {key: column[key] for key in ("name", "type", "present", "numeric", "distinct")}
+                for column in table.columns.values()
+            ],
+        }
+
+    def query(
+        self,
+        filters: Iterable[Tuple[str, str, Any]],
+        document_ids: Optional[Iterable[str]] = None,
+        limit: int = 50,
+        stats: Iterable[str] = ()
+    ) -> dict:
+        """
+        Rows of the given documents (all indexed ones by default) matching
+        every ``(column, op, value)`` filter. ``eq``/``ne`` compare as
+        numbers when both sides are numbers and as text otherwise;
+        ``lt``/``le``/``gt``/``ge`` compare numbers, or text for a
+        non-numeric value; ``contains`` is a case-insensitive substring
+        test. Returns the match count per document, up to ``limit`` rows,
+        and count/min/max/mean/sum of the numeric ``stats`` columns over
+        all matches. Raises ValueError for an unknown op or a document id
+        that is not a plain name.
+        """
+        filters = list(filters)
+        for _, op, _ in filters:
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unknown filter op '{op}'. Use one of: {', '.join(FILTER_OPS)}")
+        document_ids = list(document_ids) if document_ids is not None else self.document_ids()
+        for document_id in document_ids:
+            self._document_dir(document_id)
+        stats = list(stats)
+        totals = {name: [0, 0.0, math.inf, -math.inf] for name in stats}
+        documents, rows, matched = [], [], 0
+        for document_id in document_ids:
+            table = self._table(document_id)
+            if table is None or not table.rows:
+                continue
+            mask = np.ones(table.rows, dtype=bool)
+            for column, op, value in filters:
+                mask &= table.mask(column, op, value)
+            indices = np.flatnonzero(mask)
+            if not len(indices):
+                continue
+            matched += len(indices)
+            documents.append({"document_id": document_id, "matched": int(len(indices))})
+            for index in indices[:max(0, limit - len(rows))]:
+                key, values = table.row(int(index))
+                rows.append({"document_id": document_id, "row": int(index), "key": str(key), "values": values})
+            for name in stats:
+                if name not in table.columns:
+                    continue
+                numbers = table.numbers(name)[indices]
+                numbers = numbers[~np.isnan(numbers)]
+                if len(numbers):
+                    total = totals[name]
+                    total[0] += len(numbers)
+                    total[1] += float(numbers.sum())
+                    total[2] = min(total[2], float(numbers.min()))
+                    total[3] = max(total[3], float(numbers.max()))
+        return {
+            "matched": matched,
+            "documents": documents,
+            "rows": rows,
+            "stats": {
+                name: {
+                    "count": count,
+                    "sum": total_sum if count else None,
+                    "min": low if count else None,
+                    "max": high if count else None,
+                    "mean": total_sum / count if count else None,
+                }
+                for name, (count, total_sum, low, high) in totals.items()
+            },
+        }
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import zipfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.json', '.csv')
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload (or an archive member) exceeds the configured size limit"""
+
+
+def copy_stream(
+    source: BinaryIO,
+    dest_path: str,
+    max_bytes: Optional[int] = None,
+    chunk_size: int = UPLOAD_CHUNK_BYTES
+) -> Tuple[str, int]:
+    """
+    Copy a binary stream to ``dest_path`` one chunk at a time, hashing it
+    on the way, so memory use does not depend on the file size. Returns
+    ``(sha256 hex digest, size)``. Past ``max_bytes`` the partial file is
+    removed and UploadTooLargeError is raised.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, 'wb') as f:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return digest.hexdigest(), size
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith('.zip')
+
+
+def iter_archive(source: BinaryIO, max_files: int) -> Iterator[Tuple[str, Optional[BinaryIO], Optional[str]]]:
+    """
+    Walk a zip archive as ``(filename, member stream, skip reason)``, one
+    member open at a time; members are decompressed as they are read.
+    Directories, macOS resource forks and hidden files are left out
+    silently, unsupported types come with a reason instead of a stream.
+    Only the base name is kept, so members cannot escape the upload
+    directory.
+    """
+    with zipfile.ZipFile(source) as archive:
+        seen = 0
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name or name.startswith('.') or member.filename.startswith('__MACOSX/'):
+                continue
+            if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield name, None, "unsupported file type"
+                continue
+            seen += 1
+            if seen > max_files:
+                yield name, None, f"more than {max_files} documents in one request"
+                continue
+            with archive.open(member) as stream:
+                yield name, stream, None
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware that stops reading a request body once it passes the
+    limit for its route and answers 413, before the multipart parser has
+    spooled the rest to disk. A declared Content-Length over the limit is
+    rejected without reading anything.
+
+    ``limits`` is a list of ``(method, path regex, max bytes)``; requests
+    matching none are not limited.
+    """
+
+    def __init__(self, app, limits: List[Tuple[str, str, int]]):
+        self.app = app
+        self.limits = [(method, re.compile(pattern), max_bytes) for method, pattern, max_bytes in limits]
+
+    def _limit_for(self, scope) -> Optional[int]:
+        for method, pattern, max_bytes in self.limits:
+            if scope["method"] == method and pattern.fullmatch(scope["path"]) and max_bytes:
+                return max_bytes
+        return None
+
+    async def _reject(self, send, limit: int):
+        body = json.dumps({"detail": f"Request body exceeds the {limit} byte limit"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit_for(scope) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLargeError(f"Request body exceeds the {limit} byte limit")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # The app turns the aborted body into an error response of its own; 413 replaces it
+            if exceeded:
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            pass
+        if exceeded and not started:
+            await self._reject(send, limit)
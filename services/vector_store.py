@@ -0,0 +1,551 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import uuid4
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from services.lexical_index import LexicalIndex, reciprocal_rank_fusion, filter_document_ids
+from services.query_cache import BoundedTTLCache, normalize_query
+from services.metrics import tracer
+from services.change_feed import ChangeFeed
+
+
+COLLECTION_MODES = ("shared", "per_document")
+VECTOR_BACKENDS = ("chroma", "mmap")
+# Installs that embedded with the chat model kept their vectors in LangChain's default collection
+LEGACY_COLLECTION_NAME = "langchain"
+LEGACY_EMBEDDING_MODEL = "deepseek-r1:32b"
+
+
+def collection_name_for(embedding_model: str) -> str:
+    """
+    Collection holding the vectors of one embedding model. Models differ
+    in dimension, so each gets its own collection instead of failing on
+    the other's vectors. The name stays short enough (22 characters) for
+    Chroma's 63-character limit with a ``_doc_<uuid>`` suffix.
+    """
+    if embedding_model == LEGACY_EMBEDDING_MODEL:
+        return LEGACY_COLLECTION_NAME
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", embedding_model).strip("-")[:15].rstrip("-") or "embeddings"
+    digest = hashlib.sha1(embedding_model.encode("utf-8")).hexdigest()[:6]
+    return f"{slug}-{digest}"
+
+
+class SharedVectorStore:
+    """
+    Single, process-wide handle on the Chroma collection. Owned by the app
+    and injected into DocumentProcessor and ChatService so documents added
+    by an upload are immediately visible to every conversation.
+
+    Embedding happens outside the lock; only the collection write is
+    serialized, so retrieval is not blocked while a large upload embeds.
+
+    A BM25 lexical index is kept in step with the collection for exact
+    matches on part numbers and model codes that dense search misses.
+
+    Query embeddings and fused retrieval results are cached by normalized
+    query text. Retrieval entries are keyed on the collection version and
+    dropped whenever the collection changes.
+
+    Deleting chunks leaves holes in the lexical index and free pages in
+    Chroma's SQLite file; ``maybe_compact`` reclaims both on a background
+    thread once enough have piled up.
+
+    With ``collection_mode="per_document"`` each document's chunks live in
+    their own Chroma collection. A query scoped to some documents then only
+    touches their (small) indexes, searched in parallel and merged by
+    distance, and deleting a document drops its collection outright.
+    Switching modes does not move existing chunks; re-ingest after a change.
+
+    ``backend="mmap"`` swaps Chroma for ``MmapCollection``: flat search over
+    a memory-mapped float16 matrix under ``<persist_directory>/mmap``. It
+    is smaller and faster to open at our corpus sizes, and worker processes
+    share its pages. The two backends do not share data either.
+
+    ``collection_name`` should come from ``collection_name_for`` so that
+    changing the embedding model starts a new, empty collection rather
+    than mixing vector dimensions. The old collection is left on disk;
+    DocumentProcessor.claim_for_reembedding finds the documents to ingest
+    again.
+
+    Nothing is opened in the constructor: the collection (and Chroma's
+    import), the per-document collections and the lexical index are loaded
+    on first use, or ahead of it by ``warm_up()``.
+
+    Given a ``ChangeFeed``, every write is announced to the other worker
+    processes by document id; when they announce theirs, this process
+    re-reads those documents' chunks into its lexical index and drops its
+    retrieval cache. Chroma keeps its HNSW index in process memory, so only
+    the mmap backend sees other workers' vectors without a restart.
+    """
+
+    def __init__(
+        self,
+        persist_directory: str,
+        embeddings: Embeddings,
+        collection_name: str = "langchain",
+        query_cache_entries: int = 2048,
+        query_cache_bytes: int = 64 * 1024 * 1024,
+        query_cache_ttl: float = 3600,
+        collection_mode: str = "shared",
+        search_workers: int = 8,
+        backend: str = "chroma",
+        mmap_nprobe: int = 16,
+        change_feed: Optional[ChangeFeed] = None
+    ):
+        if collection_mode not in COLLECTION_MODES:
+            raise ValueError(f"Unsupported collection mode: {collection_mode}")
+        if backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unsupported vector backend: {backend}")
+        self.persist_directory = persist_directory
+        self.embeddings = embeddings
+        self.collection_name = collection_name
+        self.collection_mode = collection_mode
+        self.backend = backend
+        self.search_workers = search_workers
+        self._search_executor: Optional[ThreadPoolExecutor] = None
+        self.mmap_nprobe = mmap_nprobe
+        # Reentrant: opening the store on first use can happen inside a write
+        self._write_lock = threading.RLock()
+        self._version = 0
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._change_listeners: List[Callable[[Set[str]], None]] = []
+        self.change_feed = change_feed
+        self._handles: Optional[tuple] = None
+        self._ready = False
+        self._document_collection_map: Dict[str, object] = {}
+        self.query_embedding_cache = BoundedTTLCache(query_cache_entries, query_cache_bytes // 2, query_cache_ttl)
+        self.retrieval_cache = BoundedTTLCache(query_cache_entries, query_cache_bytes // 2, query_cache_ttl)
+        if change_feed is not None:
+            change_feed.subscribe("vectors", self.apply_remote_changes)
+
+    def _open(self) -> tuple:
+        """(client, collection, lexical index), opened on first call"""
+        if self._ready:
+            return self._handles
+        with self._write_lock:
+            # The opening thread gets the handles back while it is still filling them in
+            if self._handles is not None:
+                return self._handles
+            start = time.perf_counter()
+            try:
+                if self.backend == "mmap":
+                    from services.mmap_vector_index import MmapVectorClient
+                    index_directory = os.path.join(self.persist_directory, "mmap")
+                    client = MmapVectorClient(index_directory, nprobe=self.mmap_nprobe)
+                    collection = client.get_or_create_collection(self.collection_name)
+                else:
+                    from langchain_community.vectorstores import Chroma
+                    index_directory = self.persist_directory
+                    store = Chroma(
+                        collection_name=self.collection_name,
+                        persist_directory=self.persist_directory,
+                        embedding_function=self.embeddings
+                    )
+                    client, collection = store._client, store._collection
+                lexical = LexicalIndex(os.path.join(index_directory, f"{self.collection_name}_lexical.pkl"))
+                self._handles = (client, collection, lexical)
+                if self.collection_mode == "per_document":
+                    self._load_document_collections()
+                if len(lexical) != self.count():
+                    self.rebuild_lexical_index()
+                self._warn_other_collections(client)
+            except BaseException:
+                self._handles = None
+                self._document_collection_map = {}
+                raise
+            self._ready = True
+            print(f"Vector store opened in {time.perf_counter() - start:.2f}s")
+            return self._handles
+
+    @property
+    def _client(self):
+        return self._open()[0]
+
+    @property
+    def _collection(self):
+        return self._open()[1]
+
+    @property
+    def lexical(self) -> LexicalIndex:
+        return self._open()[2]
+
+    @property
+    def _document_collections(self) -> Dict[str, object]:
+        self._open()
+        return self._document_collection_map
+
+    def warm_up(self):
+        """Open the store now instead of on the first request"""
+        self._open()
+
+    @property
+    def version(self) -> int:
+        """Incremented on every write; lets callers detect stale cached results"""
+        return self._version
+
+    def _warn_other_collections(self, client):
+        """Point out vectors left behind by a previous embedding model"""
+        if self.count():
+            return
+        doc_marker = "_doc_"
+        others = sorted({
+            getattr(collection, "name", collection) for collection in client.list_collections()
+        } - {self.collection_name})
+        others = [name for name in others if doc_marker not in name]
+        if others:
+            print(
+                f"Warning: collection '{self.collection_name}' is empty but {', '.join(others)} exist. "
+                f"They hold vectors from another embedding model; documents are re-ingested into this "
+                f"one at startup, after which the old collections can be deleted."
+            )
+
+    def _document_collection_name(self, document_id: str) -> str:
+        return f"{self.collection_name}_doc_{document_id}"
+
+    def _load_document_collections(self):
+        prefix = self._document_collection_name("")
+        for collection in self._client.list_collections():
+            # Older chromadb returns Collection objects, newer ones return names
+            name = getattr(collection, "name", collection)
+            if name.startswith(prefix):
+                self._document_collections[name[len(prefix):]] = self._client.get_collection(name)
+
+    def _collection_for(self, document_id: Optional[str], create: bool = True):
+        """Collection holding a document's chunks (the shared one unless partitioned)"""
+        if self.collection_mode != "per_document" or document_id is None:
+            return self._collection
+        collection = self._document_collections.get(document_id)
+        if collection is None and create:
+            collection = self._client.get_or_create_collection(self._document_collection_name(document_id))
+            self._document_collections[document_id] = collection
+        return collection
+
+    def _all_collections(self) -> list:
+        return [self._collection] + list(self._document_collections.values())
+
+    def _collections_for(self, filter: Optional[dict]) -> List[Tuple[object, Optional[dict]]]:
+        """(collection, remaining where clause) pairs a filtered query has to visit"""
+        document_ids = filter_document_ids(filter)
+        if document_ids is not None and not document_ids:
+            return []
+        if self.collection_mode != "per_document":
+            return [(self._collection, filter or None)]
+        if document_ids is None:
+            return [(collection, filter or None) for collection in self._all_collections()]
+        # The collection already implies the document, so drop that condition
+        rest = {key: value for key, value in filter.items() if key != "document_id"} or None
+        return [
+            (self._document_collections[document_id], rest)
+            for document_id in sorted(document_ids) if document_id in self._document_collections
+        ]
+
+    def _group_by_collection(self, metadatas: List[dict]) -> Dict[int, Tuple[object, List[int]]]:
+        groups: Dict[int, Tuple[object, List[int]]] = {}
+        for i, metadata in enumerate(metadatas):
+            collection = self._collection_for((metadata or {}).get("document_id"))
+            groups.setdefault(id(collection), (collection, []))[1].append(i)
+        return groups
+
+    def rebuild_lexical_index(self, page_size: int = 1000):
+        """Re-read every chunk from Chroma into a fresh lexical index"""
+        print(f"Rebuilding lexical index from {self.count()} chunks...")
+        with self._write_lock:
+            self.lexical.clear()
+            for collection in self._all_collections():
+                offset = 0
+                while True:
+                    page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                    if not page["ids"]:
+                        break
+                    self.lexical.add(page["ids"], page["documents"], page["metadatas"])
+                    offset += len(page["ids"])
+            self.lexical.flush()
+
+    def add_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[str]:
+        if not texts:
+            return []
+        vectors = self.embeddings.embed_documents(texts)
+        ids = [str(uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        with self._write_lock:
+            for collection, indexes in self._group_by_collection(metadatas).values():
+                collection.upsert(
+                    ids=[ids[i] for i in indexes],
+                    embeddings=[vectors[i] for i in indexes],
+                    metadatas=[metadatas[i] for i in indexes],
+                    documents=[texts[i] for i in indexes]
+                )
+            self.lexical.add(ids, texts, metadatas)
+            self._bump_version(m.get("document_id") for m in metadatas)
+        return ids
+
+    def get_chunks(self, where: dict) -> Tuple[List[str], List[str], List[dict]]:
+        """Return (ids, texts, metadatas) of every chunk matching a metadata filter"""
+        ids, texts, metadatas = [], [], []
+        for collection, rest in self._collections_for(where):
+            result = collection.get(where=rest, include=["documents", "metadatas"])
+            ids.extend(result["ids"])
+            texts.extend(result["documents"])
+            metadatas.extend(m or {} for m in result["metadatas"])
+        return ids, texts, metadatas
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]):
+        """Rewrite chunk metadata in place, keeping the stored vectors"""
+        if not ids:
+            return
+        with self._write_lock:
+            for collection, indexes in self._group_by_collection(metadatas).values():
+                collection.update(ids=[ids[i] for i in indexes], metadatas=[metadatas[i] for i in indexes])
+            self.lexical.update_metadata(ids, metadatas)
+            self._bump_version(m.get("document_id") for m in metadatas)
+
+    def delete(self, ids: List[str]) -> int:
+        if not ids:
+            return 0
+        with self._write_lock:
+            groups: Dict[int, Tuple[object, List[str]]] = {}
+            document_ids = set()
+            for chunk_id in ids:
+                document_id = self.lexical.document_of(chunk_id)
+                document_ids.add(document_id)
+                collection = self._collection_for(document_id, create=False)
+                if collection is not None:
+                    groups.setdefault(id(collection), (collection, []))[1].append(chunk_id)
+            for collection, chunk_ids in groups.values():
+                collection.delete(ids=chunk_ids)
+            self.lexical.remove(ids)
+            self._bump_version(document_ids)
+        return len(ids)
+
+    def delete_document(self, document_id: str) -> int:
+        """Remove every chunk of a document; returns the number removed"""
+        if self.collection_mode == "per_document" and document_id in self._document_collections:
+            with self._write_lock:
+                collection = self._document_collections.pop(document_id)
+                ids = collection.get(include=[])["ids"]
+                self._client.delete_collection(self._document_collection_name(document_id))
+                self.lexical.remove(ids)
+                self._bump_version([document_id])
+            self.lexical.flush()
+            return len(ids)
+        ids = self._collection.get(where={"document_id": document_id}, include=[])["ids"]
+        removed = self.delete(ids)
+        self.lexical.flush()
+        return removed
+
+    def compact(self):
+        """Drop empty lexical slots and VACUUM Chroma's SQLite file (or rewrite the mmap files)"""
+        start = time.perf_counter()
+        with self._write_lock:
+            self.lexical.compact()
+            self.lexical.flush()
+            if self.backend == "mmap":
+                for collection in self._all_collections():
+                    collection.compact()
+                print(f"Vector store compacted in {time.perf_counter() - start:.2f}s")
+                return
+            sqlite_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+            if os.path.exists(sqlite_path):
+                try:
+                    conn = sqlite3.connect(sqlite_path, timeout=30)
+                    try:
+                        conn.execute("VACUUM")
+                    finally:
+                        conn.close()
+                except sqlite3.Error as e:
+                    print(f"Could not vacuum vector store: {str(e)}")
+        print(f"Vector store compacted in {time.perf_counter() - start:.2f}s")
+
+    def maybe_compact(self, min_dead_ratio: float = 0.2):
+        """Start a background compaction if enough deleted slots have accumulated"""
+        if self.lexical.dead_ratio < min_dead_ratio:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self.compact, name="vector-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def add_change_listener(self, callback: Callable[[Set[str]], None]):
+        """Call ``callback(document_ids)`` after every write, with the documents it touched"""
+        self._change_listeners.append(callback)
+
+    def apply_remote_changes(self, document_ids: Set[Optional[str]]):
+        """
+        Catch up with writes another worker process made to the listed
+        documents (None: unknown documents, caches only).
+        """
+        with self._write_lock:
+            if self.collection_mode == "per_document":
+                self._document_collections.clear()
+                self._load_document_collections()
+            for document_id in document_ids - {None}:
+                ids, texts, metadatas = self.get_chunks({"document_id": document_id})
+                stale = set(self.lexical.document_chunk_ids(document_id)) - set(ids)
+                self.lexical.remove(stale)
+                self.lexical.add(ids, texts, metadatas)
+                self.lexical.update_metadata(ids, metadatas)
+            self._bump_version(document_ids, publish=False)
+
+    def _bump_version(self, document_ids: Iterable[Optional[str]] = (), publish: bool = True):
+        self._version += 1
+        self.retrieval_cache.clear()
+        changed = set(document_ids) - {None}
+        if publish and self.change_feed is not None:
+            try:
+                self.change_feed.publish("vectors", changed)
+            except Exception as e:
+                print(f"Could not announce vector store change: {str(e)}")
+        for callback in self._change_listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                print(f"Vector store change listener failed: {str(e)}")
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing the vector for repeated questions"""
+        key = normalize_query(query)
+        vector = self.query_embedding_cache.get(key)
+        if vector is None:
+            with tracer.span("embedding.query") as span:
+                vector = self.embeddings.embed_query(query)
+            cost_ms = span.duration * 1000
+            # A list of floats costs roughly 32 bytes per element
+            self.query_embedding_cache.put(key, vector, 32 * len(vector) + len(key) + 64, cost_ms)
+        return vector
+
+    def cache_stats(self) -> dict:
+        return {
+            "collection_version": self._version,
+            "lexical_dead_ratio": round(self.lexical.dead_ratio, 4),
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "retrieval": self.retrieval_cache.stats(),
+        }
+
+    def flush(self):
+        """Persist in-memory side indexes; call after a document finishes ingesting"""
+        self.lexical.flush()
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Document]:
+        return [doc for _, doc in self.dense_search(query, k=k, filter=filter)]
+
+    def _get_search_executor(self) -> ThreadPoolExecutor:
+        if self._search_executor is None:
+            with self._write_lock:
+                if self._search_executor is None:
+                    self._search_executor = ThreadPoolExecutor(
+                        max_workers=self.search_workers, thread_name_prefix="vector-search"
+                    )
+        return self._search_executor
+
+    def dense_search(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[str, Document]]:
+        """
+        Vector search returning (chunk id, document) pairs. Filters are
+        pushed down to Chroma; with per-document collections only the
+        selected documents' collections are queried.
+        """
+        targets = self._collections_for(filter)
+        if k <= 0 or not targets:
+            return []
+        vector = self.embed_query(query)
+
+        def query_one(target) -> List[Tuple[float, str, Document]]:
+            collection, where = target
+            result = collection.query(
+                query_embeddings=[vector],
+                n_results=k,
+                where=where,
+                include=["documents", "metadatas", "distances"]
+            )
+            return [
+                (distance, chunk_id, Document(page_content=text, metadata=metadata or {}))
+                for chunk_id, text, metadata, distance in zip(
+                    result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+                )
+            ]
+
+        if len(targets) > 1:
+            # Querying an empty collection is wasted work, and an error on older chromadb
+            targets = [target for target in targets if target[0].count() > 0]
+        if not targets:
+            return []
+        if len(targets) == 1:
+            hits = query_one(targets[0])
+        else:
+            hits = [hit for part in self._get_search_executor().map(query_one, targets) for hit in part]
+            hits.sort(key=lambda hit: hit[0])
+        return [(chunk_id, doc) for _, chunk_id, doc in hits[:k]]
+
+    def keyword_search(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[str, Document]]:
+        """BM25 lookup only; never calls the embedding model"""
+        return [
+            (chunk_id, Document(page_content=text, metadata=metadata or {}))
+            for chunk_id, _, text, metadata in self.lexical.search(query, k=k, filter=filter)
+        ]
+
+    def hybrid_search(
+        self,
+        query: str,
+        k: int = 4,
+        dense_k: int = 20,
+        lexical_k: int = 20,
+        filter: Optional[dict] = None,
+        rrf_k: int = 60
+    ) -> List[Document]:
+        """Dense and BM25 results fused by reciprocal rank"""
+        return [doc for _, doc in self.hybrid_search_with_ids(query, k, dense_k, lexical_k, filter, rrf_k)]
+
+    def hybrid_search_with_ids(
+        self,
+        query: str,
+        k: int = 4,
+        dense_k: int = 20,
+        lexical_k: int = 20,
+        filter: Optional[dict] = None,
+        rrf_k: int = 60
+    ) -> List[Tuple[str, Document]]:
+        """``hybrid_search`` returning (chunk id, document) pairs"""
+        key = (
+            normalize_query(query), self._version, k, dense_k, lexical_k, rrf_k,
+            json.dumps(filter, sort_keys=True, default=str) if filter else None
+        )
+        cached = self.retrieval_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        start = time.perf_counter()
+        dense = self.dense_search(query, k=dense_k, filter=filter)
+        lexical = self.keyword_search(query, k=lexical_k, filter=filter)
+        by_id = dict(lexical)
+        by_id.update(dense)
+        fused = reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _ in dense], [chunk_id for chunk_id, _ in lexical]],
+            k=rrf_k
+        )
+        hits = [(chunk_id, by_id[chunk_id]) for chunk_id, _ in fused[:k]]
+        cost_ms = (time.perf_counter() - start) * 1000
+        size = sum(len(doc.page_content) + 320 for _, doc in hits) + 128
+        self.retrieval_cache.put(key, tuple(hits), size, cost_ms)
+        return hits
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, List[float]]:
+        """Stored embeddings for the given chunk ids, read back from Chroma"""
+        groups: Dict[int, Tuple[object, List[str]]] = {}
+        for chunk_id in ids:
+            collection = self._collection_for(self.lexical.document_of(chunk_id), create=False)
+            if collection is not None:
+                groups.setdefault(id(collection), (collection, []))[1].append(chunk_id)
+        vectors: Dict[str, List[float]] = {}
+        for collection, chunk_ids in groups.values():
+            result = collection.get(ids=chunk_ids, include=["embeddings"])
+            vectors.update(zip(result["ids"], result["embeddings"]))
+        return vectors
+
+    def count(self) -> int:
+        return sum(collection.count() for collection in self._all_collections())
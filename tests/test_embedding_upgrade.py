@@ -0,0 +1,98 @@
+"""
+Upgrading the embedding model: documents embedded into the legacy
+collection must be ingested again into the new model's collection, not
+reported as duplicates of themselves.
+"""
+import hashlib
+import io
+import json
+import os
+from datetime import datetime
+from typing import List
+from langchain_core.embeddings import Embeddings
+from services.document_processor import DocumentProcessor
+from services.document_store import DocumentStore
+from services.vector_store import LEGACY_COLLECTION_NAME, SharedVectorStore, collection_name_for
+
+RECORDS = json.dumps([{"serial": f"SN{i:04d}", "status": "ok" if i % 3 else "service"} for i in range(40)]).encode()
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic 8-dimensional vectors, so no Ollama is needed"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [byte / 255 for byte in digest[:8]]
+
+
+def make_processor(tmp_path, collection_name: str) -> DocumentProcessor:
+    db_dir = str(tmp_path / "db")
+    embeddings = HashEmbeddings()
+    vector_store = SharedVectorStore(
+        persist_directory=db_dir, embeddings=embeddings, collection_name=collection_name, backend="mmap"
+    )
+    return DocumentProcessor(
+        upload_dir=str(tmp_path / "uploads"),
+        db_directory=db_dir,
+        vector_store=vector_store,
+        embeddings=embeddings
+    )
+
+
+def add_legacy_document(tmp_path) -> str:
+    """A completed document from before collections were recorded, with its file on disk"""
+    doc_id = "legacy-doc"
+    os.makedirs(tmp_path / "uploads", exist_ok=True)
+    (tmp_path / "uploads" / f"{doc_id}_fleet.json").write_bytes(RECORDS)
+    store = DocumentStore(str(tmp_path / "db"))
+    store.add_unless_duplicate({
+        "id": doc_id,
+        "filename": "fleet.json",
+        "document_type": "json",
+        "upload_date": datetime.now(),
+        "total_pages": 1,
+        "status": "processed",
+        "embedding_status": "completed",
+        "content_hash": hashlib.sha256(RECORDS).hexdigest(),
+    })
+    store.close()
+    return doc_id
+
+
+def test_legacy_document_is_reingested_after_model_change(tmp_path):
+    doc_id = add_legacy_document(tmp_path)
+    processor = make_processor(tmp_path, collection_name_for("nomic-embed-text"))
+
+    # A re-upload of the same file is not answered by the stale document
+    assert processor.find_by_content_hash(hashlib.sha256(RECORDS).hexdigest()) is None
+
+    claimed = processor.claim_for_reembedding()
+    assert [doc.id for doc in claimed] == [doc_id]
+    assert processor.get_document(doc_id).embedding_status == "pending"
+    # Claimed once, even with several workers starting up
+    assert processor.claim_for_reembedding() == []
+
+    processor.ingest_document(doc_id)
+    doc = processor.get_document(doc_id)
+    assert doc.embedding_status == "completed"
+    assert doc.vector_collection == collection_name_for("nomic-embed-text")
+    ids, _, _ = processor.vector_store.get_chunks({"document_id": doc_id})
+    assert ids
+
+    # Now live in the current collection, so the same file is a duplicate again
+    doc_info, is_duplicate = processor.save_stream(io.BytesIO(RECORDS), "fleet.json")
+    assert is_duplicate and doc_info.id == doc_id
+    processor.shutdown()
+
+
+def test_legacy_document_stays_live_for_the_legacy_model(tmp_path):
+    doc_id = add_legacy_document(tmp_path)
+    processor = make_processor(tmp_path, LEGACY_COLLECTION_NAME)
+
+    assert processor.claim_for_reembedding() == []
+    doc_info, is_duplicate = processor.save_stream(io.BytesIO(RECORDS), "fleet.json")
+    assert is_duplicate and doc_info.id == doc_id
+    processor.shutdown()